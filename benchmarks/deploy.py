@@ -0,0 +1,309 @@
+"""
+S3lify deploy benchmark
+
+Deploys synthetic build trees of 1k, 10k and 100k files to a local S3
+stand-in, and measures each phase: upload, create manifest, sync with
+nothing changed, sync with 1% of the files changed, cloudfront
+invalidation of all the files, and purge.
+For each phase it reports the wall time, files/s, MB/s, the peak RSS of the
+process so far, and the number of AWS API calls.
+
+By default the AWS services are mocked in process with moto, so the RSS
+includes the objects stored by moto. With --endpoint-url, the calls go to a
+moto server instead, ie: started with `moto_server -p 5000`.
+
+    python benchmarks/deploy.py [--sizes 1000,10000,100000] [--concurrency 10]
+                                [--endpoint-url http://127.0.0.1:5000]
+                                [--compare results/<file>.json] [--no-save]
+
+Each size runs in its own process. The results are saved in
+benchmarks/results/, and compared with the previous results file.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import glob
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import threading
+import subprocess
+import collections
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+DOMAIN = "bench.example.com"
+
+# File types of a typical build: (extension, weight, median size)
+FILE_TYPES = [
+    (".js", 25, 4 * 1024),
+    (".css", 10, 3 * 1024),
+    (".html", 10, 2 * 1024),
+    (".json", 5, 1024),
+    (".svg", 10, 2 * 1024),
+    (".map", 5, 8 * 1024),
+    (".png", 15, 16 * 1024),
+    (".jpg", 15, 24 * 1024),
+    (".woff2", 5, 20 * 1024),
+]
+SIZE_SIGMA = 1.0
+MAX_FILE_SIZE = 8 * 1024 * 1024
+
+# Share of the files changed for the 'sync changed' phase
+CHANGED_RATIO = 0.01
+
+
+class ApiCalls(object):
+    """
+    Count the AWS API calls, from the botocore 'before-call' event
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, model, **kwargs):
+        with self._lock:
+            self.counts["%s.%s" % (model.service_model.service_name, model.name)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return collections.Counter(self.counts)
+
+
+def make_tree(build_dir, files, seed=0):
+    """
+    Write a build tree of `files` files, with sizes following a log-normal
+    distribution by file type, about 20 files per directory
+    :return: int - the total size
+    """
+    rnd = random.Random(seed)
+    # As random.randbytes, which needs python 3.9
+    block = rnd.getrandbits(MAX_FILE_SIZE * 8).to_bytes(MAX_FILE_SIZE, "little")
+    extensions = [t[0] for t in FILE_TYPES]
+    weights = [t[1] for t in FILE_TYPES]
+    medians = dict((t[0], t[2]) for t in FILE_TYPES)
+    total = 0
+    for i in range(files):
+        ext = rnd.choices(extensions, weights)[0]
+        size = min(MAX_FILE_SIZE, int(rnd.lognormvariate(math.log(medians[ext]), SIZE_SIGMA)))
+        directory = os.path.join(build_dir, "d%02d" % (i // 400 % 50), "d%02d" % (i // 20 % 20))
+        if i % 20 == 0:
+            os.makedirs(directory, exist_ok=True)
+        offset = rnd.randrange(MAX_FILE_SIZE - size + 1)
+        with open(os.path.join(directory, "f%06d%s" % (i, ext)), "wb") as f:
+            f.write(b"%d" % i)
+            f.write(block[offset:offset + size])
+        total += size
+    return total
+
+
+def change_files(build_dir, ratio, seed=1):
+    """
+    Append to a share of the files
+    :return: tuple (files changed, their total size)
+    """
+    rnd = random.Random(seed)
+    paths = sorted(glob.glob(os.path.join(build_dir, "*", "*", "*")))
+    changed = rnd.sample(paths, max(1, int(len(paths) * ratio)))
+    for path in changed:
+        with open(path, "ab") as f:
+            f.write(b"changed")
+    return len(changed), sum(os.path.getsize(p) for p in changed)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux, and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
+
+
+def run_phase(name, fn, files, size, api_calls, results):
+    before = api_calls.snapshot()
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    calls = api_calls.snapshot()
+    calls.subtract(before)
+    calls = dict((k, v) for k, v in sorted(calls.items()) if v)
+    results.append({
+        "phase": name,
+        "files": files,
+        "bytes": size,
+        "wall_s": round(elapsed, 3),
+        "files_per_s": round(files / elapsed, 1) if elapsed else None,
+        "mb_per_s": round(size / 1048576.0 / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "api_calls": sum(calls.values()),
+        "api_calls_by_operation": calls,
+    })
+    print("  %-16s %8.2fs %10s files/s %8s MB/s %8.1fMB RSS %7s calls" % (
+        name, elapsed, results[-1]["files_per_s"], results[-1]["mb_per_s"],
+        results[-1]["peak_rss_mb"], results[-1]["api_calls"]), file=sys.stderr)
+
+
+def bench_size(files, concurrency):
+    """
+    Run all the phases for a tree of `files` files
+    :return: list of dict - the results of the phases
+    """
+    import boto3
+    sys.path.insert(0, ROOT)
+    from s3lify import S3lify
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    api_calls = ApiCalls()
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register("before-call", api_calls)
+
+    work_dir = tempfile.mkdtemp(prefix="s3lify-bench-")
+    build_dir = os.path.join(work_dir, "build")
+    results = []
+    try:
+        start = time.time()
+        total = make_tree(build_dir, files)
+        print("  %-16s %8.2fs %s files, %.1fMB" % ("build tree", time.time() - start,
+                                                   files, total / 1048576.0), file=sys.stderr)
+
+        client = S3lify(DOMAIN, upload_concurrency=concurrency,
+                        cache_dir=os.path.join(work_dir, ".s3lify"))
+        client.s3_create_site()
+        client._acm.request_certificate(DomainName=DOMAIN, ValidationMethod="DNS")
+        client.cloudfront_create_distribution()
+        keys = []
+
+        def upload():
+            result = client.s3_upload(build_dir)
+            if not result.ok:
+                raise Exception("%s files failed to upload" % len(result.failed))
+            keys.extend(result.succeeded)
+
+        def sync():
+            result = client.s3_sync(build_dir, delete=True, exclude_files=[])
+            if not result.ok:
+                raise Exception("%s files failed to upload" % len(result.upload.failed))
+
+        run_phase("upload", upload, files, total, api_calls, results)
+        run_phase("create_manifest", client.s3_create_manifest, files, 0, api_calls, results)
+        run_phase("sync_unchanged", sync, files, total, api_calls, results)
+        changed, changed_size = change_files(build_dir, CHANGED_RATIO)
+        run_phase("sync_changed", sync, changed, changed_size, api_calls, results)
+        run_phase("invalidate", lambda: client.cloudfront_invalidate_objects(keys=keys),
+                  files, 0, api_calls, results)
+        run_phase("purge", lambda: client.s3_purge_files(exclude_files=[]),
+                  files, 0, api_calls, results)
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def run_child(files, concurrency, endpoint_url):
+    if endpoint_url:
+        os.environ["AWS_ENDPOINT_URL"] = endpoint_url
+        return bench_size(files, concurrency)
+    from moto import mock_aws
+    with mock_aws():
+        return bench_size(files, concurrency)
+
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def latest_results():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), key=os.path.getmtime)
+    return paths[-1] if paths else None
+
+
+def compare(results, previous):
+    """
+    Print the wall time and API calls changes from previous results
+    """
+    before = dict(((r["files_total"], r["phase"]), r) for r in previous["phases"])
+    print("")
+    print("Compared with %s (%s)" % (previous["version"], previous["date"]))
+    print("%8s %-16s %12s %12s" % ("files", "phase", "wall", "api calls"))
+    for r in results:
+        prev = before.get((r["files_total"], r["phase"]))
+        if not prev:
+            continue
+        wall = (r["wall_s"] - prev["wall_s"]) / prev["wall_s"] * 100 if prev["wall_s"] else 0
+        print("%8s %-16s %+11.1f%% %+12d" % (r["files_total"], r["phase"], wall,
+                                             r["api_calls"] - prev["api_calls"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="S3lify deploy benchmark")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated numbers of files")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--endpoint-url", help="a moto server, instead of mocking in process")
+    parser.add_argument("--compare", help="results file to compare with. Default: the latest")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        results = run_child(options.child, options.concurrency, options.endpoint_url)
+        print(json.dumps(results))
+        return
+
+    previous = options.compare or latest_results()
+    results = []
+    for files in [int(s) for s in options.sizes.split(",")]:
+        print("%s files" % files, file=sys.stderr)
+        args = [sys.executable, os.path.abspath(__file__), "--child", str(files),
+                "--concurrency", str(options.concurrency)]
+        if options.endpoint_url:
+            args += ["--endpoint-url", options.endpoint_url]
+        output = subprocess.check_output(args).decode()
+        for phase in json.loads(output.strip().splitlines()[-1]):
+            phase["files_total"] = files
+            results.append(phase)
+
+    print("")
+    print("%8s %-16s %9s %11s %9s %10s %9s" % ("files", "phase", "wall", "files/s",
+                                               "MB/s", "peak RSS", "api calls"))
+    for r in results:
+        print("%8s %-16s %8.2fs %11s %9s %8.1fMB %9s" % (
+            r["files_total"], r["phase"], r["wall_s"], r["files_per_s"], r["mb_per_s"],
+            r["peak_rss_mb"], r["api_calls"]))
+
+    if previous:
+        with open(previous) as f:
+            compare(results, json.load(f))
+
+    if not options.no_save:
+        data = {
+            "version": git_version(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": sys.version.split()[0],
+            "concurrency": options.concurrency,
+            "endpoint_url": options.endpoint_url,
+            "phases": results,
+        }
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        path = os.path.join(RESULTS_DIR, "deploy-%s-%s.json" % (
+            time.strftime("%Y%m%d-%H%M%S", time.gmtime()), data["version"]))
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+        print("")
+        print("Results saved in %s" % os.path.relpath(path, ROOT))
+
+
+if __name__ == "__main__":
+    main()
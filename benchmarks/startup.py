@@ -0,0 +1,152 @@
+"""
+S3lify startup benchmark
+
+Measures the time `s3lify --help` and `s3lify init` take, minus the time of
+a bare python interpreter, and checks that the heavy modules are not
+imported by them.
+With moto installed, it also checks that a `distribution: s3` deploy only
+creates the S3 client.
+
+    python benchmarks/startup.py [--runs 10] [--budget-ms 100]
+
+Exits with 1 when a command goes over the budget.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["boto3", "botocore", "tldextract", "pkg_resources", "halo"]
+
+RUN_CLI = "import sys; sys.argv = ['s3lify'] + sys.argv[1:]; from s3lify.cli import main; main()"
+
+CHECK_MODULES = """
+import sys
+sys.argv = ['s3lify', '--help']
+from s3lify.cli import main
+try:
+    main()
+except SystemExit:
+    pass
+print("imported:" + ",".join(m for m in %r if m in sys.modules))
+""" % (HEAVY_MODULES,)
+
+CONFIG = """
+aws_region: us-east-1
+domain: example.com
+site_directory: ./build
+distribution: s3
+"""
+
+
+def run(args, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.time()
+    proc = subprocess.run([sys.executable] + args, cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    elapsed = time.time() - start
+    if proc.returncode != 0:
+        raise Exception("%s failed:\n%s" % (" ".join(args), proc.stderr.decode()))
+    return elapsed, proc.stdout.decode()
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def bench_command(name, args, runs, setup=None):
+    times = []
+    for _ in range(runs):
+        cwd = tempfile.mkdtemp()
+        try:
+            if setup:
+                setup(cwd)
+            times.append(run(args, cwd)[0])
+        finally:
+            shutil.rmtree(cwd)
+    return median(times)
+
+
+def write_config(cwd):
+    with open(os.path.join(cwd, "s3lify.yml"), "w") as f:
+        f.write(CONFIG)
+
+
+def check_s3_deploy_clients():
+    """
+    Sync a site with `distribution: s3` against moto, and return the
+    AWS clients that were created
+    """
+    try:
+        from moto import mock_aws
+    except ImportError:
+        return None
+    sys.path.insert(0, ROOT)
+    from s3lify import S3lify
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    build_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(build_dir, "index.html"), "w") as f:
+            f.write("<html></html>")
+        with mock_aws():
+            client = S3lify("example.com")
+            client.s3_create_site()
+            client.get_status("s3")
+            client.s3_sync(build_dir)
+            return client._clients.services
+    finally:
+        shutil.rmtree(build_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="S3lify startup benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=100)
+    options = parser.parse_args()
+
+    baseline = bench_command("python", ["-c", "pass"], options.runs)
+    results = [
+        ("s3lify --help", bench_command("help", ["-c", RUN_CLI, "--help"],
+                                        options.runs, setup=write_config)),
+        ("s3lify init", bench_command("init", ["-c", RUN_CLI, "init"], options.runs)),
+    ]
+
+    ok = True
+    print("python startup: %.1fms" % (baseline * 1000))
+    for name, elapsed in results:
+        overhead = (elapsed - baseline) * 1000
+        over = overhead > options.budget_ms
+        ok = ok and not over
+        print("%-15s %.1fms (+%.1fms) %s" % (name, elapsed * 1000, overhead,
+                                           "OVER BUDGET" if over else "OK"))
+
+    cwd = tempfile.mkdtemp()
+    try:
+        write_config(cwd)
+        imported = run(["-c", CHECK_MODULES], cwd)[1].strip().splitlines()[-1][len("imported:"):]
+    finally:
+        shutil.rmtree(cwd)
+    print("heavy modules imported by --help: %s" % (imported or "none"))
+    ok = ok and not imported
+
+    clients = check_s3_deploy_clients()
+    if clients is None:
+        print("s3 deploy clients: skipped (moto is not installed)")
+    else:
+        print("s3 deploy clients: %s" % ", ".join(clients))
+        ok = ok and clients == ["s3"]
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,30 @@
 
 import re
-import yaml
 import time
-import boto3
-import botocore
 import json
 import os
-import threading
-import uuid
-import tempfile
 import mimetypes
-import tldextract
+import contextlib
+from . import manifest
+from .hashcache import HashCache, file_md5
+from .lookupcache import LookupCache
+from .clients import ClientPool
+from .headers import HeaderPolicy
+from .walker import walk_files, prefetch, IgnoreRules, DEFAULT_IGNORE_FILES
+from .throttle import AdaptiveLimiter, parse_rate
+from .journal import Journal
+from .waiters import wait_until, DEFAULT_TIMEOUT
 
 NAME = "S3lify"
 CWD = os.getcwd()
 
 MANIFEST_FILE = ".s3lify.manifest"
 
+# With releases, each deploy is uploaded in its own directory of the bucket,
+# under this one. Its name is not one a site would use
+DEFAULT_RELEASES_PREFIX = ".s3lify-releases/"
+DEFAULT_KEEP_RELEASES = 5
+
 MIMETYPE_MAP = {
     '.js':   'application/javascript',
     '.mov':  'video/quicktime',
@@ -29,11 +37,63 @@ MIMETYPE_MAP = {
     '.ttf':  'application/x-font-truetype',
     '.otf':  'application/x-font-opentype',
     '.svg':  'image/svg+xml',
+    '.webp': 'image/webp',
 }
 MIMETYPE_DEFAULT = 'application/octet-stream'
 
+# Number of files uploaded at the same time
+DEFAULT_UPLOAD_CONCURRENCY = 10
+
+# With 'upload_concurrency: auto', the requests in flight start at the
+# default and grow up to this, as long as S3 does not throttle
+AUTO_UPLOAD_CONCURRENCY = "auto"
+AUTO_MAX_UPLOAD_CONCURRENCY = 64
+
+# Max number of uploads submitted ahead of the workers, per worker
+UPLOAD_QUEUE_FACTOR = 4
+
+# Max number of paths sent in one cloudfront invalidation, before collapsing
+# them into wildcards. Cloudfront allows 15 wildcard paths in progress
+DEFAULT_INVALIDATION_MAX_PATHS = 15
+CLOUDFRONT_MAX_WILDCARD_PATHS = 15
+
+# Max number of keys S3 deletes in one request, and attempts to delete them
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_MAX_ATTEMPTS = 5
+
+# Backoff between the attempts, in seconds
+S3_RETRY_BASE_DELAY = 0.5
+S3_RETRY_MAX_DELAY = 10
+
+# S3 errors worth retrying, for the whole request or a single key
+S3_RETRY_ERROR_CODES = ["SlowDown", "InternalError", "ServiceUnavailable",
+                        "RequestTimeout", "Throttling", "500", "503"]
+
 CLOUDFRONT_ZONE_ID = 'Z2FDTNDATAQYW2'
 
+# Default TTLs of the cloudfront cache, in seconds
+CLOUDFRONT_DEFAULT_TTL = 86400
+CLOUDFRONT_MAX_TTL = 31536000
+
+# Parts of the distribution config managed by the 'cloudfront' settings.
+# Origins, aliases and certificate are left as they are
+CLOUDFRONT_MANAGED_CONFIG = ["PriceClass", "DefaultRootObject", "DefaultCacheBehavior",
+                             "CacheBehaviors", "CustomErrorResponses"]
+
+# With releases, S3 redirects '/docs' to '/<releases_prefix><id>/docs/',
+# the release directory being the origin path. This function, run on the
+# responses, takes the release directory out of the redirects
+CLOUDFRONT_RELEASES_FUNCTION = """function handler(event) {
+    var response = event.response;
+    var location = response.headers.location;
+    if (location) {
+        location.value = location.value.replace(/^(?:https?:\\/\\/[^\\/]+)?\\/%s[^\\/]+\\//, "/");
+    }
+    return response;
+}
+"""
+CLOUDFRONT_FUNCTION_RUNTIME = "cloudfront-js-2.0"
+
 S3_HOSTED_ZONE_IDS = {
     'us-east-1': 'Z3AQBSTGFYJSTF',
     'us-west-1': 'Z2F56UZL2M1ACD',
@@ -50,15 +110,23 @@ S3_HOSTED_ZONE_IDS = {
 }
 
 
+_mimetypes_by_ext = {}
+
+
 def get_mimetype(filename):
-    mimetype, _ = mimetypes.guess_type(filename)
-    if mimetype:
-        return mimetype
-    base, ext = os.path.splitext(filename)
-    ext = ext.lower()
-    if ext in MIMETYPE_MAP:
-        return MIMETYPE_MAP[ext]
-    return MIMETYPE_DEFAULT
+    """
+    Return the mimetype of a file, from its extension. Cached by extension
+    :param filename: str
+    :return: str
+    """
+    ext = os.path.splitext(filename)[1]
+    mimetype = _mimetypes_by_ext.get(ext)
+    if mimetype is None:
+        mimetype, _ = mimetypes.guess_type("file" + ext)
+        if not mimetype:
+            mimetype = MIMETYPE_MAP.get(ext.lower(), MIMETYPE_DEFAULT)
+        _mimetypes_by_ext[ext] = mimetype
+    return mimetype
 
 
 def chunk_list(items, size):
@@ -72,13 +140,298 @@ def chunk_list(items, size):
     return [items[i:i + size] for i in range(0, len(items), size)]
 
 
+def record_keys(record):
+    """
+    Return the S3 keys of a manifest record: its own, and the ones of its
+    variants, ie: the WebP image
+    :param record: dict
+    :return: list
+    """
+    return [record["key"]] + (record.get("variants") or [])
+
+
+_tld_extract = None
+
+
 def extract_domain(url):
-    d = tldextract.extract(url)
+    global _tld_extract
+    if _tld_extract is None:
+        # tldextract is slow to import, and would fetch the public suffix
+        # list online. Its bundled snapshot is enough to find the domain
+        import tldextract
+        _tld_extract = tldextract.TLDExtract(suffix_list_urls=())
+    d = _tld_extract(url)
     return '.'.join([d.domain, d.suffix])
 
+def exclude_matcher(patterns):
+    """
+    Return the matcher of the S3 keys of the files excluded by patterns,
+    ie: '/index.html', '*.txt', 'static/'. See s3lify.patterns.
+    A plain name, without '/' or wildcard, is the key at the root, as
+    exclusions always were: 'index.html' doesn't exclude 'docs/index.html'
+    :param patterns: list of str
+    :return: callable - takes a key, returns bool
+    """
+    rules = IgnoreRules([_anchor_plain_name(p) for p in patterns or []])
+    if not rules:
+        return lambda key: False
+    return rules.match_file
+
+def _anchor_plain_name(pattern):
+    """
+    Return a pattern, anchored to the root if it's a plain name
+    :param pattern: str
+    :return: str
+    """
+    pattern = str(pattern).strip()
+    if pattern and pattern[0] not in "!#" and not any(c in pattern for c in "/*?[\\"):
+        return "/" + pattern
+    return pattern
+
+def upload_concurrency_limits(upload_concurrency):
+    """
+    Return the max and starting number of S3 requests in flight
+    :param upload_concurrency: int, or 'auto'
+    :return: tuple (int, int)
+    """
+    if str(upload_concurrency).lower() == AUTO_UPLOAD_CONCURRENCY:
+        return AUTO_MAX_UPLOAD_CONCURRENCY, DEFAULT_UPLOAD_CONCURRENCY
+    concurrency = max(1, int(upload_concurrency or DEFAULT_UPLOAD_CONCURRENCY))
+    return concurrency, concurrency
+
+def make_release_id():
+    """
+    Return a new release id, from the current UTC time to the microsecond,
+    so they sort by date and deploys close to each other get their own
+    :return: str
+    """
+    now = time.time()
+    return "%s-%06d" % (time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)), (now % 1) * 1000000)
+
+def release_prefix(release_id, releases_prefix=DEFAULT_RELEASES_PREFIX):
+    """
+    Return the directory of a release in the bucket
+    :param release_id: str
+    :param releases_prefix: str - the directory of the releases
+    :return: str
+    """
+    return "%s%s/" % (releases_prefix, release_id)
+
 def caller_reference_uuid():
+    import uuid
     return str(uuid.uuid4())
 
+
+def file_multipart_etag(local_path, chunksize=None):
+    """
+    Return the ETag S3 gives to a file uploaded in parts of `chunksize`:
+    the md5 of the parts md5, followed by the number of parts
+    :param local_path: str
+    :param chunksize: int - Default: the part size used by the uploads
+    :return: str
+    """
+    import hashlib
+    from .transfer import multipart_chunksize
+    chunksize = chunksize or multipart_chunksize(os.path.getsize(local_path))
+    digests = []
+    with open(local_path, "rb") as f:
+        for block in iter(lambda: f.read(chunksize), b""):
+            digests.append(hashlib.md5(block).digest())
+    return "%s-%s" % (hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+
+def invalidation_paths(keys, max_paths=DEFAULT_INVALIDATION_MAX_PATHS, index_file="index.html"):
+    """
+    Return the cloudfront paths to invalidate for a list of S3 keys.
+    An index file also invalidates its directory, ie: 'dir/index.html' gives
+    '/dir/index.html' and '/dir/'.
+    When there are more than `max_paths` paths, the deepest directories
+    are collapsed into wildcards, ie: '/dir/*', up to '/*'
+    :param keys: list of S3 keys
+    :param max_paths: int
+    :param index_file: str
+    :return: list
+    """
+    from urllib.parse import quote
+    paths = set()
+    for key in keys:
+        path = "/" + quote(key.lstrip("/"), safe="/~!$&'()+,;=:@")
+        paths.add(path)
+        if path == "/" + index_file or path.endswith("/" + index_file):
+            paths.add(path[:-len(index_file)])
+
+    max_paths = max(1, max_paths)
+    depth = max([_invalidation_path_dir(p).count("/") - 1 for p in paths] or [0])
+    while len(paths) > max_paths and depth >= 0:
+        # Collapse the directories of the deepest level first, biggest first
+        groups = {}
+        for p in paths:
+            parts = _invalidation_path_dir(p).strip("/").split("/")
+            if depth == 0 or len(parts) >= depth and parts[0]:
+                prefix = "/".join(parts[:depth])
+                groups.setdefault("/%s/" % prefix if prefix else "/", []).append(p)
+        for prefix, items in sorted(groups.items(), key=lambda g: -len(g[1])):
+            if len(items) < 2 or len(paths) <= max_paths:
+                break
+            paths.difference_update(items)
+            paths.add(prefix + "*")
+        depth -= 1
+
+    if len([p for p in paths if p.endswith("*")]) > CLOUDFRONT_MAX_WILDCARD_PATHS:
+        return ["/*"]
+    return sorted(paths)
+
+
+def _invalidation_path_dir(path):
+    """
+    Return the directory of an invalidation path, with a trailing slash
+    ie: '/a/b/c.html' -> '/a/b/', '/a/b/' -> '/a/b/', '/a/b/*' -> '/a/b/'
+    """
+    path = path.rstrip("*")
+    return path[:path.rfind("/") + 1]
+
+
+def is_file_changed(local_path, size, etag, hash_cache=None):
+    """
+    Check a local file against the size and ETag of its S3 object
+    :param local_path: str
+    :param size: int - the size of the S3 object
+    :param etag: str - the ETag of the S3 object, or the md5 of its content
+    :param hash_cache: HashCache - to not hash again files that haven't changed
+    :return: bool
+    """
+    if os.path.getsize(local_path) != size:
+        return True
+    if "-" in etag:
+        return file_multipart_etag(local_path) != etag
+    return _file_md5(local_path, hash_cache) != etag
+
+
+def _file_md5(local_path, hash_cache=None):
+    return hash_cache.md5(local_path) if hash_cache else file_md5(local_path)
+
+
+class UploadResult(object):
+    """
+    Aggregated result of an upload run
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.records = []
+        self.bytes = 0
+        # Bytes less uploaded, thanks to the image optimization
+        self.bytes_saved = 0
+        self.elapsed = 0.0
+        # Files already uploaded by the interrupted deploy being resumed
+        self.resumed = 0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return "<UploadResult succeeded=%s failed=%s bytes=%s elapsed=%.2fs>" % \
+               (len(self.succeeded), len(self.failed), self.bytes, self.elapsed)
+
+
+class DeleteResult(object):
+    """
+    Aggregated result of a deletion
+    """
+
+    def __init__(self):
+        self.deleted = []
+        self.failed = []
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return "<DeleteResult deleted=%s failed=%s elapsed=%.2fs>" % \
+               (len(self.deleted), len(self.failed), self.elapsed)
+
+
+class SyncResult(object):
+    """
+    Result of a sync: what has been uploaded, deleted or left untouched
+    """
+
+    def __init__(self, upload, delete, unchanged):
+        self.upload = upload
+        self.delete = delete
+        self.unchanged = unchanged
+
+    @property
+    def deleted(self):
+        return self.delete.deleted
+
+    @property
+    def ok(self):
+        return self.upload.ok and self.delete.ok
+
+    @property
+    def changed_keys(self):
+        """
+        Keys that differ on S3 after the sync, with the variants of the images
+        """
+        variants = [k for r in self.upload.records for k in r.get("variants") or []]
+        return self.upload.succeeded + variants + self.deleted
+
+    def __repr__(self):
+        return "<SyncResult uploaded=%s deleted=%s unchanged=%s>" % \
+               (len(self.upload.succeeded), len(self.deleted), self.unchanged)
+
+
+class ReleaseResult(object):
+    """
+    Result of a release upload: the files uploaded, and the unchanged ones
+    copied from the base release
+    """
+
+    def __init__(self, release_id, upload, copy):
+        self.release_id = release_id
+        self.upload = upload
+        self.copy = copy
+
+    @property
+    def ok(self):
+        return self.upload.ok and self.copy.ok
+
+    def __repr__(self):
+        return "<ReleaseResult %s uploaded=%s copied=%s failed=%s>" % \
+               (self.release_id, len(self.upload.succeeded), len(self.copy.succeeded),
+                len(self.upload.failed) + len(self.copy.failed))
+
+
+class SiteStatus(object):
+    """
+    Snapshot of the status of a site
+    """
+
+    def __init__(self, domain, distribution, site_exists, certificate_status=None,
+                 distribution_id=None, distribution_domain_name=None, ns_values=None,
+                 domain_url=None, s3_url=None):
+        self.domain = domain
+        self.distribution = distribution
+        self.site_exists = site_exists
+        self.certificate_status = certificate_status
+        self.distribution_id = distribution_id
+        self.distribution_domain_name = distribution_domain_name
+        self.ns_values = ns_values
+        self.domain_url = domain_url
+        self.s3_url = s3_url
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "<SiteStatus %s site_exists=%s>" % (self.domain, self.site_exists)
+
+
 class S3lify(object):
     """
     To manage S3 website and domain on Route53
@@ -89,6 +442,20 @@ class S3lify(object):
                  region="us-east-1",
                  aws_access_key_id=None,
                  aws_secret_access_key=None,
+                 upload_concurrency=DEFAULT_UPLOAD_CONCURRENCY,
+                 cache_dir=None,
+                 compress=None,
+                 lookup_cache_ttl=0,
+                 clients=None,
+                 hash_cache=None,
+                 headers=None,
+                 cloudfront_options=None,
+                 releases=False,
+                 releases_prefix=None,
+                 ignore_files=None,
+                 follow_symlinks=False,
+                 max_upload_rate=None,
+                 optimize_images=None,
                  **kwargs):
         """
 
@@ -96,6 +463,29 @@ class S3lify(object):
         :param region: the region of the site
         :param access_key_id: AWS
         :param secret_access_key: AWS
+        :param upload_concurrency: int - max number of S3 requests in flight, lowered
+                                   while S3 throttles. 'auto' to start lower and grow
+        :param cache_dir: str - directory to keep local caches, ie: the files hashes
+        :param compress: str - gzip | br, to upload text assets compressed
+        :param lookup_cache_ttl: int - seconds to keep the AWS lookups in cache_dir,
+                                 to reuse them between runs. 0 to disable
+        :param clients: ClientPool - to share the AWS clients between sites
+        :param hash_cache: HashCache - to share the files hashes between sites.
+                           Default: one in cache_dir
+        :param headers: list - the rules of the files headers, ie: Cache-Control.
+                        See HeaderPolicy
+        :param cloudfront_options: dict - the cache settings of the distribution,
+                                   see _make_cloudfront_config
+        :param releases: bool - if the site is deployed as releases. Their
+                         directory is then not part of the site
+        :param releases_prefix: str - the directory of the releases in the
+                                bucket. Default: DEFAULT_RELEASES_PREFIX
+        :param ignore_files: list - gitignore style patterns of the files not to
+                             upload. Default: DEFAULT_IGNORE_FILES
+        :param follow_symlinks: bool - to upload the content of the symlinked directories
+        :param max_upload_rate: int or str - max bytes uploaded per second, ie: '20MB'
+        :param optimize_images: bool or dict - to recompress PNG and JPEG images.
+                                dict for options: quality, webp, webp_quality
         :param setup_dns: bool - If True it will create route53
         :param allow_www: Bool - If true, it will create a second bucket with www.
         """
@@ -107,16 +497,54 @@ class S3lify(object):
             "region_name": region
         }
         self.region = region
-
-        self._s3 = boto3.client('s3', **self.aws_params)
-        self._route53 = boto3.client('route53', **self.aws_params)
-        self._cloudfront = boto3.client('cloudfront', **self.aws_params)
-        self._acm = boto3.client('acm', **self.aws_params)
-        self._route53domains = boto3.client('route53domains', **self.aws_params)
+        self.upload_concurrency, initial_concurrency = upload_concurrency_limits(upload_concurrency)
+        # Requests in flight on S3 uploads, copies and deletes, adjusted to throttling
+        self.s3_limiter = AdaptiveLimiter(self.upload_concurrency,
+                                          initial=initial_concurrency,
+                                          max_rate=parse_rate(max_upload_rate))
+        self.cache_dir = cache_dir
+        self.hash_cache = hash_cache or (HashCache(cache_dir) if cache_dir else None)
+        self.header_policy = HeaderPolicy(headers)
+        self.cloudfront_options = cloudfront_options or {}
+        self.releases = releases
+        self.releases_prefix = (releases_prefix or DEFAULT_RELEASES_PREFIX).strip("/") + "/"
+        if self.releases_prefix == "/":
+            raise Exception("Invalid releases_prefix '%s'" % releases_prefix)
+        self.ignore_rules = IgnoreRules(DEFAULT_IGNORE_FILES if ignore_files is None else ignore_files)
+        self.follow_symlinks = follow_symlinks
+        # Default directory of the caches that can't be disabled
+        if cache_dir:
+            work_dir = cache_dir
+        else:
+            import tempfile
+            work_dir = os.path.join(tempfile.gettempdir(), "s3lify")
+        # Compression and image optimization share their worker processes
+        pool = None
+        if compress or optimize_images:
+            from .processes import ProcessPool
+            pool = ProcessPool()
+        self.compressor = None
+        if compress:
+            from .compress import Compressor
+            self.compressor = Compressor(compress,
+                                         cache_dir=work_dir,
+                                         pool=pool)
+        self.image_optimizer = None
+        if optimize_images:
+            from .images import ImageOptimizer
+            options = optimize_images if isinstance(optimize_images, dict) else {}
+            self.image_optimizer = ImageOptimizer(work_dir, pool=pool, **options)
+
+        # AWS clients are created on first use
+        self._clients = clients or ClientPool()
+        # Lookups of the whole account, ie: all its distributions, shared by the sites
+        self._account_cache = self._clients.lookup_cache(self.aws_params)
+
+        # Files uploaded by the deploy in progress, when it's recorded
+        self.journal = Journal(work_dir, domain)
 
         self.domain = domain
-        self.tld_domain = extract_domain(self.domain)
-        self.set_www = self.domain == self.tld_domain
+        self._tld_domain = None
         self.s3_bucket = domain
         self.s3_bucket_www = "www." + self.domain
 
@@ -125,6 +553,63 @@ class S3lify(object):
         self.s3_url = "http://" + self.s3_domain
         self.domain_url = "http://" + self.domain
 
+        # Lookups are done once per session, and invalidated after changes
+        self._lookup_cache = LookupCache(namespace="%s:%s:%s" % (aws_access_key_id or "",
+                                                                 region, domain),
+                                         cache_dir=cache_dir,
+                                         ttl=lookup_cache_ttl)
+
+    def _client(self, service, max_pool_connections=None):
+        """
+        Return the AWS client of a service, creating it on first use.
+        boto3 clients are thread safe, once created they are shared
+        :param service: str
+        :param max_pool_connections: int - size of the client connection pool
+        :return: boto3 client
+        """
+        return self._clients.get(service, self.aws_params,
+                                  max_pool_connections=max_pool_connections)
+
+    @property
+    def metrics(self):
+        """
+        The metrics of the AWS API calls, shared by the sites sharing the clients
+        :return: Metrics
+        """
+        return self._clients.metrics
+
+    @property
+    def _s3(self):
+        # The upload workers share this client and its connection pool,
+        # which is sized to the number of workers
+        return self._client('s3', max_pool_connections=self.upload_concurrency)
+
+    @property
+    def _route53(self):
+        return self._client('route53')
+
+    @property
+    def _cloudfront(self):
+        return self._client('cloudfront')
+
+    @property
+    def _acm(self):
+        return self._client('acm')
+
+    @property
+    def _route53domains(self):
+        return self._client('route53domains')
+
+    @property
+    def tld_domain(self):
+        if self._tld_domain is None:
+            self._tld_domain = extract_domain(self.domain)
+        return self._tld_domain
+
+    @property
+    def set_www(self):
+        return self.domain == self.tld_domain
+
     @property
     def site_exists(self):
         return self.s3_get_bucket_status(self.domain)[0]
@@ -138,17 +623,64 @@ class S3lify(object):
         return self._acm_get_certificate_arn() is not None
 
     @property
-    def has_distribution_id():
+    def has_distribution_id(self):
         return self.cloudfront_get_distribution_id() is not None
 
+    def get_status(self, distribution="cloudfront"):
+        """
+        Return a snapshot of the site status.
+        The independent lookups run at the same time
+        :param distribution: s3 | route53 | cloudfront
+        :return: SiteStatus
+        """
+        lookups = {"site_exists": lambda: self.site_exists}
+        if distribution != "s3":
+            lookups["certificate_status"] = self.acm_get_certificate_status
+            lookups["distribution"] = self._cloudfront_get_distribution
+            lookups["ns_values"] = self.route53_get_ns_values
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(lookups)) as executor:
+            futures = dict((k, executor.submit(fn)) for k, fn in lookups.items())
+        values = dict((k, f.result()) for k, f in futures.items())
+
+        dist = values.get("distribution") or {}
+        return SiteStatus(domain=self.domain,
+                          distribution=distribution,
+                          site_exists=values["site_exists"],
+                          certificate_status=values.get("certificate_status"),
+                          distribution_id=dist.get("Id"),
+                          distribution_domain_name=dist.get("DomainName"),
+                          ns_values=values.get("ns_values"),
+                          domain_url=self.domain_url,
+                          s3_url=self.s3_url)
+
 # Route 53
 
+    def clear_lookup_cache(self, *names):
+        """
+        Clear the cached lookups, ie: after resources have been changed
+        outside of S3lify.
+        :param names: the lookups to clear. Default: all
+        """
+        self._lookup_cache.invalidate(*names)
+        self._account_cache.invalidate(*names)
+
     def _route53_get_hosted_zone(self):
-        hosted_zone = self._route53.list_hosted_zones()
-        if hosted_zone or "HostedZones" in hosted_zone:
-            for hz in hosted_zone["HostedZones"]:
-                if hz["Name"].rstrip(".") == self.tld_domain:
-                    return hz
+        return self._lookup_cache.get("route53_hosted_zone", self._route53_find_hosted_zone)
+
+    def _route53_find_hosted_zone(self):
+        """
+        Look up the public hosted zone of the domain. Zones are listed by
+        name from the domain, so the first ones returned are the candidates
+        """
+        name = self.tld_domain + "."
+        resp = self._route53.list_hosted_zones_by_name(DNSName=name, MaxItems="10")
+        for hz in resp.get("HostedZones", []):
+            if hz["Name"] != name:
+                break
+            if not hz.get("Config", {}).get("PrivateZone"):
+                return hz
 
     def _route53_get_hosted_zone_id(self):
         hosted_zone = self._route53_get_hosted_zone()
@@ -167,6 +699,7 @@ class S3lify(object):
                 'Comment': "HostedZone created by S3lify.py!",
                 'PrivateZone': False
             })
+        self._lookup_cache.invalidate("route53_hosted_zone", "route53_ns_values")
         return response['HostedZone']
 
     def route53_set_cname(self, name, value):
@@ -187,13 +720,27 @@ class S3lify(object):
         response = self._route53.change_resource_record_sets(
             HostedZoneId=hosted_zone["Id"],
             ChangeBatch=record)
-        return True if response and "ChangeInfo" in response else False
+        return response["ChangeInfo"]["Id"] if response and "ChangeInfo" in response else False
+
+    def route53_wait_change(self, change_id, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for a Route53 change to be propagated to all the name servers
+        :param change_id: str - as returned by the record changes
+        :param timeout: int - seconds
+        :return:
+        """
+        def is_insync():
+            return self._route53.get_change(Id=change_id)["ChangeInfo"]["Status"] == "INSYNC"
+        wait_until(is_insync, timeout=timeout, description="Route53 change %s" % change_id)
 
     def route53_get_ns_values(self):
         """
         Return a list of NS values to put in the registrar
         :return list:
         """
+        return self._lookup_cache.get("route53_ns_values", self._route53_find_ns_values)
+
+    def _route53_find_ns_values(self):
         hosted_zone_id = self._route53_get_hosted_zone_id()
         if hosted_zone_id:
             rrset = self._route53.list_resource_record_sets(HostedZoneId=hosted_zone_id)
@@ -207,16 +754,17 @@ class S3lify(object):
         If using route53domains as the registrar, it will update 
         the registrar DNS to reflect the route 53 values.
         """
+        from botocore.exceptions import ClientError
         try:
-            nameservers = self.route53_get_ns_values()
-            nameservers2 = [n.rstrip('.') for n in self.route53_get_ns_values()]
+            nameservers = self.route53_get_ns_values() or []
+            nameservers2 = [n.rstrip('.') for n in nameservers]
 
             rdomain = self._route53domains.get_domain_detail(DomainName=self.tld_domain)
             rdNS = [d["Name"].rstrip('.') for d in rdomain["Nameservers"]]
 
             # The name servers don't match, attempt to update it.
             if bool(set(nameservers2) & set(rdNS)) is False:
-                Nameservers = [{"Name": k} for k in self.route53_get_ns_values()]
+                Nameservers = [{"Name": k} for k in nameservers]
                 response = self._route53domains.update_domain_nameservers(
                     DomainName=self.tld_domain,
                     Nameservers=Nameservers
@@ -224,7 +772,7 @@ class S3lify(object):
                 if response and response["OperationId"]:
                     return True
 
-        except botocore.exceptions.ClientError as e:
+        except ClientError as e:
             if e.response["Error"]["Code"] in ["InvalidInput"]:
                 return False, 404, e.response["Error"]["Message"]
             return False
@@ -266,64 +814,360 @@ class S3lify(object):
         response = self._route53.change_resource_record_sets(
             HostedZoneId=hosted_zone["Id"],
             ChangeBatch=change_batch_payload)
-        return True if response and "ChangeInfo" in response else False
+        return response["ChangeInfo"]["Id"] if response and "ChangeInfo" in response else False
 
 # Cloudfront
 
-    def cloudfront_create_distribution(self):
+    def cloudfront_create_distribution(self, origin_path=""):
         """
         To create a distribution in cloudfront
+        :param origin_path: str - the directory of the bucket to serve, ie: '/.s3lify-releases/<id>'
         """
         # Automatically pick the distribution_id
         distribution_id = self.cloudfront_get_distribution_id()
         if not distribution_id:
             arn = self._acm_get_certificate_arn()
             if arn:
-                dist_config = _make_cloudfront_config(domain_name=self.domain, ssl_arn=arn, s3_domain=self.s3_domain)
+                dist_config = _make_cloudfront_config(domain_name=self.domain, ssl_arn=arn,
+                                                      s3_domain=self.s3_domain, origin_path=origin_path,
+                                                      options=self.cloudfront_options,
+                                                      function_arn=self._cloudfront_get_function_arn())
                 res = self._cloudfront.create_distribution(DistributionConfig=dist_config)
+                self._lookup_cache.invalidate("cloudfront_distribution")
+                self._account_cache.invalidate("cloudfront_origin_index")
                 return res
 
+    def cloudfront_update_distribution(self):
+        """
+        Update the cache settings of the distribution (price class, cache
+        behaviors, error responses) to the ones of cloudfront_options.
+        The distribution is only updated if they have changed
+        :return: list - the parts of the config updated
+        """
+        distribution_id = self.cloudfront_get_distribution_id()
+        if not distribution_id:
+            return []
+        resp = self._cloudfront.get_distribution_config(Id=distribution_id)
+        live = resp["DistributionConfig"]
+        desired = _make_cloudfront_config(domain_name=self.domain, ssl_arn=None,
+                                          s3_domain=self.s3_domain, options=self.cloudfront_options,
+                                          function_arn=self._cloudfront_get_function_arn())
+        changed = [k for k in CLOUDFRONT_MANAGED_CONFIG if not _config_matches(desired[k], live.get(k))]
+        if not changed:
+            return []
+
+        config = _merge_config(live, dict((k, desired[k]) for k in changed))
+        # A behavior has either a cache policy, or its own TTLs
+        behavior = config["DefaultCacheBehavior"]
+        if "CachePolicyId" in desired["DefaultCacheBehavior"]:
+            for k in ["ForwardedValues", "MinTTL", "DefaultTTL", "MaxTTL"]:
+                behavior.pop(k, None)
+        else:
+            behavior.pop("CachePolicyId", None)
+        self._cloudfront.update_distribution(Id=distribution_id,
+                                             IfMatch=resp["ETag"],
+                                             DistributionConfig=config)
+        return changed
+
+    def cloudfront_get_releases_function(self):
+        """
+        Return the ARN of the cloudfront function fixing the redirects of the
+        releases, see CLOUDFRONT_RELEASES_FUNCTION. It is created, or updated,
+        and published if needed
+        :return: str
+        """
+        from botocore.exceptions import ClientError
+        name = re.sub(r"[^A-Za-z0-9_-]", "-", "s3lify-releases-%s" % self.domain)[:64]
+        code = _make_releases_function_code(self.releases_prefix)
+        try:
+            live = self._cloudfront.get_function(Name=name, Stage="LIVE")
+            if live["FunctionCode"].read() == code:
+                resp = self._cloudfront.describe_function(Name=name, Stage="LIVE")
+                return resp["FunctionSummary"]["FunctionMetadata"]["FunctionARN"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchFunctionExists":
+                raise e
+        config = {"Comment": "s3lify releases redirects", "Runtime": CLOUDFRONT_FUNCTION_RUNTIME}
+        try:
+            etag = self._cloudfront.describe_function(Name=name)["ETag"]
+            etag = self._cloudfront.update_function(Name=name, IfMatch=etag, FunctionConfig=config,
+                                                    FunctionCode=code)["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchFunctionExists":
+                raise e
+            etag = self._cloudfront.create_function(Name=name, FunctionConfig=config,
+                                                    FunctionCode=code)["ETag"]
+        resp = self._cloudfront.publish_function(Name=name, IfMatch=etag)
+        return resp["FunctionSummary"]["FunctionMetadata"]["FunctionARN"]
+
+    def _cloudfront_get_function_arn(self):
+        """
+        Return the function of the behaviors of the distribution, if any
+        :return: str, or None
+        """
+        if self.releases:
+            return self.cloudfront_get_releases_function()
+        return None
+
     def cloudfront_update_route53_a_records(self):
         """
         Update the A records with the cloudfront domain, so it can use the SSL
+        :return: str - the Route53 change id
         """
         domain = self.cloudfront_get_distribution_domain_name()
         if domain:
-            self._route53_update_a_records(domain, CLOUDFRONT_ZONE_ID)
+            return self._route53_update_a_records(domain, CLOUDFRONT_ZONE_ID)
+
+    def cloudfront_wait_deployed(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for the distribution to be deployed on all the edge locations
+        :param timeout: int - seconds
+        :return:
+        """
+        distribution_id = self.cloudfront_get_distribution_id()
+        if distribution_id:
+            def is_deployed():
+                dist = self._cloudfront.get_distribution(Id=distribution_id)
+                return dist["Distribution"]["Status"] == "Deployed"
+            wait_until(is_deployed, timeout=timeout,
+                       description="distribution %s to be deployed" % distribution_id)
 
     def cloudfront_get_distribution_id(self):
-        distribution_id = None
-        dists = self._cloudfront.list_distributions()
-        items = dists['DistributionList']["Items"]
-        for item in items:
-            for i in item["Origins"]["Items"]:
-                if self.s3_domain == i['DomainName']:
-                    return item['Id']
+        dist = self._cloudfront_get_distribution()
+        if dist:
+            return dist['Id']
 
     def cloudfront_get_distribution_domain_name(self):
-        distribution_id = None
-        dists = self._cloudfront.list_distributions()
-        items = dists['DistributionList']["Items"]
-        for item in items:
-            for i in item["Origins"]["Items"]:
-                if self.s3_domain == i['DomainName']:
-                    return item['DomainName']
-
-    def cloudfront_invalidate_objects(self):
+        dist = self._cloudfront_get_distribution()
+        if dist:
+            return dist['DomainName']
+
+    def _cloudfront_get_distribution(self):
+        """
+        Return the distribution with the S3 site as origin
+        :return: dict - Id, DomainName, ARN
+        """
+        return self._lookup_cache.get("cloudfront_distribution", self._cloudfront_find_distribution)
+
+    def _cloudfront_find_distribution(self):
+        return self._cloudfront_get_origin_index().get(self.s3_domain)
+
+    def _cloudfront_get_origin_index(self):
+        """
+        Return all the distributions of the account, by origin domain name.
+        Built once per run, for all the sites of the account
+        :return: dict - {origin_domain: {Id, DomainName, ARN}}
+        """
+        return self._account_cache.get("cloudfront_origin_index",
+                                       self._cloudfront_build_origin_index)
+
+    def _cloudfront_build_origin_index(self):
+        index = {}
+        paginator = self._cloudfront.get_paginator("list_distributions")
+        for page in paginator.paginate():
+            for item in page["DistributionList"].get("Items", []):
+                dist = dict((k, item[k]) for k in ["Id", "DomainName", "ARN"])
+                for origin in item["Origins"]["Items"]:
+                    index.setdefault(origin["DomainName"], dist)
+        return index
+
+    def cloudfront_invalidate_objects(self, keys=None,
+                                      max_paths=DEFAULT_INVALIDATION_MAX_PATHS,
+                                      index_file="index.html"):
+        """
+        Invalidate cloudfront objects
+        :param keys: list - the S3 keys that have changed. If None, everything is invalidated
+        :param max_paths: int - the max number of paths before collapsing them into wildcards
+        :param index_file: str
+        :return: str - the invalidation id, or None if nothing was invalidated
+        """
+        if keys is None:
+            paths = ["/*"]
+        else:
+            paths = invalidation_paths(keys, max_paths=max_paths, index_file=index_file)
+        if not paths:
+            return None
+
         distribution_id = self.cloudfront_get_distribution_id()
         if distribution_id:
             response = self._cloudfront.create_invalidation(
                 DistributionId=distribution_id,
                 InvalidationBatch={
                     'Paths': {
-                        'Quantity': 1,
-                        'Items': [
-                            '/*',
-                        ]
+                        'Quantity': len(paths),
+                        'Items': paths
                     },
                     'CallerReference': caller_reference_uuid()
                 }
             )
+            return response["Invalidation"]["Id"]
+
+    def cloudfront_wait_invalidation(self, invalidation_id, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for an invalidation to be completed
+        :param invalidation_id: str
+        :param timeout: int - seconds
+        :return:
+        """
+        distribution_id = self.cloudfront_get_distribution_id()
+        if distribution_id and invalidation_id:
+            def is_completed():
+                resp = self._cloudfront.get_invalidation(DistributionId=distribution_id,
+                                                         Id=invalidation_id)
+                return resp["Invalidation"]["Status"] == "Completed"
+            wait_until(is_completed, timeout=timeout,
+                       description="invalidation %s" % invalidation_id)
+
+    def cloudfront_get_origin_path(self):
+        """
+        Return the directory of the bucket the distribution serves
+        :return: str - ie: '/.s3lify-releases/<id>', or '' for the whole bucket
+        """
+        distribution_id = self.cloudfront_get_distribution_id()
+        if distribution_id:
+            resp = self._cloudfront.get_distribution_config(Id=distribution_id)
+            return resp["DistributionConfig"]["Origins"]["Items"][0].get("OriginPath") or ""
+
+    def cloudfront_set_origin_path(self, origin_path, function_arn=None):
+        """
+        Point the distribution to a directory of the bucket.
+        Only the distribution config is updated, it is live once deployed
+        :param origin_path: str - ie: '/.s3lify-releases/<id>'
+        :param function_arn: str - the function to run on the responses of
+                             all the behaviors, ie: the releases one
+        :return: bool - False if it was already set
+        """
+        distribution_id = self.cloudfront_get_distribution_id()
+        if not distribution_id:
+            raise Exception("Cloudfront distribution doesn't exist for '%s'" % self.domain)
+        resp = self._cloudfront.get_distribution_config(Id=distribution_id)
+        config = resp["DistributionConfig"]
+        origin = config["Origins"]["Items"][0]
+        changed = (origin.get("OriginPath") or "") != origin_path
+        origin["OriginPath"] = origin_path
+        associated = True
+        if function_arn:
+            behaviors = [config["DefaultCacheBehavior"]] + \
+                        ((config.get("CacheBehaviors") or {}).get("Items") or [])
+            for behavior in behaviors:
+                associated = _set_function_association(behavior, function_arn) and associated
+        if changed or not associated:
+            self._cloudfront.update_distribution(Id=distribution_id,
+                                                 IfMatch=resp["ETag"],
+                                                 DistributionConfig=config)
+        return changed
+
+# Releases
+
+    def release_list(self):
+        """
+        Return the ids of the releases on S3, oldest first
+        :return: list
+        """
+        releases = []
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=self.releases_prefix, Delimiter="/"):
+            for item in page.get("CommonPrefixes", []):
+                releases.append(item["Prefix"][len(self.releases_prefix):].rstrip("/"))
+        return sorted(releases)
+
+    def release_get_live(self):
+        """
+        Return the id of the release served by the distribution
+        :return: str, or None
+        """
+        origin_path = self.cloudfront_get_origin_path() or ""
+        prefix = "/" + self.releases_prefix
+        if origin_path.startswith(prefix):
+            return origin_path[len(prefix):]
+        return None
+
+    def release_get_previous(self, release_id):
+        """
+        Return the release before another one, ie: to rollback to
+        :param release_id: str
+        :return: str, or None
+        """
+        older = [r for r in self.release_list() if r < release_id]
+        return older[-1] if older else None
+
+    def release_upload(self, build_dir, release_id=None, base_release=None):
+        """
+        Upload a site directory as a new release, in '<releases_prefix><id>/'.
+        Files unchanged since `base_release` are copied on S3 instead of
+        being uploaded again. The live site is not changed.
+        A site directory with a directory of the name of the releases one is
+        refused, as its files could be taken for releases
+        :param build_dir: The directory to upload
+        :param release_id: str - Default: a new id from the current time
+        :param base_release: str - the release to copy the unchanged files from, ie: the live one
+        :return: ReleaseResult
+        """
+        reserved = os.path.join(build_dir, *self.releases_prefix.rstrip("/").split("/"))
+        if os.path.exists(reserved):
+            raise Exception("'%s' can't be deployed as releases: '%s' is the directory of the "
+                            "releases on S3. Rename it, or set 'releases_prefix'"
+                            % (build_dir, self.releases_prefix))
+        release_id = release_id or make_release_id()
+        prefix = self._release_prefix(release_id)
+        base = {}
+        if base_release:
+            for record in self._s3_iter_manifest(prefix=self._release_prefix(base_release)):
+                if record.get("size") is not None and record.get("hash"):
+                    base[record["key"]] = record
+
+        copies = []
+
+        def changed_files():
+            for local_path, s3_path in self._walk_files(build_dir):
+                record = base.get(s3_path)
+                if record and self._is_unchanged(local_path, record):
+                    copies.append(record)
+                else:
+                    yield local_path, s3_path
+
+        upload = self._s3_upload_files(changed_files(), prefix=prefix)
+        copy = self._s3_copy_objects(copies,
+                                     from_prefix=self._release_prefix(base_release) if base_release else "",
+                                     to_prefix=prefix)
+
+        self._s3_update_manifest(upload.records + copy.records, prefix=prefix)
+        return ReleaseResult(release_id=release_id, upload=upload, copy=copy)
+
+    def release_activate(self, release_id, error_file="error.html"):
+        """
+        Make a release the live site: the bucket error document is taken from
+        the release, and the distribution origin points to its directory.
+        No object is transferred. Once the distribution is deployed, its
+        cache must be invalidated
+        :param release_id: str
+        :param error_file: str
+        :return: bool - False if the release was already live
+        """
+        if release_id not in self.release_list():
+            raise Exception("Release '%s' doesn't exist for '%s'" % (release_id, self.domain))
+        self.s3_set_error_document(self._release_prefix(release_id) + error_file)
+        return self.cloudfront_set_origin_path("/" + self._release_prefix(release_id).rstrip("/"),
+                                               function_arn=self.cloudfront_get_releases_function())
+
+    def release_prune(self, keep=DEFAULT_KEEP_RELEASES, protect=()):
+        """
+        Delete the oldest releases, to keep the `keep` most recent ones
+        :param keep: int
+        :param protect: list - releases never deleted, ie: the live one
+        :return: tuple (list of the releases deleted, DeleteResult)
+        """
+        releases = self.release_list()
+        pruned = [r for r in releases[:max(0, len(releases) - max(1, keep))]
+                  if r not in protect]
+        keys = []
+        for release_id in pruned:
+            keys.extend(self._s3_iter_keys(prefix=self._release_prefix(release_id)))
+        return pruned, self._s3_delete_keys(keys)
+
+    def _release_prefix(self, release_id):
+        return release_prefix(release_id, self.releases_prefix)
+
 # ACM
 
     def acm_generate_certificate(self):
@@ -339,19 +1183,43 @@ class S3lify(object):
                 DomainName=self.domain,
                 # SubjectAlternativeNames=SubjectAlternativeNames,
                 ValidationMethod='DNS')
-            # Pause to allow the generation of the certificate
-            time.sleep(2)
+            self._lookup_cache.invalidate("acm_certificate_arn")
+            self._account_cache.invalidate("acm_certificate_index:%s" % self.region)
             if resp:
                 return True
 
     def acm_update_route53_cname_records(self):
         """
         Update the CNAME, to validate Amazon certificate with DNS
+        :return: str - the Route53 change id
         """
         r = self._acm_get_certificate_cname_config()
         if r and r[0] is True and r[1] and r[2]:
-            self.route53_set_cname(r[1], r[2])
-            return True
+            return self.route53_set_cname(r[1], r[2])
+
+    def acm_wait_validation_records(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for a new certificate to be listed with its DNS validation records
+        :param timeout: int - seconds
+        :return:
+        """
+        wait_until(self._acm_get_certificate_cname_config, timeout=timeout,
+                   description="certificate validation records")
+
+    def acm_wait_certificate_issued(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for the certificate to be issued
+        :param timeout: int - seconds
+        :return:
+        """
+        def is_issued():
+            status = self.acm_get_certificate_status()
+            if status in ["FAILED", "REVOKED", "EXPIRED", "VALIDATION_TIMED_OUT", "INACTIVE"]:
+                raise Exception("Certificate for '%s' can't be issued. "
+                                "Status: %s" % (self.domain, status))
+            return status == "ISSUED"
+        wait_until(is_issued, timeout=timeout,
+                   description="certificate of '%s' to be issued" % self.domain)
 
     def acm_get_certificate_status(self):
         arn = self._acm_get_certificate_arn()
@@ -361,10 +1229,34 @@ class S3lify(object):
                 return cert["Certificate"]["Status"]
 
     def _acm_get_certificate_arn(self):
-        resp = self._acm.list_certificates()
-        for c in resp["CertificateSummaryList"]:
-            if self.domain == c["DomainName"]:
-                return c["CertificateArn"]
+        return self._lookup_cache.get("acm_certificate_arn", self._acm_find_certificate_arn)
+
+    def _acm_find_certificate_arn(self):
+        return self._acm_get_certificate_index().get(self.domain)
+
+    def _acm_get_certificate_index(self):
+        """
+        Return the certificates ARN of the account, by domain name.
+        An issued certificate wins over others of the same domain.
+        Built once per run, for all the sites of the account in the region
+        :return: dict
+        """
+        return self._account_cache.get("acm_certificate_index:%s" % self.region,
+                                       self._acm_build_certificate_index)
+
+    def _acm_build_certificate_index(self):
+        index = {}
+        issued = set()
+        paginator = self._acm.get_paginator("list_certificates")
+        for page in paginator.paginate():
+            for c in page["CertificateSummaryList"]:
+                domain = c["DomainName"]
+                if domain not in index or \
+                        (domain not in issued and c.get("Status") == "ISSUED"):
+                    index[domain] = c["CertificateArn"]
+                if c.get("Status") == "ISSUED":
+                    issued.add(domain)
+        return index
 
     def _acm_get_certificate_cname_config(self):
         arn = self._acm_get_certificate_arn()
@@ -374,6 +1266,9 @@ class S3lify(object):
                 for domainValidations in cert["Certificate"]["DomainValidationOptions"]:
                     if domainValidations["ValidationStatus"] == "PENDING_VALIDATION" \
                             and domainValidations["ValidationMethod"] == "DNS":
+                        # Not listed yet right after the request
+                        if "ResourceRecord" not in domainValidations:
+                            return None
                         cname_name = domainValidations["ResourceRecord"]["Name"]
                         cname_value = domainValidations["ResourceRecord"]["Value"]
                         return True, cname_name, cname_value
@@ -435,29 +1330,300 @@ class S3lify(object):
 
     def s3_upload(self, build_dir):
         """
-        Upload a site directory to S3
+        Upload a site directory to S3, with a bounded pool of workers.
+        It waits for all the uploads to be done
         :param build_dir: The directory to upload
-        :return:
+        :return: UploadResult
         """
-        files_list = []
-        for root, dirs, files in os.walk(build_dir):
-            for filename in files:
-                local_path = os.path.join(root, filename)
-                s3_path = os.path.relpath(local_path, build_dir)
-                mimetype = get_mimetype(local_path)
+        result = self._s3_upload_files(self._walk_files(build_dir))
 
-                kwargs = dict(aws_params=self.aws_params,
-                              bucket_name=self.domain,
-                              local_path=local_path,
-                              s3_path=s3_path,
-                              mimetype=mimetype)
+        # Save the files that have been uploaded
+        self._s3_update_manifest(result.records)
+        return result
 
-                files_list.append(s3_path)
-                threading.Thread(target=_s3_upload_file, kwargs=kwargs)\
-                    .start()
+    def s3_sync(self, build_dir, delete=True, exclude_files=["/index.html", "/error.html"],
+                use_manifest=True):
+        """
+        Upload only the files that are new or have changed, by comparing
+        their size and content hash with the S3 objects, then delete the
+        objects that are no longer in the site directory.
+        The S3 objects are read from the manifest, or from the bucket listing
+        when the manifest has no hashes.
+        :param build_dir: The directory to sync
+        :param delete: bool - to delete the objects that have disappeared
+        :param exclude_files: list : path patterns of the files to not delete
+        :param use_manifest: bool - False to always list the bucket
+        :return: SyncResult
+        """
+        remote, from_manifest = self._s3_get_remote_records(use_manifest=use_manifest)
+
+        records = []
+        previous = {}
+
+        # Changed files are uploaded as they are found
+        def changed_files():
+            for local_path, s3_path in self._walk_files(build_dir):
+                record = remote.pop(s3_path, None)
+                # Files of the resumed deploy are taken from the journal, to be invalidated
+                if record and not self.journal.get(s3_path) and self._is_unchanged(local_path, record):
+                    records.append(record)
+                else:
+                    if record:
+                        previous[s3_path] = record
+                    yield local_path, s3_path
+
+        upload = self._s3_upload_files(changed_files())
+        unchanged = len(records)
+        records.extend(upload.records)
+        # Failed uploads left the previous objects in place
+        records.extend(previous[k] for k, _ in upload.failed if k in previous)
+        # Variants go with their image, they are not objects of their own
+        variants = set(k for r in records for k in r.get("variants") or [])
+        for key in variants:
+            remote.pop(key, None)
+
+        # Delete after upload, so the site is never missing files
+        deletion = DeleteResult()
+        if delete:
+            is_excluded = exclude_matcher(exclude_files)
+            keys = [k for key in remote if not is_excluded(key) for k in record_keys(remote[key])]
+            # Variants the images re-uploaded no longer have
+            keys.extend(k for r in previous.values() for k in r.get("variants") or []
+                        if k not in variants)
+            deletion = self._s3_delete_keys(keys)
+        # Objects that failed to be deleted are still there
+        deleted = set(deletion.deleted)
+        records.extend(remote[k] for k in remote if k not in deleted)
+
+        # A sync that changed nothing leaves the manifest as it is
+        if upload.records or deletion.deleted or not from_manifest:
+            self._s3_update_manifest(records)
+        return SyncResult(upload=upload, delete=deletion, unchanged=unchanged)
+
+    def s3_push(self, build_dir, keys, delete=True, exclude_files=["/index.html", "/error.html"],
+                records=None):
+        """
+        Sync only some files of the site directory, ie: the ones that changed
+        since the last sync: they are uploaded, or deleted from S3 when they
+        are gone. The manifest is updated with them
+        :param build_dir: The site directory
+        :param keys: list - the paths of the files in the site
+        :param delete: bool - to delete the objects of the files that are gone
+        :param exclude_files: list : path patterns of the files to not delete
+        :param records: dict - the manifest records by key, from
+                        `s3_get_manifest_records`, updated in place. To not
+                        download the manifest on each push, ie: with `s3lify watch`
+        :return: SyncResult
+        """
+        remote = self.s3_get_manifest_records() if records is None else records
+        is_excluded = exclude_matcher(exclude_files)
+
+        files = []
+        gone = []
+        unchanged = 0
+        for key in sorted(set(keys)):
+            local_path = os.path.join(build_dir, *key.split("/"))
+            record = remote.get(key)
+            if not os.path.isfile(local_path):
+                if delete and not is_excluded(key):
+                    gone.append(key)
+            elif record and record.get("size") is not None and record.get("hash") \
+                    and self._is_unchanged(local_path, record):
+                unchanged += 1
+            else:
+                files.append((local_path, key))
+
+        upload = self._s3_upload_files(files)
+        variants = set(k for r in upload.records for k in r.get("variants") or [])
+        # The gone files with their variants, and the variants the images no longer have
+        keys = [k for key in gone for k in (record_keys(remote[key]) if key in remote else [key])]
+        keys.extend(k for r in upload.records if r["key"] in remote
+                    for k in remote[r["key"]].get("variants") or [] if k not in variants)
+        deletion = self._s3_delete_keys(keys)
+        for key in deletion.deleted:
+            remote.pop(key, None)
+        for record in upload.records:
+            remote[record["key"]] = record
+        if upload.records or deletion.deleted:
+            self._s3_update_manifest(list(remote.values()))
+        return SyncResult(upload=upload, delete=deletion, unchanged=unchanged)
+
+    def _walk_files(self, build_dir):
+        """
+        Yield the files of the site directory to upload, found by a
+        background thread, ahead of the upload
+        :param build_dir: str
+        :return: generator of tuple (local_path, s3_path)
+        """
+        return prefetch(walk_files(build_dir,
+                                   ignore=self.ignore_rules,
+                                   follow_symlinks=self.follow_symlinks))
 
-        # Save the files that have been uploaded
-        self._s3_update_manifest(files_list)
+    def _is_unchanged(self, local_path, record):
+        """
+        Check if a file is the same as an S3 object: content, encoding and headers
+        :param local_path: str
+        :param record: dict - the manifest record of the S3 object
+        :return: bool
+        """
+        return not is_file_changed(local_path, record["size"], record["hash"],
+                                   hash_cache=self.hash_cache) \
+            and not self._is_encoding_changed(local_path, record) \
+            and not self._is_image_changed(record) \
+            and (record.get("headers") or {}) == self.header_policy.headers(record["key"])
+
+    def _is_encoding_changed(self, local_path, record):
+        """
+        Check if an unchanged file would now be compressed otherwise, ie:
+        compression has been turned on or off. Files not worth compressing
+        are in the manifest with the encoding they were compressed with,
+        not the local cache, which a deploy from a new checkout doesn't have
+        :param local_path: str
+        :param record: dict - the manifest record of the S3 object
+        :return: bool
+        """
+        if not self.compressor:
+            return bool(record.get("content_encoding"))
+        compression = self.compressor.compression(get_mimetype(local_path), record["size"])
+        return compression != (record.get("compressed") or record.get("content_encoding"))
+
+    def _is_image_changed(self, record):
+        """
+        Check if an unchanged image would now be optimized with other
+        settings, or have other variants
+        :param record: dict - the manifest record of the S3 object
+        :return: bool
+        """
+        mimetype = get_mimetype(record["key"])
+        if not self.image_optimizer or not self.image_optimizer.is_optimizable(mimetype):
+            return bool(record.get("optimized") or record.get("variants"))
+        return record.get("optimized") != self.image_optimizer.settings \
+            or (record.get("variants") or []) != self.image_optimizer.variants(record["key"], mimetype)
+
+    def _s3_get_remote_records(self, use_manifest=True):
+        """
+        Return the manifest records of the S3 objects, by key.
+        From the manifest if all its records have a hash, otherwise from
+        the bucket listing, with the ETag as hash
+        :param use_manifest: bool
+        :return: tuple (dict, bool - if they are from the manifest)
+        """
+        if use_manifest:
+            records = {}
+            for record in self._s3_iter_manifest():
+                if record.get("size") is None or not record.get("hash"):
+                    records = None
+                    break
+                records[record["key"]] = record
+            if records:
+                return records, True
+        return dict((obj["Key"], _s3_object_record(obj)) for obj in self._s3_iter_objects()), False
+
+    def _s3_upload_files(self, files, prefix=""):
+        """
+        Upload files with the pool of workers, and wait for them to be done
+        :param files: iterable of tuple (local_path, s3_path)
+        :param prefix: str - the directory to upload to, ie: of a release
+        :return: UploadResult
+        """
+        from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+        from .transfer import Transfer
+        result = UploadResult()
+        start = time.time()
+        # Files are read from `files` as the uploads complete
+        max_pending = self.upload_concurrency * UPLOAD_QUEUE_FACTOR
+
+        def collect(future):
+            s3_path = futures.pop(future)
+            try:
+                record, size, saved = future.result()
+                result.bytes += size
+                result.bytes_saved += saved
+                result.succeeded.append(s3_path)
+                result.records.append(record)
+                self.journal.add(record)
+            except Exception as ex:
+                result.failed.append((s3_path, ex))
+
+        with Transfer(self._s3, self.upload_concurrency, limiter=self.s3_limiter) as transfer, \
+                self.compressor or contextlib.nullcontext(), \
+                self.image_optimizer or contextlib.nullcontext():
+            futures = {}
+            for local_path, s3_path in files:
+                record = self.journal.get(s3_path)
+                if record and self._is_unchanged(local_path, record):
+                    result.succeeded.append(s3_path)
+                    result.records.append(record)
+                    result.resumed += 1
+                    continue
+                if len(futures) >= max_pending:
+                    done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                future = transfer.submit(_s3_upload_file,
+                                         transfer=transfer,
+                                         bucket_name=self.s3_bucket,
+                                         local_path=local_path,
+                                         s3_path=s3_path,
+                                         prefix=prefix,
+                                         mimetype=get_mimetype(local_path),
+                                         headers=self.header_policy.headers(s3_path),
+                                         hash_cache=self.hash_cache,
+                                         compressor=self.compressor,
+                                         image_optimizer=self.image_optimizer)
+                futures[future] = s3_path
+
+            for future in as_completed(list(futures)):
+                collect(future)
+        result.elapsed = time.time() - start
+        if self.hash_cache:
+            self.hash_cache.save()
+        return result
+
+    def _s3_copy_objects(self, records, from_prefix, to_prefix):
+        """
+        Copy objects within the bucket, with their metadata.
+        Nothing goes through the client, S3 copies the objects itself,
+        in parts for the ones over 5GB
+        :param records: list of manifest records, of the objects to copy
+        :param from_prefix: str
+        :param to_prefix: str
+        :return: UploadResult
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from .transfer import copy_object
+        result = UploadResult()
+        start = time.time()
+
+        def copy(record):
+            # The compressed object, and the variants, are not larger than the file
+            for key in record_keys(record):
+                copy_object(self._s3, self.s3_bucket, to_prefix + key, from_prefix + key,
+                            size=record.get("size"), request=self.s3_limiter.call)
+            return record
+
+        pending = []
+        for record in records:
+            if self.journal.get(record["key"]) == record:
+                result.records.append(record)
+                result.succeeded.append(record["key"])
+                result.resumed += 1
+            else:
+                pending.append(record)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+                futures = dict((executor.submit(copy, record), record["key"]) for record in pending)
+                for future in as_completed(futures):
+                    try:
+                        record = future.result()
+                        result.records.append(record)
+                        result.succeeded.append(futures[future])
+                        self.journal.add(record)
+                    except Exception as ex:
+                        result.failed.append((futures[future], ex))
+        result.elapsed = time.time() - start
+        return result
 
     def s3_update_route53_a_records(self):
         dns_name = "s3-website-%s.amazonaws.com" % self.region
@@ -469,93 +1635,292 @@ class S3lify(object):
         :param name:
         :return: tuple (exists, error_code, error_message)
         """
+        from botocore.exceptions import ClientError
         try:
             self._s3.head_bucket(Bucket=name)
             info = self._s3.get_bucket_website(Bucket=name)
             if not info:
                 return False, 404, "Configure improrperly"
             return True, None, None
-        except botocore.exceptions.ClientError as e:
+        except ClientError as e:
             if e.response["Error"]["Code"] in ["403", "404"]:
                 return False, e.response["Error"]["Code"], e.response["Error"]["Message"]
             else:
                 raise e
 
-    def s3_purge_files(self, exclude_files=["index.html", "error.html"]):
+    def s3_set_error_document(self, key):
         """
-        To delete files that are in the manifest
-        :param excludes_files: list : files to not delete
+        Change the error document of the bucket website, ie: to the one of a release
+        :param key: str
         :return:
         """
-        for chunk in chunk_list(self._s3_get_manifest(), 1000):
-            try:
-                self._s3.delete_objects(
-                    Bucket=self.s3_bucket,
-                    Delete={
-                        'Objects': [{"Key": f} for f in chunk
-                                    if f not in exclude_files]
-                    }
-                )
-            except Exception as ex:
-                pass
+        website = self._s3.get_bucket_website(Bucket=self.s3_bucket)
+        config = dict((k, website[k]) for k in ["IndexDocument", "RoutingRules"] if k in website)
+        config["ErrorDocument"] = {"Key": key}
+        self._s3.put_bucket_website(Bucket=self.s3_bucket, WebsiteConfiguration=config)
+
+    def s3_purge_files(self, exclude_files=["/index.html", "/error.html"]):
+        """
+        To delete files that are in the manifest
+        :param excludes_files: list : path patterns of the files to not delete
+        :return: DeleteResult
+        """
+        is_excluded = exclude_matcher(exclude_files)
+        # When resuming a deploy, the files it uploaded already are kept
+        kept = set(k for r in self.journal.records.values() for k in record_keys(r))
+        return self._s3_delete_keys([f for f in self._s3_get_manifest()
+                                     if not is_excluded(f) and f not in kept])
+
+    def _s3_delete_keys(self, keys):
+        """
+        Delete keys from the bucket, by batches of 1000 sent at the same time.
+        Keys failing with a transient error are retried
+        :param keys: list
+        :return: DeleteResult
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        result = DeleteResult()
+        start = time.time()
+        batches = chunk_list(list(keys), S3_DELETE_BATCH_SIZE)
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(len(batches), self.upload_concurrency)) as executor:
+                futures = [executor.submit(_s3_delete_batch, self._s3, self.s3_bucket, batch,
+                                           limiter=self.s3_limiter)
+                           for batch in batches]
+            for future in futures:
+                deleted, failed = future.result()
+                result.deleted.extend(deleted)
+                result.failed.extend(failed)
+        result.elapsed = time.time() - start
+        return result
+
+    def _s3_iter_objects(self):
+        """
+        Yield all the objects of the bucket, except the manifest, and the
+        releases when the site is deployed as releases
+        :return: generator of dict
+        """
+        skipped = self.releases_prefix if self.releases else None
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.s3_bucket):
+            for obj in page.get("Contents", []):
+                if obj["Key"] != MANIFEST_FILE and not (skipped and obj["Key"].startswith(skipped)):
+                    yield obj
+
+    def _s3_iter_keys(self, prefix):
+        """
+        Yield all the keys of a directory of the bucket
+        :param prefix: str
+        :return: generator of str
+        """
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
 
     def s3_create_manifest(self):
         """
-        To create a manifest db for the current
+        To create a manifest db for the current site.
+        It pages through the whole bucket, then writes the manifest once
         :return:
         """
-        obj = self._s3.list_objects_v2(Bucket=self.s3_bucket)
-        if 'Contents' in obj:
-            for k in obj['Contents']:
-                key = k["Key"]
-                files = []
-                if key not in [MANIFEST_FILE]:
-                    files.append(key)
-                self._s3_update_manifest(files)
+        self._s3_update_manifest([_s3_object_record(obj) for obj in self._s3_iter_objects()])
 
-    def _s3_update_manifest(self, files_list):
+    def _s3_update_manifest(self, records, prefix=""):
         """
         Write manifest files
-        :param files_list: list
+        :param records: list of manifest records, or of keys
+        :param prefix: str - the directory of the manifest, ie: of a release
         :return:
         """
-        if files_list:
-            data = ",".join(files_list)
+        if records:
             self._s3.put_object(Bucket=self.s3_bucket,
-                                Key=MANIFEST_FILE,
-                                Body=data,
+                                Key=prefix + MANIFEST_FILE,
+                                Body=manifest.dumps(records),
+                                ContentType=manifest.CONTENT_TYPE,
                                 ACL='private')
 
+    def _s3_iter_manifest(self, prefix=""):
+        """
+        Yield the records of the manifest, as it is downloaded
+        :param prefix: str - the directory of the manifest, ie: of a release
+        :return: generator of dict
+        """
+        from botocore.exceptions import ClientError
+        try:
+            obj = self._s3.get_object(Bucket=self.s3_bucket, Key=prefix + MANIFEST_FILE)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404", "403"]:
+                return
+            raise e
+        try:
+            for record in manifest.iter_records(obj["Body"]):
+                yield record
+        finally:
+            obj["Body"].close()
+
+    def s3_get_manifest_records(self):
+        """
+        Return the records of the manifest
+        :return: dict - {key: record}
+        """
+        return dict((record["key"], record) for record in self._s3_iter_manifest())
+
     def _s3_get_manifest(self):
         """
-        Return the list of items in the manifest
+        Return the list of items in the manifest, with the variants of the images
         :return: list
         """
-        with tempfile.NamedTemporaryFile(delete=True) as tmp:
-            try:
-                self._s3.download_fileobj(self.domain, MANIFEST_FILE, tmp)
-                tmp.seek(0)
-                data = tmp.read()
-                if data is not None:
-                    return data.split(",")
-            except Exception as ex:
-                pass
-        return []
+        try:
+            return [k for record in self._s3_iter_manifest() for k in record_keys(record)]
+        except Exception as ex:
+            return []
+
+
+def _s3_upload_file(transfer, bucket_name, local_path, s3_path, mimetype, headers=None,
+                    hash_cache=None, compressor=None, image_optimizer=None, prefix=""):
+    """
+    Upload a file to S3, at `prefix` + `s3_path`, with its variants if it's
+    an image to optimize. Used by the upload workers
+    :return: Future of tuple (dict, int, int) - the manifest record of the file,
+             the bytes uploaded, the bytes saved by the image optimization
+    """
+    from .transfer import chain, gather
+    size = os.path.getsize(local_path)
+    hash = _file_md5(local_path, hash_cache)
+    upload_path = local_path
+    saved = 0
+    compressed = None
+    optimized = None
+    variants = []
+    extra_args = {"ContentType": mimetype}
+    if headers:
+        extra_args.update(headers)
+    if image_optimizer and image_optimizer.is_optimizable(mimetype):
+        optimized = image_optimizer.settings
+        variants = image_optimizer.variants(s3_path, mimetype)
+        optimized_path = image_optimizer.optimize(local_path, mimetype, hash)
+        if optimized_path:
+            upload_path = optimized_path
+            saved = size - os.path.getsize(optimized_path)
+    elif compressor:
+        compressed = compressor.compression(mimetype, size)
+        compressed_path = compressor.compress(local_path, mimetype, hash)
+        if compressed_path:
+            upload_path = compressed_path
+            extra_args["ContentEncoding"] = compressor.encoding
+
+    record = manifest.record(s3_path,
+                             size=size,
+                             hash=hash,
+                             content_type=mimetype,
+                             content_encoding=extra_args.get("ContentEncoding"),
+                             headers=headers or None,
+                             compressed=compressed,
+                             optimized=optimized,
+                             variants=variants)
+    uploads = [transfer.upload(upload_path,
+                               bucket=bucket_name,
+                               key=prefix + s3_path,
+                               extra_args=extra_args)]
+    for key in variants:
+        uploads.append(transfer.upload(image_optimizer.make_webp(local_path, mimetype, hash),
+                                       bucket=bucket_name,
+                                       key=prefix + key,
+                                       extra_args=dict(extra_args, ContentType=get_mimetype(key))))
+
+    def uploaded(uploaded_bytes):
+        record["uploaded_at"] = int(time.time())
+        return record, sum(uploaded_bytes), saved
+    return chain(gather(uploads), uploaded)
+
+
+def _s3_delete_batch(s3, bucket_name, keys, max_attempts=S3_DELETE_MAX_ATTEMPTS, limiter=None):
+    """
+    Delete a batch of keys in one request. The keys that failed with a
+    transient error, or the whole batch if the request did, are sent again
+    after a backoff with jitter
+    :param s3: boto3 S3 client
+    :param bucket_name: str
+    :param keys: list - up to 1000 keys
+    :param max_attempts: int
+    :param limiter: AdaptiveLimiter - to make the requests through
+    :return: tuple (deleted keys, [(key, exception)])
+    """
+    import random
+    from botocore import exceptions
+    deleted = []
+    failed = []
+    pending = keys
+    attempt = 0
+    while pending:
+        if attempt:
+            delay = min(S3_RETRY_MAX_DELAY, S3_RETRY_BASE_DELAY * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+        attempt += 1
+        last_attempt = attempt >= max_attempts
+        try:
+            delete = {
+                'Objects': [{"Key": k} for k in pending],
+                'Quiet': True
+            }
+            if limiter:
+                resp = limiter.call(s3.delete_objects, Bucket=bucket_name, Delete=delete)
+            else:
+                resp = s3.delete_objects(Bucket=bucket_name, Delete=delete)
+        except (exceptions.ClientError, exceptions.ConnectionError,
+                exceptions.HTTPClientError) as ex:
+            retryable = not isinstance(ex, exceptions.ClientError) or \
+                        ex.response["Error"]["Code"] in S3_RETRY_ERROR_CODES
+            if last_attempt or not retryable:
+                failed.extend((k, ex) for k in pending)
+                break
+            continue
+
+        # In quiet mode, only the keys that failed are returned
+        errors = resp.get("Errors", [])
+        error_keys = set(e["Key"] for e in errors)
+        deleted.extend(k for k in pending if k not in error_keys)
+        pending = []
+        for error in errors:
+            if error.get("Code") in S3_RETRY_ERROR_CODES and not last_attempt:
+                pending.append(error["Key"])
+            else:
+                failed.append((error["Key"], Exception("%s: %s" % (error.get("Code"),
+                                                                   error.get("Message")))))
+    return deleted, failed
 
 
-def _s3_upload_file(aws_params, bucket_name, local_path, s3_path, mimetype):
+def _s3_object_record(obj):
     """
-    Upload a file to S3. Used mainly with threading
+    Return the manifest record of an object from a bucket listing.
+    The ETag is the md5 of the content, unless it was uploaded in parts
     """
-    s3 = boto3.client("s3", **aws_params)
-    s3.upload_file(local_path,
-                   Bucket=bucket_name,
-                   Key=s3_path,
-                   ExtraArgs={"ContentType": mimetype})
+    return manifest.record(obj["Key"],
+                           size=obj["Size"],
+                           hash=obj["ETag"].strip('"'),
+                           uploaded_at=int(obj["LastModified"].timestamp()))
 
 
-def _make_cloudfront_config(domain_name, s3_domain, ssl_arn):
+def _make_cloudfront_config(domain_name, s3_domain, ssl_arn, origin_path="", options=None,
+                            function_arn=None):
+    """
+    Return the config of a distribution of the S3 site
+    :param domain_name: str
+    :param s3_domain: str - the S3 website endpoint
+    :param ssl_arn: str - the ACM certificate
+    :param origin_path: str - the directory of the bucket to serve
+    :param options: dict - the 'cloudfront' settings: price_class, min_ttl,
+                    default_ttl, max_ttl, behaviors, error_responses, spa
+    :param function_arn: str - the function to run on the responses, ie: of the releases
+    :return: dict
+    """
+    options = options or {}
     id = "S3-website-%s" % s3_domain
+    behaviors = [_make_cloudfront_cache_behavior(id, _inherit_behavior_options(options, b),
+                                                 path=b["path"], function_arn=function_arn)
+                 for b in options.get("behaviors") or []]
+    error_responses = _make_cloudfront_error_responses(options)
     return {
         'CallerReference': caller_reference_uuid(),
         'Aliases': {'Quantity': 1, 'Items': [domain_name]},
@@ -565,7 +1930,7 @@ def _make_cloudfront_config(domain_name, s3_domain, ssl_arn):
                 {
                     'Id': id,
                     'DomainName': s3_domain,
-                    'OriginPath': '',
+                    'OriginPath': origin_path,
                     'CustomHeaders': {'Quantity': 0, 'Items': []},
                     'CustomOriginConfig': {
                         'HTTPPort': 80,
@@ -580,46 +1945,17 @@ def _make_cloudfront_config(domain_name, s3_domain, ssl_arn):
         },
         'Enabled': True,
         'Comment': '',
-        'PriceClass': 'PriceClass_100',
+        'PriceClass': options.get("price_class") or 'PriceClass_100',
         'Logging': {
             'Enabled': False,
             'IncludeCookies': False,
             'Bucket': '',
             'Prefix': ''
         },
-        'CacheBehaviors': {'Quantity': 0},
-        'Restrictions': {
-            "GeoRestriction": {
-                "RestrictionType": 'none',
-                "Quantity": 0
-            }
-        },
-        "DefaultRootObject": "index.html",
-        "WebACLId": "",
-        "HttpVersion": "http2",
-        'DefaultCacheBehavior': {
-            'TargetOriginId': id,
-            'ForwardedValues': {
-                'QueryString': False,
-                'Cookies': {'Forward': 'none'},
-                'Headers': {'Quantity': 0, 'Items': []},
-                'QueryStringCacheKeys': {'Quantity': 0, 'Items': []}
-            },
-            'TrustedSigners': {'Enabled': False, 'Quantity': 0, 'Items': []},
-            'ViewerProtocolPolicy': 'redirect-to-https',
-            'MinTTL': 0,
-            'AllowedMethods': {
-                'Quantity': 2,
-                'Items': ['GET', 'HEAD'],
-                'CachedMethods': {'Quantity': 2, 'Items': ['GET', 'HEAD']}
-            },
-            'DefaultTTL': 86400,
-            'MaxTTL': 31536000,
-            'Compress': True,
-            'LambdaFunctionAssociations': {'Quantity': 0},
-            'FieldLevelEncryptionId': ''
-        },
-        'CustomErrorResponses': {'Quantity': 0},
+        'CacheBehaviors': {'Quantity': len(behaviors), 'Items': behaviors},
+        "DefaultRootObject": options.get("index_file") or "index.html",
+        'DefaultCacheBehavior': _make_cloudfront_cache_behavior(id, options, function_arn=function_arn),
+        'CustomErrorResponses': {'Quantity': len(error_responses), 'Items': error_responses},
         'ViewerCertificate': {
             'ACMCertificateArn': ssl_arn,
             'SSLSupportMethod': 'sni-only',
@@ -632,3 +1968,155 @@ def _make_cloudfront_config(domain_name, s3_domain, ssl_arn):
         'WebACLId': '',
         'HttpVersion': 'http2'
     }
+
+
+def _make_cloudfront_cache_behavior(origin_id, options, path=None, function_arn=None):
+    """
+    Return a cache behavior. With a cache_policy_id, the TTLs are the ones of
+    the cache policy, otherwise they are set on the behavior
+    :param origin_id: str
+    :param options: dict - min_ttl, default_ttl, max_ttl, compress, cache_policy_id
+    :param path: str - the path pattern, None for the default behavior
+    :param function_arn: str - the function to run on the responses
+    :return: dict
+    """
+    behavior = {
+        'TargetOriginId': origin_id,
+        'TrustedSigners': {'Enabled': False, 'Quantity': 0, 'Items': []},
+        'ViewerProtocolPolicy': 'redirect-to-https',
+        'AllowedMethods': {
+            'Quantity': 2,
+            'Items': ['GET', 'HEAD'],
+            'CachedMethods': {'Quantity': 2, 'Items': ['GET', 'HEAD']}
+        },
+        'Compress': options.get("compress", True),
+        'LambdaFunctionAssociations': {'Quantity': 0},
+        'FieldLevelEncryptionId': ''
+    }
+    if path:
+        behavior['PathPattern'] = path
+    if function_arn:
+        _set_function_association(behavior, function_arn)
+    if options.get("cache_policy_id"):
+        behavior['CachePolicyId'] = options["cache_policy_id"]
+    else:
+        behavior.update({
+            'ForwardedValues': {
+                'QueryString': False,
+                'Cookies': {'Forward': 'none'},
+                'Headers': {'Quantity': 0, 'Items': []},
+                'QueryStringCacheKeys': {'Quantity': 0, 'Items': []}
+            },
+            'MinTTL': int(options.get("min_ttl", 0)),
+            'DefaultTTL': int(options.get("default_ttl", CLOUDFRONT_DEFAULT_TTL)),
+            'MaxTTL': int(options.get("max_ttl", CLOUDFRONT_MAX_TTL)),
+        })
+    return behavior
+
+
+def _inherit_behavior_options(options, behavior):
+    """
+    Return the options of a path behavior, with the caching of the default
+    behavior it doesn't set. A behavior with its own TTLs doesn't take the
+    default cache_policy_id, which would replace them, and the other way around
+    :param options: dict - the 'cloudfront' settings
+    :param behavior: dict - one of its 'behaviors'
+    :return: dict
+    """
+    ttls = ["min_ttl", "default_ttl", "max_ttl"]
+    if any(k in behavior for k in ttls):
+        inherited = ttls
+    elif "cache_policy_id" in behavior:
+        inherited = []
+    else:
+        inherited = ttls + ["cache_policy_id"]
+    return dict(dict((k, options[k]) for k in inherited + ["compress"] if k in options), **behavior)
+
+
+def _set_function_association(behavior, function_arn, event_type="viewer-response"):
+    """
+    Set the function a behavior runs on an event, replacing any other one
+    :param behavior: dict
+    :param function_arn: str
+    :param event_type: str
+    :return: bool - False if it was not set already
+    """
+    items = (behavior.get("FunctionAssociations") or {}).get("Items") or []
+    association = {"FunctionARN": function_arn, "EventType": event_type}
+    if association in items:
+        return True
+    items = [a for a in items if a["EventType"] != event_type] + [association]
+    behavior["FunctionAssociations"] = {"Quantity": len(items), "Items": items}
+    return False
+
+
+def _make_releases_function_code(releases_prefix):
+    """
+    Return the code of the releases function, for a releases directory
+    :param releases_prefix: str
+    :return: bytes
+    """
+    # Escaped for a javascript regex
+    escaped = "".join(c if c.isalnum() else "\\" + c for c in releases_prefix)
+    return (CLOUDFRONT_RELEASES_FUNCTION % escaped).encode("utf-8")
+
+
+def _make_cloudfront_error_responses(options):
+    """
+    Return the custom error responses. With 'spa', the 403 and 404 errors
+    respond with the index file, so the app can route the path itself
+    :param options: dict - error_responses, spa, index_file
+    :return: list
+    """
+    responses = {}
+    if options.get("spa"):
+        for code in [403, 404]:
+            responses[code] = {
+                'ErrorCode': code,
+                'ResponsePagePath': "/" + (options.get("index_file") or "index.html"),
+                'ResponseCode': '200',
+                'ErrorCachingMinTTL': 0
+            }
+    for r in options.get("error_responses") or []:
+        response = {'ErrorCode': int(r["error_code"]),
+                    'ErrorCachingMinTTL': int(r.get("ttl", 0))}
+        if r.get("response_page"):
+            response['ResponsePagePath'] = r["response_page"]
+            response['ResponseCode'] = str(r.get("response_code", r["error_code"]))
+        responses[response['ErrorCode']] = response
+    return [responses[code] for code in sorted(responses)]
+
+
+def _config_matches(desired, live):
+    """
+    Check if a live distribution config has the values of a desired one.
+    Keys only in the live config, ie: defaults set by cloudfront, are ignored
+    :param desired: the desired value
+    :param live: the live value
+    :return: bool
+    """
+    if live is None and not desired:
+        return True
+    if isinstance(desired, dict):
+        return isinstance(live, dict) and \
+            all(_config_matches(v, live.get(k)) for k, v in desired.items())
+    if isinstance(desired, list):
+        return isinstance(live, list) and len(desired) == len(live) and \
+            all(_config_matches(d, l) for d, l in zip(desired, live))
+    return desired == live
+
+
+def _merge_config(live, changes):
+    """
+    Merge changes into a live distribution config, keeping the live values
+    of the keys not in the changes. Lists are replaced
+    :param live: dict
+    :param changes: dict
+    :return: dict - live
+    """
+    for k, v in changes.items():
+        if isinstance(v, dict) and isinstance(live.get(k), dict):
+            _merge_config(live[k], v)
+        else:
+            live[k] = v
+    return live
@@ -0,0 +1,51 @@
+"""
+S3lify cache directories
+
+The compressed files and the optimized images are cached by the md5 of
+their content, in directories shared by all the sites of the project. A
+cached file is touched each time it is used, and the ones not used for
+`max_age` are deleted, so the caches don't keep every version of the
+files ever deployed.
+"""
+
+import os
+import time
+
+# Cached files not used for this many seconds are deleted
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+def touch(path):
+    """
+    Mark a cached file as used
+    :param path: str
+    :return: bool - False if it is not in the cache
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def prune(cache_dir, max_age=DEFAULT_MAX_AGE):
+    """
+    Delete the files of a cache directory not used for `max_age`
+    :param cache_dir: str
+    :param max_age: int - seconds
+    :return: int - the number of files deleted
+    """
+    deleted = 0
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(cache_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
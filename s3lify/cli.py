@@ -1,19 +1,90 @@
 
 import os
-import re
 import sys
-import yaml
 import time
 import json
 import click
-import pkg_resources
-from . import S3lify
-from halo import Halo
+import pkgutil
+import threading
+from . import S3lify, DEFAULT_INVALIDATION_MAX_PATHS, upload_concurrency_limits, \
+    DEFAULT_KEEP_RELEASES, make_release_id
+from .clients import ClientPool
+from .hashcache import HashCache
+from .waiters import wait_all, WaitTimeout, DEFAULT_TIMEOUT
 
 NAME = "S3lify"
 CWD = os.getcwd()
 CONFIG_FILE = "%s/%s" % (CWD, "s3lify.yml")
-sp = Halo()
+CACHE_DIR = "%s/%s" % (CWD, ".s3lify")
+
+# Number of sites deployed at the same time, with 'sites' in the config
+DEFAULT_SITES_CONCURRENCY = 4
+
+# Min seconds between the cloudfront invalidations of `s3lify watch`.
+# The changes in between are invalidated together
+WATCH_INVALIDATION_INTERVAL = 10
+
+
+class Spinner(object):
+    """
+    Halo spinner, created on first use as it is slow to set up
+    """
+    _halo = None
+
+    def __getattr__(self, name):
+        if Spinner._halo is None:
+            from halo import Halo
+            Spinner._halo = Halo()
+        return getattr(Spinner._halo, name)
+
+
+sp = Spinner()
+
+
+class SiteLog(object):
+    """
+    Output of a site run along others. Instead of a spinner, the messages
+    are printed as they come, prefixed with the domain
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, domain):
+        self.domain = domain
+
+    def _print(self, symbol, text):
+        with SiteLog._lock:
+            print("%s [%s] %s" % (symbol, self.domain, text))
+
+    def start(self, text=""):
+        self._print("-", text)
+
+    def info(self, text=""):
+        self._print("i", text)
+
+    def succeed(self, text=""):
+        self._print("+", text)
+
+    def warn(self, text=""):
+        self._print("!", text)
+
+    def fail(self, text=""):
+        self._print("x", text)
+
+    def clear(self):
+        pass
+
+
+class DeployReport(object):
+    """
+    What has been done deploying a site
+    """
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.ok = True
+        self.summary = ""
+        self.failed = []
+        self.elapsed = 0.0
 
 
 def header(title=None, domain_name=None):
@@ -40,10 +111,530 @@ def site_404_message(domain):
     print("Verify the s3lify.yml config file")
     print("or run 's3lify setup' to setup the site")
 
+def deploy_failed_message(report):
+    sp.fail('Deploy failed: %s' % report.summary)
+    for s3_path, ex in report.failed:
+        print("  %s: %s" % (s3_path, ex))
+    footer()
+    sys.exit(1)
+
+def delete_failed_message(result, log, limit=10):
+    log.warn('%s files could not be deleted, they are left on S3' % len(result.failed))
+    for s3_path, ex in result.failed[:limit]:
+        print("  %s: %s" % (s3_path, ex))
+    if len(result.failed) > limit:
+        print("  ...")
+
+def throttle_message(client, log):
+    limiter = client.s3_limiter
+    if limiter.throttles:
+        log.warn('S3 slowed down %s requests, concurrency lowered to %s'
+                 % (limiter.throttles, limiter.concurrency))
+
+def write_metrics(metrics, path):
+    data = json.dumps(metrics.to_dict(), indent=2, sort_keys=True)
+    # On stderr, not to be mixed with the output of the command
+    if path == "-":
+        sys.stderr.write(data + "\n")
+    else:
+        with open(path, "w") as f:
+            f.write(data)
+
+def sites_report(title, rows):
+    """
+    Print a table of the sites
+    :param title: tuple - the columns names
+    :param rows: list of tuple
+    """
+    rows = [title] + [tuple(str(v) for v in row) for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(title))]
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+
 def create_config_file():
     if not os.path.isfile(CONFIG_FILE):
         with open(CONFIG_FILE, "wb") as f:
-            f.write(pkg_resources.resource_string(__name__, "s3lify.yml"))
+            f.write(pkgutil.get_data(__name__, "s3lify.yml"))
+
+def get_sites(config):
+    """
+    Return the config of each site. With 'sites', each site takes the top
+    level settings, and overrides them with its own
+    :param config: dict
+    :return: list of dict
+    """
+    if not config.get("sites"):
+        return [config]
+    defaults = dict((k, v) for k, v in config.items() if k not in ["sites", "domain"])
+    sites = []
+    for site in config["sites"]:
+        site_config = dict(defaults)
+        site_config.update(site)
+        sites.append(site_config)
+    return sites
+
+def get_distribution(site):
+    distribution = (site.get('distribution', 's3') or '').lower()
+    if distribution not in ['s3', 'route53', 'cloudfront']:
+        distribution = 's3'
+    return distribution
+
+def make_client(site, clients=None, hash_cache=None):
+    return S3lify(domain=site.get("domain"),
+                  aws_access_key_id=site.get("aws_access_key_id"),
+                  aws_secret_access_key=site.get("aws_secret_access_key"),
+                  region=site.get("aws_region"),
+                  upload_concurrency=site.get("upload_concurrency"),
+                  max_upload_rate=site.get("max_upload_rate"),
+                  optimize_images=site.get("optimize_images") or None,
+                  releases=bool(site.get("releases")),
+                  releases_prefix=site.get("releases_prefix"),
+                  cache_dir=CACHE_DIR,
+                  compress=site.get("compress") or None,
+                  lookup_cache_ttl=site.get("lookup_cache_ttl") or 0,
+                  clients=clients,
+                  hash_cache=hash_cache,
+                  headers=site.get("headers"),
+                  ignore_files=site.get("ignore_files"),
+                  follow_symlinks=site.get("follow_symlinks", False),
+                  cloudfront_options=dict(site.get("cloudfront") or {},
+                                          index_file=site.get("index_file") or "index.html"),
+                  )
+
+def run_sites(sites, fn, concurrency):
+    """
+    Run `fn(client, site)` for each site, `concurrency` sites at a time
+    :param sites: list of tuple (client, site)
+    :param fn: callable
+    :param concurrency: int
+    :return: list of tuple (value, exception), in the order of the sites
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(fn, client, site) for client, site in sites]
+    results = []
+    for future in futures:
+        try:
+            results.append((future.result(), None))
+        except Exception as ex:
+            results.append((None, ex))
+    return results
+
+def deploy_site(client, site, log, resume=False):
+    """
+    Deploy a site. The files uploaded are recorded in a journal, so an
+    interrupted deploy can be resumed. It's deleted once the deploy is complete
+    :param client: S3lify
+    :param site: dict - the site config
+    :param log: the spinner, or a SiteLog
+    :param resume: bool - to carry on with the interrupted deploy
+    :return: DeployReport
+    """
+    start_journal(client, site, log, resume)
+    if site.get('releases'):
+        report = deploy_release(client, site, log)
+    else:
+        report = deploy_files(client, site, log)
+    if report.ok:
+        client.journal.discard()
+    else:
+        client.journal.close()
+    return report
+
+def start_journal(client, site, log, resume=False):
+    """
+    Start the journal of a deploy, or carry on with the one of the
+    interrupted deploy, if it was in the same mode
+    :return: bool - True when resuming
+    """
+    mode = "releases" if site.get('releases') else (site.get('deploy_mode') or 'purge').lower()
+    journal = client.journal
+    if journal.exists():
+        if not resume:
+            log.warn('An interrupted deploy was found, starting over. Use --resume to carry on with it')
+        elif not journal.resume():
+            log.warn('The journal of the interrupted deploy is unreadable, starting over')
+        elif journal.info.get("mode") != mode:
+            log.warn("The interrupted deploy was in '%s' mode, starting over" % journal.info.get("mode"))
+        else:
+            log.info('resuming the interrupted deploy (%s files done)' % len(journal.records))
+            return True
+    elif resume:
+        log.info('No interrupted deploy to resume')
+    journal.start(mode=mode, release_id=make_release_id() if mode == "releases" else None)
+    return False
+
+def deploy_files(client, site, log):
+    """
+    Deploy a site directory, and invalidate the changed objects on cloudfront
+    :param client: S3lify
+    :param site: dict - the site config
+    :param log: the spinner, or a SiteLog
+    :return: DeployReport
+    """
+    report = DeployReport(client.domain)
+    start = time.time()
+    site_directory = os.path.join(CWD, site.get('site_directory'))
+    exclude_files = site.get("purge_exclude_files", [])
+    deploy_mode = (site.get('deploy_mode') or 'purge').lower()
+    changed_keys = None
+
+    if deploy_mode == 'sync':
+        log.info('syncing site directory to S3...')
+        sync = client.s3_sync(site_directory,
+                              delete=bool(site.get('purge_files')),
+                              exclude_files=exclude_files)
+        throttle_message(client, log)
+        if not sync.upload.ok:
+            report.ok = False
+            report.failed = sync.upload.failed
+            report.summary = "%s files failed to upload" % len(sync.upload.failed)
+            return report
+        report.summary = '%s uploaded, %s deleted, %s unchanged' \
+                         % (len(sync.upload.succeeded), len(sync.deleted), sync.unchanged)
+        if sync.upload.resumed:
+            report.summary += ', %s resumed' % sync.upload.resumed
+        if sync.upload.bytes_saved:
+            report.summary += ', %s bytes saved on images' % sync.upload.bytes_saved
+        log.succeed('Site files synced: OK (%s)' % report.summary)
+        if not sync.delete.ok:
+            delete_failed_message(sync.delete, log)
+            report.ok = False
+            report.failed = sync.delete.failed
+            report.summary += ', %s not deleted' % len(sync.delete.failed)
+        changed_keys = sync.changed_keys
+    else:
+        client.s3_create_manifest()
+        log.succeed('Manifest file created: OK')
+
+        if not site.get('purge_files'):
+            log.warn('config.purge_files is disabled')
+        else:
+            purge = client.s3_purge_files(exclude_files=exclude_files)
+            log.succeed('Files purged from S3: OK (%s deleted)' % len(purge.deleted))
+            if not purge.ok:
+                delete_failed_message(purge, log)
+                report.ok = False
+                report.failed = purge.failed
+
+        log.info('uploading site directory to S3...')
+        result = client.s3_upload(site_directory)
+        throttle_message(client, log)
+        if not result.ok:
+            report.ok = False
+            report.failed = result.failed
+            report.summary = "%s files failed to upload" % len(result.failed)
+            return report
+        report.summary = '%s files, %s bytes' % (len(result.succeeded), result.bytes)
+        if result.resumed:
+            report.summary += ', %s resumed' % result.resumed
+        if result.bytes_saved:
+            report.summary += ', %s bytes saved on images' % result.bytes_saved
+        log.succeed('Site files uploaded: OK (%s in %.2fs)' % (report.summary, result.elapsed))
+        if report.failed:
+            report.summary += ', %s not deleted' % len(report.failed)
+
+    if get_distribution(site) != 'cloudfront':
+        pass
+    elif not site.get('invalidate_cloudfront_objects'):
+        log.warn('invalidate_cloudfront_objects is False')
+    else:
+        invalidation_id = client.cloudfront_invalidate_objects(
+            keys=changed_keys,
+            max_paths=site.get('invalidation_max_paths') or DEFAULT_INVALIDATION_MAX_PATHS,
+            index_file=site.get('index_file') or 'index.html')
+        if invalidation_id:
+            log.succeed('Invalidated cloudfront objects: OK (%s)' % invalidation_id)
+            if site.get('invalidation_wait'):
+                log.start('waiting for the invalidation to complete...')
+                client.cloudfront_wait_invalidation(
+                    invalidation_id,
+                    timeout=site.get('wait_timeout') or DEFAULT_TIMEOUT)
+                log.succeed('Invalidation completed: OK')
+        else:
+            log.info('Nothing to invalidate on cloudfront')
+
+    report.elapsed = time.time() - start
+    return report
+
+
+def deploy_release(client, site, log):
+    """
+    Deploy a site directory as a new release, make it live, then delete
+    the oldest releases. The live site is untouched until the release is
+    fully uploaded
+    :param client: S3lify
+    :param site: dict - the site config
+    :param log: the spinner, or a SiteLog
+    :return: DeployReport
+    """
+    report = DeployReport(client.domain)
+    start = time.time()
+    if get_distribution(site) != 'cloudfront':
+        report.ok = False
+        report.summary = "'releases' requires 'distribution: cloudfront'"
+        return report
+
+    site_directory = os.path.join(CWD, site.get('site_directory'))
+    release_id = client.journal.info.get("release_id") or make_release_id()
+    live = client.release_get_live()
+    if live == release_id:
+        # Resuming a deploy interrupted after its release went live
+        live = client.release_get_previous(release_id)
+    log.info('uploading release to S3...')
+    release = client.release_upload(site_directory, release_id=release_id, base_release=live)
+    throttle_message(client, log)
+    if not release.ok:
+        report.ok = False
+        report.failed = release.upload.failed + release.copy.failed
+        report.summary = "%s files failed to upload, release %s is not live" \
+                         % (len(report.failed), release.release_id)
+        return report
+    report.summary = 'release %s, %s uploaded, %s copied' \
+                     % (release.release_id, len(release.upload.succeeded), len(release.copy.succeeded))
+    resumed = release.upload.resumed + release.copy.resumed
+    if resumed:
+        report.summary += ', %s resumed' % resumed
+    if release.upload.bytes_saved:
+        report.summary += ', %s bytes saved on images' % release.upload.bytes_saved
+    log.succeed('Release uploaded: OK (%s)' % report.summary)
+
+    activate_release(client, site, release.release_id, log)
+
+    pruned, deletion = client.release_prune(keep=site.get('keep_releases') or DEFAULT_KEEP_RELEASES,
+                                            protect=[release.release_id, live])
+    if pruned:
+        log.succeed('Old releases deleted: OK (%s)' % ", ".join(pruned))
+    if not deletion.ok:
+        delete_failed_message(deletion, log)
+
+    report.elapsed = time.time() - start
+    return report
+
+def activate_release(client, site, release_id, log):
+    """
+    Make a release live, then invalidate the cloudfront cache once the
+    distribution serves it
+    :param client: S3lify
+    :param site: dict - the site config
+    :param release_id: str
+    :param log: the spinner, or a SiteLog
+    """
+    wait_timeout = site.get('wait_timeout') or DEFAULT_TIMEOUT
+    if not client.release_activate(release_id, error_file=site.get('error_file') or 'error.html'):
+        log.info('Release %s is already live' % release_id)
+        return
+    log.succeed('Release %s activated: OK' % release_id)
+
+    # Edges still serving the previous release would cache it again
+    log.start('waiting for the distribution to be deployed...')
+    client.cloudfront_wait_deployed(timeout=wait_timeout)
+    log.succeed('Distribution deployed: OK')
+
+    invalidation_id = client.cloudfront_invalidate_objects()
+    log.succeed('Invalidated cloudfront objects: OK (%s)' % invalidation_id)
+    if site.get('invalidation_wait'):
+        log.start('waiting for the invalidation to complete...')
+        client.cloudfront_wait_invalidation(invalidation_id, timeout=wait_timeout)
+        log.succeed('Invalidation completed: OK')
+
+def rollback_site(client, site, release_id=None):
+    """
+    Make a previous release live again. Nothing is uploaded
+    :param client: S3lify
+    :param site: dict - the site config
+    :param release_id: str - the release to go back to. Default: the one before the live release
+    :return: bool - False if there is no such release to go back to
+    """
+    if not site.get('releases'):
+        sp.fail("'releases' is not enabled in 's3lify.yml'")
+        return False
+
+    live = client.release_get_live()
+    releases = client.release_list()
+    print("")
+    sp.info('Releases: %s' % (", ".join(releases) or "none"))
+    sp.info('Live release: %s' % live)
+    if release_id and release_id not in releases:
+        sp.fail("Release '%s' doesn't exist" % release_id)
+        return False
+    release_id = release_id or (live and client.release_get_previous(live))
+    if not release_id:
+        sp.fail('No release to rollback to')
+        return False
+
+    activate_release(client, site, release_id, sp)
+    sp.clear()
+    sp.succeed('Done! Live release: %s' % release_id)
+    return True
+
+def watch_site(client, site, watcher):
+    """
+    Push the changes of the site directory to S3 as they happen, until
+    Ctrl-C. With cloudfront, the changed objects are invalidated by batch
+    :param client: S3lify
+    :param site: dict - the site config
+    :param watcher: Watcher - started before the site directory was synced
+    """
+    site_directory = os.path.join(CWD, site.get('site_directory'))
+    exclude_files = site.get("purge_exclude_files", [])
+    invalidate = get_distribution(site) == 'cloudfront' and site.get('invalidate_cloudfront_objects')
+    pending = set()
+    last_invalidation = 0
+    # Kept up to date by the pushes, the manifest is downloaded once
+    records = client.s3_get_manifest_records()
+
+    def invalidate_pending():
+        invalidation_id = client.cloudfront_invalidate_objects(
+            keys=sorted(pending),
+            max_paths=site.get('invalidation_max_paths') or DEFAULT_INVALIDATION_MAX_PATHS,
+            index_file=site.get('index_file') or 'index.html')
+        sp.succeed('%s Invalidated cloudfront objects: OK (%s files, %s)'
+                   % (time.strftime("%H:%M:%S"), len(pending), invalidation_id))
+        pending.clear()
+
+    sp.info('Watching %s (%s), Ctrl-C to stop' % (site.get('site_directory'), watcher.mode))
+    try:
+        for changed, deleted in watcher.batches():
+            if changed or deleted:
+                start = time.time()
+                result = client.s3_push(site_directory, changed | deleted,
+                                        delete=bool(site.get('purge_files')),
+                                        exclude_files=exclude_files,
+                                        records=records)
+                if not result.upload.ok:
+                    sp.fail('%s %s files failed to upload' % (time.strftime("%H:%M:%S"),
+                                                              len(result.upload.failed)))
+                    for s3_path, ex in result.upload.failed:
+                        print("  %s: %s" % (s3_path, ex))
+                if not result.delete.ok:
+                    delete_failed_message(result.delete, sp)
+                if result.changed_keys:
+                    sp.succeed('%s Pushed: OK (%s uploaded, %s deleted in %.2fs)'
+                               % (time.strftime("%H:%M:%S"), len(result.upload.succeeded),
+                                  len(result.deleted), time.time() - start))
+                if invalidate:
+                    pending.update(result.changed_keys)
+            if pending and time.time() - last_invalidation >= WATCH_INVALIDATION_INTERVAL:
+                invalidate_pending()
+                last_invalidation = time.time()
+    except KeyboardInterrupt:
+        print("")
+    finally:
+        watcher.stop()
+    if pending:
+        invalidate_pending()
+
+def setup_site(client, site):
+    """
+    Setup a site: S3 bucket, and with route53|cloudfront the DNS, SSL
+    certificate and distribution
+    :param client: S3lify
+    :param site: dict - the site config
+    """
+    distribution = get_distribution(site)
+
+    update_route53domains_dns = site.get('update_route53domains_dns')
+    if update_route53domains_dns is None:
+        update_route53domains_dns = True
+
+    print("")
+    sp.info('Distribution: %s' % distribution)
+
+    # Look up what already exists, all at once
+    site_status = client.get_status(distribution)
+
+    if not site_status.site_exists:
+        client.s3_create_site()
+    sp.succeed("Site created on S3: OK")
+
+    # Distribution: s3|route53|cloudfront
+    #
+    if distribution in ["route53", "cloudfront"]:
+        wait_timeout = site.get('wait_timeout') or DEFAULT_TIMEOUT
+
+        # setup route53
+        dns_change_id = client.s3_update_route53_a_records()
+        sp.succeed('DNS updated on Route53: OK')
+
+        # update domains DNS
+        if update_route53domains_dns is True:
+            if client.route53domains_update_dns():
+                sp.succeed('Domain Name Servers updated: OK')
+
+        # cloudfront specific
+        if distribution == 'cloudfront':
+
+            # SSL: Certificate
+            cert_status = site_status.certificate_status
+            if not cert_status:
+                sp.info('Creating new ACM SSL certificate')
+                client.acm_generate_certificate()
+                sp.start('Waiting for the SSL certificate validation records...')
+                client.acm_wait_validation_records(timeout=wait_timeout)
+                cert_status = client.acm_get_certificate_status()
+                sp.succeed('Created SSL certificate: OK')
+            sp.succeed('Certificate status: %s ' % cert_status)
+
+            # Update the CNAME with ACM route53 data
+            if cert_status != "ISSUED":
+                if client.acm_update_route53_cname_records():
+                    sp.succeed('Set SSL certificate Route53 CNAME: OK')
+                sp.start('Waiting for the SSL certificate to be issued...')
+                try:
+                    client.acm_wait_certificate_issued(timeout=wait_timeout)
+                except WaitTimeout as ex:
+                    sp.fail(str(ex))
+                    print("The certificate is still being validated, "
+                          "run 's3lify setup' again later")
+                    footer()
+                    return
+                sp.succeed('Certificate status: ISSUED')
+
+            # Cloudfront
+            dist_id = site_status.distribution_id
+            if not dist_id:
+                sp.info('Creating cloudfront distribution id')
+                client.cloudfront_create_distribution()
+                dist_id = client.cloudfront_get_distribution_id()
+                sp.succeed('Distribution created: OK')
+            else:
+                changed = client.cloudfront_update_distribution()
+                if changed:
+                    sp.succeed('Distribution config updated: OK (%s)' % ", ".join(changed))
+                else:
+                    sp.succeed('Distribution config is up to date')
+            sp.succeed('Distribution ID: %s' % dist_id)
+            sp.succeed('Distribution Domain Name: %s' % client.cloudfront_get_distribution_domain_name())
+
+            # Add cloudfront domain name to A records
+            dns_change_id = client.cloudfront_update_route53_a_records()
+
+        # Wait for DNS propagation, while the distribution deploys
+        waits = {}
+        if dns_change_id:
+            waits["dns"] = lambda: client.route53_wait_change(dns_change_id, timeout=wait_timeout)
+        if distribution == 'cloudfront' and site.get('wait_deployed', True):
+            waits["distribution"] = lambda: client.cloudfront_wait_deployed(timeout=wait_timeout)
+        if waits:
+            sp.start('Waiting for %s...' % " and ".join(sorted(waits)))
+            try:
+                wait_all(waits)
+                sp.succeed('Ready: %s' % ", ".join(sorted(waits)))
+            except WaitTimeout as ex:
+                sp.warn('%s. The site will be available once done' % ex)
+
+            # DONE...
+    # S3
+    else:
+        sp.info('Site will be available from AWS S3 only')
+
+    sp.clear()
+    sp.succeed('Done!')
+    print("")
+    print("URL: %s " % client.domain_url)
+    print("S3 : %s " % client.s3_url)
+    footer()
 
 
 def main():
@@ -72,178 +663,266 @@ def main():
 
     # Good to go
 
-    # Load config
-    with open(CONFIG_FILE) as f:
-        config = yaml.safe_load(f)
-
-    domain_name = config.get("domain")
-    client = S3lify(domain=domain_name,
-                    aws_access_key_id=config.get("aws_access_key_id"),
-                    aws_secret_access_key=config.get("aws_secret_access_key"),
-                    region=config.get("aws_region"),
-                    )
-
-    distribution = config.get('distribution', 's3') or ''
-    if distribution not in ['s3', 'route53', 'cloudfront']:
-        distribution = 's3'
-    distribution = distribution.lower()
+    # Load config. Help doesn't need it, nor yaml which is slow to import
+    help_only = len(sys.argv) < 2 or "--help" in sys.argv[1:]
+    config = {}
+    if not help_only:
+        import yaml
+        with open(CONFIG_FILE) as f:
+            config = yaml.safe_load(f)
+
+    sites = get_sites(config) if not help_only else []
+    sites_concurrency = max(1, int(config.get("sites_concurrency") or DEFAULT_SITES_CONCURRENCY))
+    missing_domain = not all(site.get("domain") for site in sites)
+
+    # Sites share the AWS connections, sized for the sites uploading at the
+    # same time, and the files hashes
+    pool_size = None
+    if len(sites) > 1:
+        pool_size = min(sites_concurrency, len(sites)) * \
+                    max(upload_concurrency_limits(site.get("upload_concurrency"))[0]
+                        for site in sites)
+    clients = ClientPool(max_pool_connections=pool_size)
+    hash_cache = HashCache(CACHE_DIR)
+    sites = [(make_client(site, clients=clients, hash_cache=hash_cache), site)
+             for site in sites] if not missing_domain else []
+    multi_sites = len(sites) > 1
 
     @click.group()
-    def cli():
+    @click.option("--metrics", "metrics_file", metavar="FILE",
+                  help="Write the metrics of the AWS API calls as JSON to FILE, or '-' for stderr")
+    def cli(metrics_file):
         """ S3lify, a simple python tool to deploy SPA or static site to S3 using S3, Route53, Cloudfront and ACM """
+        if missing_domain:
+            header()
+            sp.fail("ERROR")
+            print("missing 'domain' in 's3lify.yml'")
+            footer()
+            sys.exit(1)
+
+        # The API calls of the command are grouped under its name
+        ctx = click.get_current_context()
+        clients.metrics.start_phase(ctx.invoked_subcommand)
+
+        def on_close():
+            clients.metrics.end_phase()
+            if metrics_file:
+                write_metrics(clients.metrics, metrics_file)
+        ctx.call_on_close(on_close)
 
     @cli.command()
     def setup():
         """
         To setup a brand new site
         """
+        # Sites are setup one after the other, as it may wait on AWS
+        for client, site in sites:
+            header(title="Setup", domain_name=client.domain)
+            setup_site(client, site)
 
-        header(title="Setup", domain_name=domain_name)
-
-        update_route53domains_dns = config.get('update_route53domains_dns')
-        if update_route53domains_dns is None:
-            update_route53domains_dns = True
-
-        print("")
-        sp.info('Distribution: %s' % distribution)
+    @cli.command()
+    @click.option("--resume", is_flag=True,
+                  help="Carry on with the interrupted deploy, skipping the files it uploaded")
+    def deploy(resume):
+        """
+        Deploy the site
+        """
 
-        if not client.site_exists:
-            client.s3_create_site()
-        sp.succeed("Site created on S3: OK")
+        if not multi_sites:
+            client, site = sites[0]
+            header(title="Deploy site", domain_name=client.domain)
+
+            if not client.site_exists:
+                site_404_message(client.domain)
+                footer()
+                return
+
+            report = deploy_site(client, site, sp, resume=resume)
+            if not report.ok:
+                deploy_failed_message(report)
+
+            sp.succeed('Site deployed successfully: OK')
+            sp.clear()
+            sp.succeed('Done!')
+            print("")
+            print("URL: %s " % client.domain_url)
+            print("S3 : %s " % client.s3_url)
+            footer()
+            return
 
-        # Distribution: s3|route53|cloudfront
-        #
-        if distribution in ["route53", "cloudfront"]:
-            # setup route53
-            client.s3_update_route53_a_records()
-            sp.succeed('DNS updated on Route53: OK')
+        header(title="Deploy %s sites" % len(sites))
 
-            # update domains DNS
-            if update_route53domains_dns is True:
-                if client.route53domains_update_dns():
-                    sp.succeed('Domain Name Servers updated: OK')
+        def deploy_one(client, site):
+            if not client.site_exists:
+                raise Exception("Site doesn't exist, or hasn't been setup yet")
+            return deploy_site(client, site, SiteLog(client.domain), resume=resume)
 
-            # cloudfront specific
-            if distribution == 'cloudfront':
+        start = time.time()
+        results = run_sites(sites, deploy_one, sites_concurrency)
 
-                # SSL: Certificate
-                cert_status = client.acm_get_certificate_status()
-                if not cert_status:
-                    sp.info('Creating new ACM SSL certificate')
-                    client.acm_generate_certificate()
-                    time.sleep(2)
-                    cert_status = client.acm_get_certificate_status()
-                    time.sleep(2)
-                    sp.succeed('Created SSL certificate: OK')
-                sp.succeed('Certificate status: %s ' % cert_status)
-
-                # Update the CNAME with ACM route53 data
-                if cert_status != "ISSUED":
-                    time.sleep(2)
-                    if client.acm_update_route53_cname_records():
-                        sp.succeed('Set SSL certificate Route53 CNAME: OK')
-
-                # Cloudfront
-                dist_id = client.cloudfront_get_distribution_id()
-                if not dist_id:
-                    sp.info('Creating cloudfront distribution id')
-                    time.sleep(2)
-                    client.cloudfront_create_distribution()
-                    dist_id = client.cloudfront_get_distribution_id()
-                    sp.succeed('Distribution created: OK')
-                sp.succeed('Distribution ID: %s' % dist_id)
-                sp.succeed('Distribution Domain Name: %s' % client.cloudfront_get_distribution_domain_name())
-
-                # Add cloudfront domain name to A records
-                client.cloudfront_update_route53_a_records()
-
-                time.sleep(2)
-
-                # DONE...
-        # S3
-        else:
-            sp.info('Site will be available from AWS S3 only')
+        print("")
+        rows = []
+        failed = 0
+        for (client, site), (report, ex) in zip(sites, results):
+            if ex is not None:
+                rows.append((client.domain, "FAILED", ex))
+            elif not report.ok:
+                rows.append((client.domain, "FAILED", report.summary))
+            else:
+                rows.append((client.domain, "OK", "%s in %.2fs" % (report.summary, report.elapsed)))
+            failed += rows[-1][1] != "OK"
+        sites_report(("SITE", "STATUS", "DETAILS"), rows)
+
+        for report, ex in results:
+            if report and report.failed:
+                print("")
+                print("%s:" % report.domain)
+                for s3_path, ex in report.failed:
+                    print("  %s: %s" % (s3_path, ex))
 
-        sp.clear()
-        sp.succeed('Done!')
         print("")
-        print("URL: %s " % client.domain_url)
-        print("S3 : %s " % client.s3_url)
+        if failed:
+            sp.fail('%s of %s sites failed to deploy in %.2fs' % (failed, len(sites), time.time() - start))
+            footer()
+            sys.exit(1)
+        sp.succeed('%s sites deployed successfully in %.2fs' % (len(sites), time.time() - start))
         footer()
 
     @cli.command()
-    def deploy():
+    @click.option("--poll", is_flag=True, help="Poll the site directory, instead of using inotify")
+    @click.option("--interval", type=float, default=1.0, show_default=True,
+                  help="Seconds between polls")
+    @click.option("--debounce", type=float, default=0.3, show_default=True,
+                  help="Seconds without changes before pushing them")
+    def watch(poll, interval, debounce):
         """
-        Deploy the site
+        Push the changes of the site directory as they happen
         """
+        from .watch import Watcher
 
-        header(title="Deploy site", domain_name=domain_name)
-
+        client, site = sites[0]
+        header(title="Watch site", domain_name=client.domain)
+        if multi_sites:
+            sp.fail("ERROR")
+            print("watch works on one site, with 'domain' in 's3lify.yml'")
+            footer()
+            sys.exit(1)
+        if site.get('releases'):
+            sp.fail("ERROR")
+            print("watch can't be used with 'releases'")
+            footer()
+            sys.exit(1)
         if not client.site_exists:
-            site_404_message(domain_name)
+            site_404_message(client.domain)
             footer()
             return
 
-        site_directory = os.path.join(CWD, config.get('site_directory'))
-        client.s3_create_manifest()
-        sp.succeed('Manifest file created: OK')
-
-        if not config.get('purge_files'):
-            sp.warn('config.purge_files is disabled')
-        else:
-            exclude_files = config.get("purge_exclude_files", [])
-            client.s3_purge_files(exclude_files=exclude_files)
-            sp.succeed('Files purged from S3: OK')
+        site_directory = os.path.join(CWD, site.get('site_directory'))
+        watcher = Watcher(site_directory,
+                          ignore=client.ignore_rules,
+                          follow_symlinks=client.follow_symlinks,
+                          debounce=debounce,
+                          interval=interval,
+                          poll=poll)
+        # Changes made during the sync are pushed next
+        watcher.start()
 
-        if not config.get('invalidate_cloudfront_objects'):
-            sp.warn('invalidate_cloudfront_objects is False')
-        else:
-            client.cloudfront_invalidate_objects()
-            sp.succeed('Invalidated cloudfront objects: OK')
-
-        sp.info('uploading site directory to S3...')
-        client.s3_upload(site_directory)
-        sp.succeed('Site files uploaded: OK')
-        sp.succeed('Site deployed successfully: OK')
-        sp.clear()
-        sp.succeed('Done!')
         print("")
-        print("URL: %s " % client.domain_url)
-        print("S3 : %s " % client.s3_url)
+        sp.info('syncing site directory to S3...')
+        sync = client.s3_sync(site_directory,
+                              delete=bool(site.get('purge_files')),
+                              exclude_files=site.get("purge_exclude_files", []))
+        if not sync.upload.ok:
+            watcher.stop()
+            report = DeployReport(client.domain)
+            report.ok = False
+            report.failed = sync.upload.failed
+            report.summary = "%s files failed to upload" % len(sync.upload.failed)
+            deploy_failed_message(report)
+        sp.succeed('Site files synced: OK (%s uploaded, %s deleted, %s unchanged)'
+                   % (len(sync.upload.succeeded), len(sync.deleted), sync.unchanged))
+        if not sync.delete.ok:
+            delete_failed_message(sync.delete, sp)
+        if sync.changed_keys and get_distribution(site) == 'cloudfront' \
+                and site.get('invalidate_cloudfront_objects'):
+            client.cloudfront_invalidate_objects(
+                keys=sync.changed_keys,
+                max_paths=site.get('invalidation_max_paths') or DEFAULT_INVALIDATION_MAX_PATHS,
+                index_file=site.get('index_file') or 'index.html')
+
+        watch_site(client, site, watcher)
         footer()
 
+    @cli.command()
+    @click.argument("release_id", required=False)
+    def rollback(release_id):
+        """
+        Switch the site back to the previous release, or to RELEASE_ID
+        """
+        failed = 0
+        for client, site in sites:
+            header(title="Rollback", domain_name=client.domain)
+            failed += not rollback_site(client, site, release_id)
+            footer()
+        if failed:
+            sys.exit(1)
+
     @cli.command()
     def status():
         """
         Show status and info of the site
         """
 
-        header(title="Site Status", domain_name=domain_name)
+        if multi_sites:
+            header(title="Sites Status")
+            results = run_sites(sites, lambda client, site: client.get_status(get_distribution(site)),
+                                sites_concurrency)
+            rows = []
+            for (client, site), (site_status, ex) in zip(sites, results):
+                if ex is not None:
+                    rows.append((client.domain, get_distribution(site), "ERROR: %s" % ex, "", "", ""))
+                elif not site_status.site_exists:
+                    rows.append((client.domain, site_status.distribution, "Not setup", "", "", ""))
+                else:
+                    rows.append((client.domain, site_status.distribution, "OK",
+                                 site_status.certificate_status or "-",
+                                 site_status.distribution_id or "-",
+                                 site_status.domain_url))
+            sites_report(("SITE", "DISTRIBUTION", "S3", "CERTIFICATE", "DISTRIBUTION ID", "URL"), rows)
+            footer()
+            return
 
-        if not client.site_exists:
-            site_404_message(config.get("domain"))
+        client, site = sites[0]
+        distribution = get_distribution(site)
+        header(title="Site Status", domain_name=client.domain)
+
+        site_status = client.get_status(distribution)
+        if not site_status.site_exists:
+            site_404_message(client.domain)
             footer()
             return
 
         print("---")
-        print("URL : %s " % client.domain_url)
+        print("URL : %s " % site_status.domain_url)
         
         print("---")
         print("S3")
-        print("Site created: %s " % ('OK' if client.site_exists else 'Failed'))
-        print("URL : %s " % client.s3_url)
+        print("Site created: %s " % ('OK' if site_status.site_exists else 'Failed'))
+        print("URL : %s " % site_status.s3_url)
 
         if distribution != "s3":
             print("---")
             print("ACM")
-            print("Certificate status: %s " % client.acm_get_certificate_status())
+            print("Certificate status: %s " % site_status.certificate_status)
 
             print("---")
             print("Cloudfront")
-            print("Distribution id: %s " % client.cloudfront_get_distribution_id())
-            print("Domain name: %s " % client.cloudfront_get_distribution_domain_name())
+            print("Distribution id: %s " % site_status.distribution_id)
+            print("Domain name: %s " % site_status.distribution_domain_name)
+            if site.get("releases"):
+                print("Live release: %s " % client.release_get_live())
 
-            ns_values = client.route53_get_ns_values()
+            ns_values = site_status.ns_values
             if ns_values:
                 print("---")
                 print("Name Servers")
@@ -253,5 +932,8 @@ def main():
         footer()
 
     # Init cli
-    print('Domain: %s' % client.domain)
+    if multi_sites:
+        print('Sites: %s' % ", ".join(client.domain for client, _ in sites))
+    elif sites:
+        print('Domain: %s' % sites[0][0].domain)
     cli()
@@ -0,0 +1,78 @@
+"""
+S3lify clients
+
+AWS clients, created on first use. boto3 clients are thread safe, so one
+pool can be shared by many sites: sites with the same credentials and
+region use the same clients, and the same HTTP connections.
+The lookups of the whole account, ie: the index of the distributions, are
+shared the same way, so they are made once per run.
+"""
+
+import threading
+from .metrics import Metrics
+from .lookupcache import LookupCache
+
+
+class ClientPool(object):
+    """
+    AWS clients by service, credentials and region
+    """
+
+    def __init__(self, max_pool_connections=None):
+        """
+        :param max_pool_connections: int - min size of the clients
+                                     connection pools, ie: when shared by sites
+                                     uploading at the same time
+        """
+        self.max_pool_connections = max_pool_connections
+        # The API calls of all the clients are recorded
+        self.metrics = Metrics()
+        self._clients = {}
+        self._lookup_caches = {}
+        # boto3 default session is not thread safe, clients are created one at a time
+        self._lock = threading.Lock()
+
+    def get(self, service, aws_params, max_pool_connections=None):
+        """
+        Return the client of a service, creating it on first use
+        :param service: str
+        :param aws_params: dict - aws_access_key_id, aws_secret_access_key, region_name
+        :param max_pool_connections: int - size of the client connection pool
+        :return: boto3 client
+        """
+        key = (service,) + tuple(sorted(aws_params.items()))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                if key not in self._clients:
+                    import boto3
+                    import botocore.config
+                    pool_size = max(max_pool_connections or 0, self.max_pool_connections or 0)
+                    config = botocore.config.Config(max_pool_connections=pool_size) \
+                        if pool_size else None
+                    client = boto3.client(service, config=config, **aws_params)
+                    self.metrics.register(client)
+                    self._clients[key] = client
+                client = self._clients[key]
+        return client
+
+    def lookup_cache(self, aws_params):
+        """
+        Return the session cache of the lookups of an account, shared by the
+        sites with the same credentials
+        :param aws_params: dict - aws_access_key_id, aws_secret_access_key
+        :return: LookupCache
+        """
+        key = (aws_params.get("aws_access_key_id"), aws_params.get("aws_secret_access_key"))
+        with self._lock:
+            if key not in self._lookup_caches:
+                self._lookup_caches[key] = LookupCache(namespace=key[0] or "")
+            return self._lookup_caches[key]
+
+    @property
+    def services(self):
+        """
+        The services with a client created
+        :return: list
+        """
+        return sorted(set(key[0] for key in self._clients))
@@ -0,0 +1,158 @@
+"""
+S3lify compression
+
+Compress text assets before upload, so S3 websites serve them with a
+Content-Encoding. Compression runs in a process pool, shared with the image
+optimization, and the compressed files are cached by the md5 of their content.
+Compressed files not used for a month are deleted from the cache.
+"""
+
+import os
+import gzip
+import shutil
+import tempfile
+from . import cachedir
+from .processes import ProcessPool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = {
+    "gzip": ".gz",
+    "br": ".br",
+}
+
+COMPRESSIBLE_MIMETYPES = [
+    'application/javascript',
+    'application/json',
+    'application/manifest+json',
+    'application/xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'application/wasm',
+    'application/x-font-truetype',
+    'application/x-font-opentype',
+    'application/vnd.ms-fontobject',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+]
+
+# Compressed files that are not smaller than this ratio of the original
+# are uploaded as is
+DEFAULT_MIN_RATIO = 0.9
+
+# Files smaller than this are not worth compressing
+MIN_SIZE = 256
+
+
+def is_compressible(mimetype):
+    """
+    Check if a mimetype is worth compressing
+    :param mimetype: str
+    :return: bool
+    """
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+class Compressor(object):
+    """
+    Compress files in a process pool, with a cache of the compressed files.
+    To use as a context manager around the uploads.
+    """
+
+    def __init__(self, encoding, cache_dir, min_ratio=DEFAULT_MIN_RATIO, workers=None, pool=None,
+                 max_age=cachedir.DEFAULT_MAX_AGE):
+        """
+        :param encoding: str - gzip | br
+        :param cache_dir: str - the directory to keep the compressed files
+        :param min_ratio: float - max compressed/original size ratio to use the compressed file
+        :param workers: int - number of processes. Default: number of CPUs
+        :param pool: ProcessPool - to share with other users, instead of its own
+        :param max_age: int - seconds to keep the compressed files not used
+        """
+        if encoding not in ENCODINGS:
+            raise Exception("Invalid compression encoding '%s'. "
+                            "Must be one of: %s" % (encoding, ", ".join(ENCODINGS)))
+        if encoding == "br" and brotli is None:
+            raise Exception("Brotli compression requires the 'brotli' package. "
+                            "Run 'pip install s3lify[brotli]'")
+        self.encoding = encoding
+        self.cache_dir = os.path.join(cache_dir, "compressed")
+        self.min_ratio = min_ratio
+        self.pool = pool or ProcessPool(workers)
+        self.max_age = max_age
+
+    def __enter__(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.pool.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.__exit__(*exc)
+        cachedir.prune(self.cache_dir, self.max_age)
+
+    def _cache_path(self, md5):
+        return os.path.join(self.cache_dir, md5 + ENCODINGS[self.encoding])
+
+    def compression(self, mimetype, size):
+        """
+        Return the encoding a file is compressed with, whether the compressed
+        file is kept or not. It doesn't depend on the cache, so it can be
+        compared with the manifest of a deploy made from anywhere
+        :param mimetype: str
+        :param size: int
+        :return: str or None
+        """
+        if not is_compressible(mimetype) or size < MIN_SIZE:
+            return None
+        return self.encoding
+
+    def compress(self, local_path, mimetype, md5):
+        """
+        Return the path of the compressed file, or None if it's not worth it.
+        It blocks until the file is compressed.
+        :param local_path: str
+        :param mimetype: str
+        :param md5: str - the md5 of the file content
+        :return: str or None
+        """
+        if self.compression(mimetype, os.path.getsize(local_path)) is None:
+            return None
+        out_path = self._cache_path(md5)
+        if cachedir.touch(out_path):
+            return out_path
+        if cachedir.touch(out_path + ".skip"):
+            return None
+        return self.pool.submit(_compress_file, local_path, out_path,
+                                self.encoding, self.min_ratio).result()
+
+
+def _compress_file(local_path, out_path, encoding, min_ratio):
+    """
+    Compress a file into out_path. Runs in the process pool.
+    When it doesn't pay off, an empty `.skip` file is written instead
+    :return: str - out_path, or None
+    """
+    cache_dir = os.path.dirname(out_path)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with open(local_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if encoding == "br":
+                dst.write(brotli.compress(src.read()))
+            else:
+                with gzip.GzipFile(fileobj=dst, mode="wb", mtime=0, filename="") as gz:
+                    shutil.copyfileobj(src, gz)
+        if os.path.getsize(tmp) > os.path.getsize(local_path) * min_ratio:
+            os.remove(tmp)
+            open(out_path + ".skip", "w").close()
+            return None
+        os.replace(tmp, out_path)
+        return out_path
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,139 @@
+"""
+S3lify hash cache
+
+Keeps the md5 of the files on disk, by path, size and mtime, so files that
+haven't changed are never read again to be hashed.
+"""
+
+import os
+import json
+import mmap
+import time
+import threading
+
+VERSION = 1
+
+FILENAME = "hashes.json"
+
+# Size of the blocks read when hashing a file
+HASH_BLOCKSIZE = 1024 * 1024
+
+# Files modified less than this many seconds before being hashed are not
+# cached, as they may still change within the same mtime
+RACY_WINDOW = 2
+
+
+def file_md5(local_path):
+    """
+    Return the hex md5 of a file. Big files are mapped in memory
+    :param local_path: str
+    :return: str
+    """
+    import hashlib
+    md5 = hashlib.md5()
+    with open(local_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > HASH_BLOCKSIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for i in range(0, size, HASH_BLOCKSIZE):
+                    md5.update(m[i:i + HASH_BLOCKSIZE])
+        else:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+class HashCache(object):
+    """
+    On disk cache of the files md5.
+    Entries are keyed by the path relative to `root`, and are valid as long
+    as the size and mtime_ns of the file are the same.
+    """
+
+    def __init__(self, cache_dir, root=None):
+        """
+        :param cache_dir: str - the directory holding the cache file
+        :param root: str - the directory the paths are relative to.
+                    Default: the parent of cache_dir
+        """
+        self.path = os.path.join(cache_dir, FILENAME)
+        self.root = root or os.path.dirname(os.path.abspath(cache_dir))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries = None
+
+    def _load(self):
+        """
+        Load the cache file, on first use.
+        A missing, corrupted or outdated cache is empty
+        :return: dict
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") != VERSION:
+                return {}
+            entries = data["entries"]
+            for key, entry in entries.items():
+                size, mtime_ns, md5 = entry
+                if not isinstance(size, int) or not isinstance(mtime_ns, int) \
+                        or len(md5) != 32:
+                    return {}
+            return entries
+        except Exception as ex:
+            return {}
+
+    def md5(self, local_path):
+        """
+        Return the md5 of a file, from the cache if it hasn't changed
+        :param local_path: str
+        :return: str
+        """
+        key = os.path.relpath(os.path.abspath(local_path), self.root)
+        st = os.stat(local_path)
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self._load()
+        entry = self._entries.get(key)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.hits += 1
+            return entry[2]
+
+        md5 = file_md5(local_path)
+        with self._lock:
+            self.misses += 1
+            if st.st_mtime_ns < (time.time() - RACY_WINDOW) * 1e9:
+                self._entries[key] = [st.st_size, st.st_mtime_ns, md5]
+                self._dirty = True
+            else:
+                self._entries.pop(key, None)
+        return md5
+
+    def save(self):
+        """
+        Write the cache, dropping the entries of files that no longer exist.
+        The file is replaced atomically
+        :return:
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict((k, v) for k, v in self._entries.items()
+                           if os.path.isfile(os.path.join(self.root, k)))
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=FILENAME)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"version": VERSION, "entries": entries}, f,
+                              separators=(",", ":"))
+                os.replace(tmp, self.path)
+            except Exception:
+                os.remove(tmp)
+                raise
+            self._entries = entries
+            self._dirty = False
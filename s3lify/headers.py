@@ -0,0 +1,91 @@
+"""
+S3lify headers
+
+The headers of the uploaded files, ie: Cache-Control, from the rules of
+s3lify.yml:
+
+    headers:
+      - match: fingerprinted
+        cache_control: public, max-age=31536000, immutable
+      - match: ["*.html", "*.json"]
+        cache_control: no-cache
+
+The first rule matching the path of a file gives its headers. The patterns
+are the ones of s3lify.patterns. The rules are compiled once into a single
+regex, so a file costs one match.
+"""
+
+import re
+from .patterns import translate
+
+# Special pattern of the files with a content hash in their name,
+# ie: app.3f2a9c1b.js, index-BQ4Ob2Ea.css, chunk.5e1f0a2c9d.min.js
+FINGERPRINTED = "fingerprinted"
+FINGERPRINT_PATTERN = r"(?:.*/)?[^/]*[.\-_](?=[A-Za-z0-9]*[0-9])(?=[A-Za-z0-9]*[A-Za-z])[A-Za-z0-9]{8,}(?:\.[^/.]+)+\Z"
+
+# Rule settings, and their S3 upload arguments
+HEADERS = {
+    "cache_control": "CacheControl",
+    "content_disposition": "ContentDisposition",
+    "content_language": "ContentLanguage",
+    "metadata": "Metadata",
+}
+
+
+def compile_pattern(pattern):
+    """
+    Return the regex of a rule pattern
+    :param pattern: str - a path pattern, or 'fingerprinted'
+    :return: str
+    """
+    if pattern == FINGERPRINTED:
+        return FINGERPRINT_PATTERN
+    return translate(pattern)
+
+
+class HeaderPolicy(object):
+    """
+    Headers of the files, by path
+    """
+
+    def __init__(self, rules=None):
+        """
+        :param rules: list of dict - with 'match', a pattern or a list of
+                      patterns, and the headers: cache_control,
+                      content_disposition, content_language, metadata
+        """
+        self.rules = rules or []
+        self._headers = {}
+        groups = []
+        for i, rule in enumerate(self.rules):
+            patterns = rule.get("match")
+            if not patterns:
+                raise Exception("Missing 'match' in headers rule: %s" % rule)
+            if not isinstance(patterns, list):
+                patterns = [patterns]
+            headers = {}
+            for name, value in rule.items():
+                if name == "match":
+                    continue
+                if name not in HEADERS:
+                    raise Exception("Unknown header '%s' in headers rule, expected: %s"
+                                    % (name, ", ".join(sorted(HEADERS))))
+                if name == "metadata":
+                    value = dict((str(k), str(v)) for k, v in value.items())
+                headers[HEADERS[name]] = value
+            group = "r%s" % i
+            self._headers[group] = headers
+            groups.append("(?P<%s>%s)" % (group, "|".join(compile_pattern(p) for p in patterns)))
+        # Alternatives are tried in order, so the first rule matching wins
+        self._regex = re.compile("|".join(groups)) if groups else None
+
+    def headers(self, key):
+        """
+        Return the upload arguments of a file. Not to be modified
+        :param key: str - the path of the file in the site
+        :return: dict - ie: {"CacheControl": "no-cache"}
+        """
+        if self._regex is None:
+            return {}
+        m = self._regex.match(key)
+        return self._headers[m.lastgroup] if m else {}
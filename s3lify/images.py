@@ -0,0 +1,197 @@
+"""
+S3lify images
+
+Recompress PNG and JPEG files before upload, and optionally make a WebP
+variant of each, uploaded next to it at '<key>.webp'. Images are processed
+in a process pool, and the results are cached by the md5 of their content,
+so unchanged images cost nothing on later deploys. Results not used for
+a month are deleted from the cache.
+
+PNG files are always recompressed losslessly. JPEG files keep their
+quantization tables, unless a quality is set. Images that don't get
+smaller are uploaded as they are.
+Requires Pillow: 'pip install s3lify[images]'
+"""
+
+import os
+import tempfile
+from . import cachedir
+from .processes import ProcessPool
+
+OPTIMIZABLE_MIMETYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+}
+
+WEBP_SUFFIX = ".webp"
+
+DEFAULT_WEBP_QUALITY = 80
+
+# Optimized images that are not smaller than this ratio of the original
+# are uploaded as is
+DEFAULT_MIN_RATIO = 0.98
+
+
+class ImageOptimizer(object):
+    """
+    Optimize images in a process pool, with a cache of the results.
+    To use as a context manager around the uploads.
+    """
+
+    def __init__(self, cache_dir, quality=None, webp=False, webp_quality=DEFAULT_WEBP_QUALITY,
+                 min_ratio=DEFAULT_MIN_RATIO, workers=None, pool=None,
+                 max_age=cachedir.DEFAULT_MAX_AGE):
+        """
+        :param cache_dir: str - the directory to keep the optimized images
+        :param quality: int - 1-100, the JPEG quality. Default: keep the original one
+        :param webp: bool - to make the WebP variants
+        :param webp_quality: int - 1-100, the WebP quality
+        :param min_ratio: float - max optimized/original size ratio to use the optimized file
+        :param workers: int - number of processes. Default: number of CPUs
+        :param pool: ProcessPool - to share with other users, instead of its own
+        :param max_age: int - seconds to keep the results not used
+        """
+        try:
+            import PIL
+        except ImportError:
+            raise Exception("Image optimization requires the 'Pillow' package. "
+                            "Run 'pip install s3lify[images]'")
+        for name, value in (("quality", quality), ("webp_quality", webp_quality)):
+            if value is not None and not (isinstance(value, int) and 1 <= value <= 100):
+                raise Exception("Invalid image %s '%s'. Must be from 1 to 100" % (name, value))
+        self.cache_dir = os.path.join(cache_dir, "images")
+        self.quality = quality
+        self.webp = bool(webp)
+        self.webp_quality = webp_quality
+        self.min_ratio = min_ratio
+        self.pool = pool or ProcessPool(workers)
+        self.max_age = max_age
+
+    def __enter__(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.pool.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.__exit__(*exc)
+        cachedir.prune(self.cache_dir, self.max_age)
+
+    @property
+    def settings(self):
+        """
+        The settings images are optimized with, kept in the manifest so a
+        change of settings uploads them again
+        :return: str
+        """
+        return "q%s" % self.quality if self.quality else "lossless"
+
+    def is_optimizable(self, mimetype):
+        return mimetype in OPTIMIZABLE_MIMETYPES
+
+    def variants(self, key, mimetype):
+        """
+        Return the keys of the variants of an image
+        :param key: str
+        :param mimetype: str
+        :return: list
+        """
+        if self.webp and self.is_optimizable(mimetype):
+            return [key + WEBP_SUFFIX]
+        return []
+
+    def optimize(self, local_path, mimetype, md5):
+        """
+        Return the path of the optimized image, or None if it's not smaller.
+        It blocks until the image is optimized.
+        :param local_path: str
+        :param mimetype: str
+        :param md5: str - the md5 of the file content
+        :return: str or None
+        """
+        out_path = os.path.join(self.cache_dir, "%s-%s%s" % (md5, self.settings,
+                                                             OPTIMIZABLE_MIMETYPES[mimetype]))
+        if cachedir.touch(out_path):
+            return out_path
+        if cachedir.touch(out_path + ".skip"):
+            return None
+        return self.pool.submit(_optimize_image, local_path, out_path, mimetype,
+                                self.quality, self.min_ratio).result()
+
+    def make_webp(self, local_path, mimetype, md5):
+        """
+        Return the path of the WebP variant of an image.
+        It blocks until the variant is made.
+        :param local_path: str
+        :param mimetype: str
+        :param md5: str - the md5 of the file content
+        :return: str
+        """
+        lossless = mimetype == "image/png" and not self.quality
+        out_path = os.path.join(self.cache_dir, "%s-%s%s" % (
+            md5, "lossless" if lossless else "q%s" % self.webp_quality, WEBP_SUFFIX))
+        if cachedir.touch(out_path):
+            return out_path
+        return self.pool.submit(_make_webp, local_path, out_path,
+                                self.webp_quality, lossless).result()
+
+
+def _optimize_image(local_path, out_path, mimetype, quality, min_ratio):
+    """
+    Optimize an image into out_path. Runs in the process pool.
+    When it doesn't pay off, an empty `.skip` file is written instead
+    :return: str - out_path, or None
+    """
+    from PIL import Image
+    with Image.open(local_path) as im:
+        # Only the first frame would be kept
+        if getattr(im, "is_animated", False):
+            open(out_path + ".skip", "w").close()
+            return None
+        # Colors and orientation are kept
+        options = {"optimize": True}
+        for name in ("icc_profile", "exif"):
+            if im.info.get(name):
+                options[name] = im.info[name]
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(out_path))
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                if mimetype == "image/png":
+                    im.save(dst, "PNG", **options)
+                else:
+                    im.save(dst, "JPEG", quality=quality or "keep", progressive=True, **options)
+            if os.path.getsize(tmp) > os.path.getsize(local_path) * min_ratio:
+                os.remove(tmp)
+                open(out_path + ".skip", "w").close()
+                return None
+            os.replace(tmp, out_path)
+            return out_path
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def _make_webp(local_path, out_path, quality, lossless):
+    """
+    Write the WebP variant of an image into out_path. Runs in the process pool
+    :return: str - out_path
+    """
+    from PIL import Image, ImageOps
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(out_path))
+    try:
+        with Image.open(local_path) as im, os.fdopen(fd, "wb") as dst:
+            # The variant has no EXIF, the orientation is applied instead
+            im = ImageOps.exif_transpose(im)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "transparency" in im.info or "A" in im.mode else "RGB")
+            options = {"quality": quality, "lossless": lossless, "method": 4}
+            if im.info.get("icc_profile"):
+                options["icc_profile"] = im.info["icc_profile"]
+            im.save(dst, "WEBP", **options)
+        os.replace(tmp, out_path)
+        return out_path
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
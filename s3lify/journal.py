@@ -0,0 +1,133 @@
+"""
+S3lify journal
+
+Local checkpoint of a deploy: the files are appended to it as soon as they
+are on S3, with their manifest record. When a deploy is interrupted, ie: by
+a CI timeout or Ctrl-C, `s3lify deploy --resume` skips the files of the
+journal that haven't changed since, and only uploads the rest.
+The journal is deleted once the deploy completes.
+
+The first line holds the deploy settings, ie: the release id. Each other
+line is a manifest record. A line cut by the interruption is ignored.
+"""
+
+import os
+import json
+import time
+import threading
+
+VERSION = 1
+
+
+class Journal(object):
+    """
+    Append only journal of the files uploaded by a deploy of a site
+    """
+
+    def __init__(self, cache_dir, domain):
+        """
+        :param cache_dir: str - the directory holding the journal
+        :param domain: str - the site
+        """
+        self.path = os.path.join(cache_dir, "journal-%s.jsonl" % domain)
+        self.info = {}
+        self.records = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """
+        If a deploy is recorded
+        :return: bool
+        """
+        return self._file is not None
+
+    def exists(self):
+        """
+        If an interrupted deploy left a journal
+        :return: bool
+        """
+        return os.path.isfile(self.path)
+
+    def start(self, **info):
+        """
+        Start the journal of a new deploy, replacing any previous one
+        :param info: the deploy settings, ie: mode, release_id
+        """
+        self.close()
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.info = dict(info, version=VERSION, started_at=int(time.time()))
+        self.records = {}
+        # Line buffered, so each record is written as soon as it's added
+        self._file = open(self.path, "w", buffering=1)
+        self._file.write(json.dumps(self.info) + "\n")
+
+    def resume(self):
+        """
+        Load the journal of an interrupted deploy, to carry on recording it
+        :return: bool - False if there is no journal to resume
+        """
+        self.close()
+        try:
+            with open(self.path) as f:
+                info = json.loads(f.readline())
+                if info.get("version") != VERSION:
+                    return False
+                records = {}
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    records[record["key"]] = record
+        except (IOError, OSError, ValueError):
+            return False
+        self.info = info
+        self.records = records
+        # Rewritten without the cut line, if any, then appended to
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps(self.info) + "\n")
+            for record in records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", buffering=1)
+        return True
+
+    def get(self, key):
+        """
+        Return the record of a file already uploaded
+        :param key: str - the path of the file in the site
+        :return: dict, or None
+        """
+        return self.records.get(key)
+
+    def add(self, record):
+        """
+        Record a file uploaded
+        :param record: dict - its manifest record
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self.records[record["key"]] = record
+            self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """
+        Delete the journal, once the deploy is complete
+        """
+        self.close()
+        self.info = {}
+        self.records = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
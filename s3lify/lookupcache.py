@@ -0,0 +1,127 @@
+"""
+S3lify lookup cache
+
+Keeps the result of the AWS lookups (certificate ARN, distribution, hosted
+zone...) for the session, so they are listed once per run. Lookups that
+found nothing are not cached.
+With a TTL, found resources are also kept on disk for that many seconds, so
+CLI runs close to each other skip the list calls.
+"""
+
+import os
+import json
+import time
+import threading
+
+VERSION = 1
+
+FILENAME = "lookups.json"
+
+
+class LookupCache(object):
+    """
+    Cache of lookups by name. Names are scoped by `namespace`, ie: the
+    region and domain, in the disk cache.
+    """
+
+    def __init__(self, namespace, cache_dir=None, ttl=0):
+        """
+        :param namespace: str
+        :param cache_dir: str - the directory holding the disk cache
+        :param ttl: int - seconds to keep the lookups on disk. 0 to disable
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.path = os.path.join(cache_dir, FILENAME) if cache_dir and ttl else None
+        self._values = {}
+        self._lock = threading.Lock()
+        self._lookup_locks = {}
+
+    def get(self, name, lookup, persist=True):
+        """
+        Return the value of a lookup, running it if it is not in the cache
+        :param name: str
+        :param lookup: callable
+        :param persist: bool - False to keep it for the session only
+        :return: the value
+        """
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+            lookup_lock = self._lookup_locks.setdefault(name, threading.Lock())
+
+        # Sites looking up the same name at the same time wait for the first one
+        with lookup_lock:
+            with self._lock:
+                if name in self._values:
+                    return self._values[name]
+                disk = self._load()
+                entry = disk.get(self._key(name))
+                if entry and entry[0] > time.time():
+                    self._values[name] = entry[1]
+                    return entry[1]
+
+            value = lookup()
+            # Missing resources are not cached: they are about to be created,
+            # and may not be listed right after their creation
+            if value is None:
+                return value
+            with self._lock:
+                self._values[name] = value
+                if self.path and persist:
+                    disk = self._load()
+                    disk[self._key(name)] = [time.time() + self.ttl, value]
+                    self._save(disk)
+            return value
+
+    def invalidate(self, *names):
+        """
+        Drop lookups, ie: after the resource has been created
+        :param names: the lookups names. None for all of them
+        :return:
+        """
+        with self._lock:
+            if not names:
+                names = list(self._values)
+            for name in names:
+                self._values.pop(name, None)
+            if self.path:
+                disk = self._load()
+                for name in names:
+                    disk.pop(self._key(name), None)
+                self._save(disk)
+
+    def _key(self, name):
+        return "%s:%s" % (self.namespace, name)
+
+    def _load(self):
+        """
+        Load the disk cache, without the expired entries.
+        A missing or corrupted cache is empty
+        :return: dict
+        """
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") != VERSION:
+                return {}
+            now = time.time()
+            return dict((k, v) for k, v in data["entries"].items() if v[0] > now)
+        except Exception as ex:
+            return {}
+
+    def _save(self, entries):
+        cache_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=FILENAME)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": VERSION, "entries": entries}, f, default=str)
+            os.replace(tmp, self.path)
+        except (IOError, OSError):
+            # The disk cache is only an optimization
+            pass
@@ -0,0 +1,128 @@
+"""
+S3lify manifest
+
+The manifest is a gzipped file of JSON lines. The first line is the header
+with the format version, then one line per object:
+
+    {"s3lify_manifest": 2}
+    {"key": "index.html", "size": 1024, "hash": "<md5>", "content_type": "text/html",
+     "content_encoding": "gzip", "headers": {"CacheControl": "no-cache"},
+     "uploaded_at": 1700000000}
+
+size and hash are the ones of the local file, before any compression or
+image optimization. Compressed files also have "compressed", the encoding
+they were compressed with, even when the compressed file was not smaller
+and they were uploaded as they are. Optimized images also have "optimized",
+the settings they were optimized with, and "variants", the keys uploaded
+next to them, ie: ["img/logo.png.webp"].
+
+Version 1 was a comma separated list of keys. It is still readable.
+"""
+
+import gzip
+import json
+
+VERSION = 2
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+CONTENT_TYPE = "application/gzip"
+
+
+def record(key, size=None, hash=None, content_type=None, content_encoding=None,
+           headers=None, uploaded_at=None, compressed=None, optimized=None, variants=None):
+    """
+    Return a manifest record
+    :param key: str - the S3 key
+    :param size: int
+    :param hash: str - the md5 of the content, or the ETag of the object
+    :param content_type: str
+    :param content_encoding: str
+    :param headers: dict - the other upload arguments, ie: CacheControl
+    :param uploaded_at: int - timestamp
+    :param compressed: str - the encoding the file was compressed with, ie: gzip
+    :param optimized: str - the image optimization settings, ie: lossless
+    :param variants: list - the keys of the variants, ie: the WebP image
+    :return: dict
+    """
+    r = {
+        "key": key,
+        "size": size,
+        "hash": hash,
+        "content_type": content_type,
+        "content_encoding": content_encoding,
+        "headers": headers,
+        "uploaded_at": uploaded_at
+    }
+    # Only compressed files and images have them, to keep the manifest small
+    if compressed:
+        r["compressed"] = compressed
+    if optimized:
+        r["optimized"] = optimized
+    if variants:
+        r["variants"] = variants
+    return r
+
+
+def dumps(records):
+    """
+    Return the compressed manifest of records
+    :param records: iterable of dict, or str for keys only
+    :return: bytes
+    """
+    lines = [json.dumps({"s3lify_manifest": VERSION})]
+    for r in records:
+        if not isinstance(r, dict):
+            r = record(r)
+        lines.append(json.dumps(r, separators=(",", ":")))
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def iter_records(fileobj):
+    """
+    Yield the records of a manifest, reading it as a stream
+    :param fileobj: a file like object with `read`
+    :return: generator of dict
+    """
+    head = fileobj.read(len(GZIP_MAGIC))
+    if not head:
+        return
+    stream = _PrefixedReader(head, fileobj)
+
+    # Version 1: comma separated keys
+    if head != GZIP_MAGIC:
+        data = stream.read().decode("utf-8")
+        for key in data.split(","):
+            if key:
+                yield record(key)
+        return
+
+    with gzip.GzipFile(fileobj=stream, mode="rb") as f:
+        header = json.loads(f.readline().decode("utf-8"))
+        version = header.get("s3lify_manifest")
+        if version != VERSION:
+            raise ValueError("Unsupported manifest version: %s" % version)
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode("utf-8"))
+
+
+class _PrefixedReader(object):
+    """
+    A reader that gives back bytes already read from a stream,
+    because S3 streams can't seek
+    """
+
+    def __init__(self, prefix, fileobj):
+        self._prefix = prefix
+        self._fileobj = fileobj
+
+    def read(self, size=-1):
+        prefix, self._prefix = self._prefix, b""
+        if size is None or size < 0:
+            return prefix + self._fileobj.read()
+        if len(prefix) >= size:
+            self._prefix = prefix[size:]
+            return prefix[:size]
+        return prefix + self._fileobj.read(size - len(prefix))
@@ -0,0 +1,175 @@
+"""
+S3lify metrics
+
+Metrics of the AWS API calls, recorded from the botocore event hooks of the
+clients: calls, errors, retries, latency histogram and bytes transferred,
+by operation, grouped by phase, ie: the CLI command.
+
+    with client.metrics.phase("deploy"):
+        client.s3_sync(build_dir)
+    client.metrics.to_dict()
+"""
+
+import time
+import threading
+import contextlib
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+DEFAULT_PHASE = "default"
+
+_START = "s3lify_metrics_start"
+
+
+class OperationMetrics(object):
+    """
+    Metrics of one API operation, ie: s3.PutObject
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add_latency(self, latency_ms):
+        self.latency_sum += latency_ms
+        self.latency_max = max(self.latency_max, latency_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    def to_dict(self):
+        timed = sum(self.histogram)
+        buckets = ["<=%s" % b for b in LATENCY_BUCKETS_MS] + [">%s" % LATENCY_BUCKETS_MS[-1]]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_ms": {
+                "mean": round(self.latency_sum / timed, 2) if timed else None,
+                "max": round(self.latency_max, 2),
+                "histogram": dict(zip(buckets, self.histogram)),
+            }
+        }
+
+
+class Metrics(object):
+    """
+    Metrics of the AWS API calls of clients, by phase and operation.
+    Thread safe, the calls of all the threads go to the current phase
+    """
+
+    def __init__(self):
+        self._phases = {}
+        self._elapsed = {}
+        self._phase = DEFAULT_PHASE
+        self._phase_start = None
+        self._lock = threading.Lock()
+
+    def register(self, client):
+        """
+        Record the API calls of a client
+        :param client: boto3 client
+        """
+        events = client.meta.events
+        events.register("before-call", self._before_call)
+        events.register("before-send", self._before_send)
+        events.register("after-call", self._after_call)
+        events.register("after-call-error", self._after_call_error)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Group the API calls made in the block under a phase
+        :param name: str - ie: setup, deploy, status
+        """
+        self.start_phase(name)
+        try:
+            yield self
+        finally:
+            self.end_phase()
+
+    def start_phase(self, name):
+        with self._lock:
+            self._phase = name
+            self._phase_start = time.time()
+
+    def end_phase(self):
+        with self._lock:
+            if self._phase_start is not None:
+                elapsed = time.time() - self._phase_start
+                self._elapsed[self._phase] = self._elapsed.get(self._phase, 0) + elapsed
+            self._phase = DEFAULT_PHASE
+            self._phase_start = None
+
+    def _operation(self, event_name):
+        # ie: 'after-call.s3.PutObject' -> 's3.PutObject'
+        operation = event_name.split(".", 1)[1]
+        operations = self._phases.setdefault(self._phase, {})
+        if operation not in operations:
+            operations[operation] = OperationMetrics()
+        return operations[operation]
+
+    def _before_call(self, context=None, **kwargs):
+        if context is not None:
+            context[_START] = time.time()
+
+    def _before_send(self, request, event_name, **kwargs):
+        # Sent once per attempt, with the size of the payload
+        headers = request.headers
+        size = headers.get("X-Amz-Decoded-Content-Length") or headers.get("Content-Length") or 0
+        attempt = headers.get("amz-sdk-request") or b""
+        if isinstance(attempt, bytes):
+            attempt = attempt.decode()
+        with self._lock:
+            op = self._operation(event_name)
+            op.bytes_sent += int(size)
+            if attempt and attempt != "attempt=1":
+                op.retries += 1
+
+    def _after_call(self, http_response, event_name, context=None, **kwargs):
+        size = http_response.headers.get("content-length") or 0
+        with self._lock:
+            op = self._operation(event_name)
+            op.calls += 1
+            op.bytes_received += int(size)
+            if http_response.status_code >= 300:
+                op.errors += 1
+            if context and _START in context:
+                op.add_latency((time.time() - context[_START]) * 1000)
+
+    def _after_call_error(self, event_name, context=None, **kwargs):
+        with self._lock:
+            op = self._operation(event_name)
+            op.calls += 1
+            op.errors += 1
+            if context and _START in context:
+                op.add_latency((time.time() - context[_START]) * 1000)
+
+    def to_dict(self):
+        """
+        Return the metrics, by phase
+        :return: dict - {phase: {elapsed_s, calls, errors, retries, bytes_sent,
+                 bytes_received, operations: {operation: {...}}}}
+        """
+        with self._lock:
+            phases = {}
+            for name in set(self._phases) | set(self._elapsed):
+                operations = dict((k, v.to_dict()) for k, v in
+                                  sorted(self._phases.get(name, {}).items()))
+                phase = {"elapsed_s": round(self._elapsed[name], 3) if name in self._elapsed else None}
+                for k in ["calls", "errors", "retries", "bytes_sent", "bytes_received"]:
+                    phase[k] = sum(op[k] for op in operations.values())
+                phase["operations"] = operations
+                phases[name] = phase
+            return phases
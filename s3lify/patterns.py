@@ -0,0 +1,78 @@
+"""
+S3lify patterns
+
+The path patterns of s3lify.yml: 'ignore_files', 'purge_exclude_files' and
+the 'headers' rules all match the paths of the files in the site directory
+the same way, gitignore style:
+
+- patterns without '/' match the name at any level, ie: '*.html', 'index.html'
+- patterns with a '/' match from the site directory, ie: 'static/*.css'.
+  A leading '/' anchors a name, ie: '/index.html' is only the root one
+- a trailing '/' matches a directory, ie: all the files under 'drafts/'
+- '*' and '?' don't match '/', '**' matches any number of directories
+- '[abc]' and '[!abc]' match a character in, or not in, the set
+
+In 'purge_exclude_files' only, a plain name without '/' or wildcard is
+the file at the root, as it always was, ie: 'index.html' is '/index.html'.
+"""
+
+import re
+
+
+def _translate(pattern):
+    """
+    Return the regex of a pattern, without its anchoring
+    :param pattern: str
+    :return: str
+    """
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "\\" and i < n:
+            out.append(re.escape(pattern[i]))
+            i += 1
+        elif c == "[":
+            # A ']' right after '[' or '[!' is part of the set
+            j = i + 1 if pattern[i:i + 1] == "!" else i
+            j = j + 1 if pattern[j:j + 1] == "]" else j
+            end = pattern.find("]", j)
+            if end < 0:
+                out.append(re.escape(c))
+                continue
+            chars = pattern[i:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            out.append("[%s]" % chars)
+            i = end + 1
+        else:
+            out.append(re.escape(c))
+    return "".join(out)
+
+
+def translate(pattern):
+    """
+    Return the regex of a pattern, matching the whole path of a file
+    :param pattern: str
+    :return: str
+    """
+    name = pattern.rstrip("/")
+    regex = _translate(name.lstrip("/"))
+    if "/" not in name:
+        regex = "(?:.*/)?" + regex
+    if pattern.endswith("/"):
+        regex += "/.*"
+    return regex + r"\Z"
@@ -0,0 +1,58 @@
+"""
+S3lify processes
+
+One process pool for the compression and the image optimization of a
+deploy. Workers are started on the first task, so a deploy where all the
+files are cached starts none, and they are spawned, not forked: the
+upload threads may hold locks a forked worker would inherit held.
+Spawned workers import the main module again, so scripts using S3lify
+with compression or image optimization need the usual
+`if __name__ == "__main__":` guard.
+"""
+
+import threading
+
+
+class ProcessPool(object):
+    """
+    A process pool shared by its users, ie: the Compressor and the
+    ImageOptimizer. Each one uses it as a context manager, the workers
+    are stopped when the last one exits.
+    """
+
+    def __init__(self, workers=None):
+        """
+        :param workers: int - number of processes. Default: number of CPUs
+        """
+        self.workers = workers
+        self._executor = None
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self._users += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._users -= 1
+            executor = None
+            if not self._users:
+                executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run `fn` in a worker process
+        :return: Future
+        """
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            executor = self._executor
+        return executor.submit(fn, *args, **kwargs)
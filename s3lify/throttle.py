@@ -0,0 +1,151 @@
+"""
+S3lify throttle
+
+Adaptive limit of the S3 requests in flight, for uploads, copies and
+deletes. The limit grows by one every `limit` requests that succeed, and is
+halved when S3 pushes back: a SlowDown or 503, a timeout, or a request that
+botocore had to retry. It never goes above the size of the pool of workers.
+Optionally, the bytes sent are paced to a max rate.
+
+    limiter = AdaptiveLimiter(64, initial=10, max_rate=parse_rate("20MB"))
+    limiter.call(s3.put_object, Bucket=bucket, Key=key, Body=body, size=len(body))
+"""
+
+import re
+import time
+import threading
+
+# S3 errors telling to slow down, for a request or a single key
+THROTTLE_ERROR_CODES = ["SlowDown", "Throttling", "ThrottlingException", "RequestTimeout",
+                        "ServiceUnavailable", "RequestLimitExceeded", "TooManyRequests", "503"]
+
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(value):
+    """
+    Return a rate in bytes per second
+    :param value: int, or str with a unit, ie: '500KB', '20MB', '1G/s'
+    :return: int, or None for no limit
+    """
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = re.match(r"^\s*([0-9.]+)\s*([KMG]?)(?:B|iB)?(?:/s)?\s*$", str(value), re.I)
+    if not m:
+        raise Exception("Invalid rate '%s', ie: 500KB, 20MB" % value)
+    return int(float(m.group(1)) * RATE_UNITS[m.group(2).upper()])
+
+
+def is_congestion(response=None, exception=None):
+    """
+    Check if a request was throttled by S3, timed out, or was retried
+    :param response: dict - the response of the request
+    :param exception: the exception raised by the request
+    :return: bool
+    """
+    if exception is not None:
+        response = getattr(exception, "response", None)
+        if not isinstance(response, dict):
+            from botocore import exceptions
+            return isinstance(exception, (exceptions.ReadTimeoutError,
+                                          exceptions.ConnectTimeoutError,
+                                          exceptions.ConnectionClosedError))
+        if response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES:
+            return True
+    response = response or {}
+    # Keys of a batch delete
+    if any(e.get("Code") in THROTTLE_ERROR_CODES for e in response.get("Errors", [])):
+        return True
+    metadata = response.get("ResponseMetadata") or {}
+    return metadata.get("RetryAttempts", 0) > 0 or metadata.get("HTTPStatusCode") == 503
+
+
+class AdaptiveLimiter(object):
+    """
+    Additive increase, multiplicative decrease of the requests in flight.
+    Thread safe, shared by all the workers of a site
+    """
+
+    def __init__(self, max_concurrency, initial=None, min_concurrency=1, max_rate=None):
+        """
+        :param max_concurrency: int - the max requests in flight
+        :param initial: int - the starting limit. Default: max_concurrency
+        :param min_concurrency: int
+        :param max_rate: int - max bytes sent per second. None for no limit
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(min(initial or max_concurrency, max_concurrency))
+        self.max_rate = max_rate
+        self.throttles = 0
+        self._in_flight = 0
+        self._last_cut = 0.0
+        self._send_at = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def concurrency(self):
+        """
+        The current limit of requests in flight
+        :return: int
+        """
+        return int(self.limit)
+
+    def acquire(self, size=0):
+        """
+        Wait for a request to be allowed
+        :param size: int - the bytes the request sends
+        :return: float - the time the request started, for `release`
+        """
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            start = time.time()
+            delay = 0
+            if self.max_rate and size:
+                send_at = max(start, self._send_at)
+                self._send_at = send_at + float(size) / self.max_rate
+                delay = send_at - start
+        if delay > 0:
+            time.sleep(delay)
+        return start
+
+    def release(self, start, congested=False):
+        """
+        Record the outcome of a request
+        :param start: float - returned by `acquire`
+        :param congested: bool - if S3 pushed back on the request
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if congested:
+                self.throttles += 1
+                # Requests already in flight at the last cut do not cut again
+                if start >= self._last_cut:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_cut = time.time()
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, size=0, **kwargs):
+        """
+        Make a request within the limits
+        :param fn: callable - the client method
+        :param size: int - the bytes the request sends
+        :return: the response of fn
+        """
+        start = self.acquire(size)
+        congested = False
+        try:
+            response = fn(*args, **kwargs)
+            congested = is_congestion(response=response)
+            return response
+        except Exception as ex:
+            congested = is_congestion(exception=ex)
+            raise
+        finally:
+            self.release(start, congested)
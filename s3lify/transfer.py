@@ -0,0 +1,359 @@
+"""
+S3lify transfer
+
+One pool of workers for a whole upload run: small files are sent with a
+single PUT, large files are split in parts, and the parts go through the
+same pool as the small files. So the number of requests in flight never
+goes above the pool size, whatever the mix of files.
+Part size and the number of parts in flight for a file scale with its size.
+With a limiter, the requests go through it, ie: to slow down when S3 throttles.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+MB = 1024 * 1024
+
+# Files from this size are uploaded in parts
+MULTIPART_THRESHOLD = 16 * MB
+
+# Smallest part size. S3 requires at least 5MB
+MULTIPART_CHUNKSIZE = 8 * MB
+
+# Target number of parts for big files, and the S3 limit
+MULTIPART_TARGET_PARTS = 1000
+MULTIPART_MAX_PARTS = 10000
+
+# Largest object S3 copies in one request, larger ones are copied in parts
+COPY_MAX_SIZE = 5 * 1024 * MB
+
+# The headers of an object kept by a copy in parts
+COPY_HEADERS = ["CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage",
+                "ContentType", "Expires", "Metadata", "WebsiteRedirectLocation"]
+
+
+def multipart_chunksize(size):
+    """
+    Return the part size to upload a file: 8MB, or the next power of two
+    that keeps the file around 1000 parts
+    :param size: int - the file size
+    :return: int
+    """
+    chunksize = MULTIPART_CHUNKSIZE
+    while chunksize * MULTIPART_TARGET_PARTS < size:
+        chunksize *= 2
+    return max(chunksize, -(-size // MULTIPART_MAX_PARTS))
+
+
+def part_concurrency(size):
+    """
+    Return the max number of parts of a file uploaded at the same time
+    :param size: int - the file size
+    :return: int
+    """
+    if size < 128 * MB:
+        return 2
+    if size < 1024 * MB:
+        return 4
+    return 8
+
+
+def chain(future, fn):
+    """
+    Return a future with the result of `fn` applied to the result of `future`
+    :param future: Future
+    :param fn: callable
+    :return: Future
+    """
+    chained = Future()
+
+    def done(f):
+        try:
+            chained.set_result(fn(f.result()))
+        except Exception as ex:
+            chained.set_exception(ex)
+    future.add_done_callback(done)
+    return chained
+
+
+def gather(futures):
+    """
+    Return a future with the list of the results of `futures`, once they
+    are all done. It fails with the first exception, if any
+    :param futures: list of Future
+    :return: Future
+    """
+    gathered = Future()
+    futures = list(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(f):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            gathered.set_result([f.result() for f in futures])
+        except Exception as ex:
+            gathered.set_exception(ex)
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
+
+
+def _follow(future, target):
+    """
+    Resolve `target` with the outcome of `future`
+    """
+    def done(f):
+        if f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    future.add_done_callback(done)
+
+
+class Transfer(object):
+    """
+    Shared transfer manager of an upload run.
+    To use as a context manager: on exit it waits for all the transfers.
+    """
+
+    def __init__(self, s3, concurrency, multipart_threshold=MULTIPART_THRESHOLD, limiter=None):
+        """
+        :param s3: boto3 S3 client
+        :param concurrency: int - max number of requests in flight
+        :param multipart_threshold: int - size from which files are uploaded in parts
+        :param limiter: AdaptiveLimiter - to make the requests through
+        """
+        self.s3 = s3
+        self.concurrency = concurrency
+        self.multipart_threshold = multipart_threshold
+        self.limiter = limiter
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self
+
+    def __exit__(self, *exc):
+        # Parts are submitted as others complete, wait for all files first
+        while self._pending:
+            wait(list(self._pending))
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _track(self, future):
+        with self._lock:
+            self._pending.add(future)
+
+        def done(f):
+            with self._lock:
+                self._pending.discard(f)
+        future.add_done_callback(done)
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run `fn` in the pool. If `fn` returns a Future, the returned future
+        follows it, so a task can hand over to other tasks without waiting
+        :return: Future
+        """
+        outer = Future()
+
+        def run():
+            try:
+                value = fn(*args, **kwargs)
+            except Exception as ex:
+                outer.set_exception(ex)
+                return
+            if isinstance(value, Future):
+                _follow(value, outer)
+            else:
+                outer.set_result(value)
+        self._executor.submit(run)
+        return outer
+
+    def request(self, fn, size=0, **kwargs):
+        """
+        Make an S3 request, through the limiter
+        :param fn: callable - the client method
+        :param size: int - the bytes the request sends
+        :return: the response
+        """
+        if self.limiter:
+            return self.limiter.call(fn, size=size, **kwargs)
+        return fn(**kwargs)
+
+    def upload(self, local_path, bucket, key, extra_args=None):
+        """
+        Upload a file. Small files are uploaded in the calling thread,
+        large files are split in parts that are uploaded by the pool.
+        :param local_path: str
+        :param bucket: str
+        :param key: str
+        :param extra_args: dict - ie: ContentType
+        :return: Future of int - the number of bytes uploaded
+        """
+        extra_args = extra_args or {}
+        size = os.path.getsize(local_path)
+        if size < self.multipart_threshold:
+            future = Future()
+            try:
+                with open(local_path, "rb") as f:
+                    self.request(self.s3.put_object, size=size,
+                                 Bucket=bucket, Key=key, Body=f, **extra_args)
+                future.set_result(size)
+            except Exception as ex:
+                future.set_exception(ex)
+            return future
+        return self._track(_MultipartUpload(self, local_path, bucket, key, extra_args, size).start())
+
+
+def copy_object(s3, bucket, key, source_key, size=None, request=None):
+    """
+    Copy an object within a bucket, with its headers. Objects over 5GB,
+    that S3 can't copy in one request, are copied in parts
+    :param s3: boto3 S3 client
+    :param bucket: str
+    :param key: str
+    :param source_key: str
+    :param size: int - the size of the object, at most. If None, it is looked up
+    :param request: callable - to make the requests through, ie: limiter.call
+    :return: int - the number of parts, 0 if copied in one request
+    """
+    request = request or (lambda fn, **kwargs: fn(**kwargs))
+    copy_source = {"Bucket": bucket, "Key": source_key}
+    if size is not None and size < COPY_MAX_SIZE:
+        request(s3.copy_object, Bucket=bucket, Key=key, CopySource=copy_source)
+        return 0
+    head = request(s3.head_object, Bucket=bucket, Key=source_key)
+    size = head["ContentLength"]
+    if size < COPY_MAX_SIZE:
+        request(s3.copy_object, Bucket=bucket, Key=key, CopySource=copy_source)
+        return 0
+
+    extra_args = dict((k, head[k]) for k in COPY_HEADERS if head.get(k))
+    upload_id = request(s3.create_multipart_upload, Bucket=bucket, Key=key, **extra_args)["UploadId"]
+    chunksize = multipart_chunksize(size)
+
+    def copy_part(part_number):
+        start = (part_number - 1) * chunksize
+        end = min(start + chunksize, size) - 1
+        resp = request(s3.upload_part_copy, Bucket=bucket, Key=key, UploadId=upload_id,
+                       PartNumber=part_number, CopySource=copy_source,
+                       CopySourceRange="bytes=%s-%s" % (start, end))
+        return {"PartNumber": part_number, "ETag": resp["CopyPartResult"]["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=part_concurrency(size)) as executor:
+            parts = list(executor.map(copy_part, range(1, -(-size // chunksize) + 1)))
+        request(s3.complete_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts})
+    except Exception as ex:
+        try:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise ex
+    return len(parts)
+
+
+class _MultipartUpload(object):
+    """
+    A file uploaded in parts. Parts are submitted as earlier ones complete,
+    up to `part_concurrency` at the same time, so no worker waits on another.
+    """
+
+    def __init__(self, transfer, local_path, bucket, key, extra_args, size):
+        self.transfer = transfer
+        self.local_path = local_path
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args
+        self.size = size
+        self.chunksize = multipart_chunksize(size)
+        self.parts_count = max(1, -(-size // self.chunksize))
+        self.future = Future()
+        self._upload_id = None
+        self._etags = {}
+        self._next_part = 1
+        self._lock = threading.Lock()
+
+    def start(self):
+        s3 = self.transfer.s3
+        try:
+            resp = self.transfer.request(s3.create_multipart_upload,
+                                         Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self._upload_id = resp["UploadId"]
+        except Exception as ex:
+            self.future.set_exception(ex)
+            return self.future
+        for _ in range(min(self.parts_count, part_concurrency(self.size))):
+            self._submit_next()
+        return self.future
+
+    def _submit_next(self):
+        with self._lock:
+            if self._next_part > self.parts_count or self.future.done():
+                return
+            part_number = self._next_part
+            self._next_part += 1
+        self.transfer.submit(self._upload_part, part_number)\
+            .add_done_callback(self._part_done)
+
+    def _upload_part(self, part_number):
+        offset = (part_number - 1) * self.chunksize
+        with open(self.local_path, "rb") as f:
+            f.seek(offset)
+            body = f.read(self.chunksize)
+        resp = self.transfer.request(self.transfer.s3.upload_part,
+                                     size=len(body),
+                                     Bucket=self.bucket,
+                                     Key=self.key,
+                                     UploadId=self._upload_id,
+                                     PartNumber=part_number,
+                                     Body=body)
+        return part_number, resp["ETag"]
+
+    def _part_done(self, f):
+        if self.future.done():
+            return
+        if f.exception() is not None:
+            self._fail(f.exception())
+            return
+        part_number, etag = f.result()
+        with self._lock:
+            self._etags[part_number] = etag
+            complete = len(self._etags) == self.parts_count
+        if not complete:
+            self._submit_next()
+            return
+        try:
+            parts = [{"PartNumber": n, "ETag": self._etags[n]} for n in sorted(self._etags)]
+            self.transfer.request(self.transfer.s3.complete_multipart_upload,
+                                  Bucket=self.bucket,
+                                  Key=self.key,
+                                  UploadId=self._upload_id,
+                                  MultipartUpload={"Parts": parts})
+            self.future.set_result(self.size)
+        except Exception as ex:
+            self._fail(ex)
+
+    def _fail(self, ex):
+        with self._lock:
+            if self.future.done():
+                return
+            self.future.set_exception(ex)
+        try:
+            self.transfer.s3.abort_multipart_upload(Bucket=self.bucket,
+                                                    Key=self.key,
+                                                    UploadId=self._upload_id)
+        except Exception:
+            pass
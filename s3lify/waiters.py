@@ -0,0 +1,63 @@
+"""
+S3lify waiters
+
+Poll AWS resources until they are ready, with exponential backoff and
+jitter, and a deadline. Independent waits can run at the same time.
+"""
+
+import time
+
+# Default deadline of a wait, in seconds
+DEFAULT_TIMEOUT = 1800
+
+DEFAULT_INITIAL_DELAY = 1
+DEFAULT_MAX_DELAY = 30
+
+
+class WaitTimeout(Exception):
+    """
+    A resource was not ready before the deadline
+    """
+
+
+def wait_until(check, timeout=DEFAULT_TIMEOUT, description="resource",
+               initial_delay=DEFAULT_INITIAL_DELAY, max_delay=DEFAULT_MAX_DELAY,
+               factor=2):
+    """
+    Call `check` until it returns a truthy value, and return it.
+    The delay between calls doubles up to `max_delay`, with a full jitter
+    so concurrent waits don't poll in step.
+    :param check: callable - returns a falsy value while not ready. It may raise to stop
+    :param timeout: int - seconds before giving up
+    :param description: str - what is waited for, for the timeout message
+    :param initial_delay: float
+    :param max_delay: float
+    :param factor: float
+    :return: the value of check
+    """
+    import random
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while True:
+        value = check()
+        if value:
+            return value
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise WaitTimeout("Timed out after %ss waiting for %s" % (timeout, description))
+        time.sleep(min(remaining, random.uniform(delay / 2.0, delay)))
+        delay = min(max_delay, delay * factor)
+
+
+def wait_all(waits):
+    """
+    Run waits at the same time, and return their values once all are done
+    :param waits: dict - {name: callable}
+    :return: dict - {name: value}
+    """
+    if not waits:
+        return {}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(waits)) as executor:
+        futures = dict((name, executor.submit(fn)) for name, fn in waits.items())
+    return dict((name, f.result()) for name, f in futures.items())
@@ -0,0 +1,191 @@
+"""
+S3lify walker
+
+Walks the site directory with os.scandir, one directory at a time, and yields
+the files as they are found, so nothing is listed in memory upfront.
+Files and directories can be ignored with gitignore style patterns, from
+s3lify.yml:
+
+    ignore_files:
+      - .DS_Store
+      - .git/
+      - "*.map"
+      - "!vendor/app.js.map"
+
+Ignored directories are not walked at all. The patterns are the ones of
+s3lify.patterns.
+"""
+
+import os
+import re
+import threading
+from .patterns import translate
+
+# Files never uploaded, unless 'ignore_files' is set
+DEFAULT_IGNORE_FILES = [".DS_Store", "Thumbs.db", ".git/", ".svn/", ".hg/"]
+
+# Max number of files found ahead of the upload
+WALK_QUEUE_SIZE = 1000
+
+
+class IgnoreRules(object):
+    """
+    Patterns matched against the paths in the site directory, see
+    s3lify.patterns. Like in a .gitignore:
+    - '#' starts a comment
+    - '!' re-includes what a previous pattern ignored
+    - a trailing '/' only matches directories
+    """
+
+    def __init__(self, patterns=None):
+        """
+        :param patterns: list of str
+        """
+        self.patterns = patterns or []
+        self._rules = []
+        for pattern in self.patterns:
+            pattern = str(pattern).strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            self._rules.append((re.compile(translate(pattern)), negate, dir_only))
+        # The last matching pattern decides
+        self._rules.reverse()
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def match(self, path, is_dir=False):
+        """
+        Check if a path is ignored
+        :param path: str - relative to the site directory, with '/'
+        :param is_dir: bool
+        :return: bool
+        """
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                return not negate
+        return False
+
+    def match_file(self, path):
+        """
+        Check if a file is matched by its path, or by one of its directories,
+        ie: when the directories are not walked
+        :param path: str - relative to the site directory, with '/'
+        :return: bool
+        """
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), is_dir=True):
+                return True
+        return self.match(path)
+
+
+def walk_files(build_dir, ignore=None, follow_symlinks=False, prefix="", on_dir=None):
+    """
+    Yield the files of a directory.
+    Symlinks to files are yielded, to be uploaded with the content of their
+    target, broken ones are skipped. Symlinks to directories are only walked
+    with `follow_symlinks`, and never when they point to one of their
+    parent directories
+    :param build_dir: The directory to walk
+    :param ignore: IgnoreRules - the files and directories to skip
+    :param follow_symlinks: bool - to walk the symlinked directories
+    :param prefix: str - to only walk a sub directory, ie: 'static/'
+    :param on_dir: callable - called with the path and prefix of each directory walked
+    :return: generator of tuple (local_path, s3_path)
+    """
+    path = os.path.join(build_dir, *prefix.split("/")) if prefix else build_dir
+    parents = ()
+    if follow_symlinks:
+        parents = (os.path.realpath(build_dir),)
+        if prefix:
+            parents += (os.path.realpath(path),)
+    # The real paths of the parent directories, to not follow a symlink loop
+    stack = [(prefix, path, parents)]
+    while stack:
+        prefix, path, parents = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        if on_dir:
+            on_dir(path, prefix)
+        with entries:
+            for entry in entries:
+                key = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                    is_file = not is_dir and entry.is_file()
+                except OSError:
+                    continue
+                if is_dir:
+                    if ignore and ignore.match(key, is_dir=True):
+                        continue
+                    real_parents = parents
+                    if follow_symlinks:
+                        real = os.path.realpath(entry.path)
+                        if real in parents:
+                            continue
+                        real_parents = parents + (real,)
+                    elif entry.is_symlink():
+                        continue
+                    stack.append((key + "/", entry.path, real_parents))
+                elif is_file:
+                    if ignore and ignore.match(key):
+                        continue
+                    yield entry.path, key
+
+
+def prefetch(iterable, size=WALK_QUEUE_SIZE):
+    """
+    Iterate in a background thread, up to `size` items ahead of the caller,
+    ie: to walk the directory while the files are uploaded.
+    The thread stops when the caller stops iterating
+    :param iterable:
+    :param size: int - the size of the queue
+    :return: generator
+    """
+    import queue
+    items = queue.Queue(maxsize=size)
+    closed = threading.Event()
+
+    def put(item):
+        while not closed.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for value in iterable:
+                if not put((True, value)):
+                    return
+        except Exception as ex:
+            put((False, ex))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, name="s3lify-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            more, value = items.get()
+            if not more:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        closed.set()
@@ -0,0 +1,282 @@
+"""
+S3lify watch
+
+Watches the site directory, and gives the files that changed or were deleted
+once a burst of changes has settled, ie: after a rebuild.
+On Linux the changes come from inotify, and only the files and directories
+they point to are looked at again. Elsewhere, or when inotify can't be used,
+the directory is walked every `interval` seconds.
+
+    watcher = Watcher("build")
+    watcher.start()
+    for changed, deleted in watcher.batches():
+        ...
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from .walker import walk_files
+
+# Seconds without changes before a batch is given
+DEFAULT_DEBOUNCE = 0.3
+
+# Max seconds a batch waits for the changes to settle
+DEBOUNCE_MAX_DELAY = 2
+
+# Seconds between walks of the directory, when polling
+DEFAULT_POLL_INTERVAL = 1
+
+# inotify events, from sys/inotify.h
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | \
+             IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify(object):
+    """
+    Minimal inotify binding, with ctypes
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_add_watch failed: %s" % os.strerror(err))
+        return wd
+
+    def read(self, timeout):
+        """
+        Return the events, waiting up to `timeout` seconds for some
+        :return: list of tuple (wd, mask, name)
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as ex:
+            if ex.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """
+    Changes of the files of a directory, by batch
+    """
+
+    def __init__(self, directory, ignore=None, follow_symlinks=False,
+                 debounce=DEFAULT_DEBOUNCE, interval=DEFAULT_POLL_INTERVAL, poll=False):
+        """
+        :param directory: str - the site directory
+        :param ignore: IgnoreRules - the files and directories to skip
+        :param follow_symlinks: bool - to watch the symlinked directories
+        :param debounce: float - seconds without changes before a batch is given
+        :param interval: float - seconds between walks when polling. Batches
+                         are given at least this often, empty when nothing changed
+        :param poll: bool - to poll, even if inotify is available
+        """
+        self.directory = directory
+        self.ignore = ignore
+        self.follow_symlinks = follow_symlinks
+        self.debounce = debounce
+        self.interval = interval
+        self.poll = poll or not sys.platform.startswith("linux")
+        # The size and mtime of the files, by key
+        self._files = {}
+        self._inotify = None
+        self._watches = {}
+        self._watch_failed = False
+
+    @property
+    def mode(self):
+        return "polling" if self._inotify is None else "inotify"
+
+    def start(self):
+        """
+        Take the snapshot of the files the changes are compared to
+        """
+        if not self.poll:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError, TypeError):
+                self._inotify = None
+        self._scan(dirs=[""])
+        self._check_watches()
+
+    def stop(self):
+        self._close_inotify()
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watches = {}
+
+    def _watch_dir(self, path, prefix):
+        # A directory already watched keeps its watch descriptor
+        if self._inotify is not None and not self._watch_failed:
+            try:
+                self._watches[self._inotify.add_watch(path)] = prefix
+            except OSError:
+                self._watch_failed = True
+
+    def _check_watches(self):
+        # Over the max number of watches, ie: fs.inotify.max_user_watches,
+        # changes could be missed, the directory is polled instead
+        if self._watch_failed:
+            self._close_inotify()
+
+    def _stat(self, local_path):
+        st = os.stat(local_path)
+        return st.st_size, st.st_mtime_ns
+
+    def _scan(self, files=(), dirs=()):
+        """
+        Compare files, and the files of directories, with the snapshot
+        :param files: keys of files
+        :param dirs: prefixes of directories, '' for the whole directory
+        :return: tuple (set of changed keys, set of deleted keys)
+        """
+        changed = set()
+        deleted = set()
+        dirs = sorted(set(dirs))
+        # Nested directories are walked with their parent
+        dirs = [d for i, d in enumerate(dirs) if not any(d.startswith(p) for p in dirs[:i])]
+        for prefix in dirs:
+            found = {}
+            for local_path, key in walk_files(self.directory,
+                                              ignore=self.ignore,
+                                              follow_symlinks=self.follow_symlinks,
+                                              prefix=prefix,
+                                              on_dir=self._watch_dir):
+                try:
+                    found[key] = self._stat(local_path)
+                except OSError:
+                    pass
+            for key in [k for k in self._files if k.startswith(prefix) and k not in found]:
+                del self._files[key]
+                deleted.add(key)
+            for key, stat in found.items():
+                if self._files.get(key) != stat:
+                    self._files[key] = stat
+                    changed.add(key)
+
+        for key in files:
+            if any(key.startswith(p) for p in dirs):
+                continue
+            local_path = os.path.join(self.directory, *key.split("/"))
+            stat = None
+            if os.path.isfile(local_path) and not (self.ignore and self.ignore.match(key)):
+                try:
+                    stat = self._stat(local_path)
+                except OSError:
+                    pass
+            if stat is None:
+                if self._files.pop(key, None) is not None:
+                    deleted.add(key)
+            elif self._files.get(key) != stat:
+                self._files[key] = stat
+                changed.add(key)
+        return changed, deleted
+
+    def _read_events(self, timeout, files, dirs):
+        """
+        Wait for inotify events, and add the files and directories to look at
+        :return: bool - if there were events
+        """
+        events = self._inotify.read(timeout)
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost
+                dirs.add("")
+                continue
+            prefix = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if prefix is None:
+                continue
+            if mask & IN_DELETE_SELF:
+                dirs.add(prefix)
+            elif mask & IN_ISDIR:
+                if self.ignore and self.ignore.match(prefix + name, is_dir=True):
+                    continue
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    # Its watch goes away with it
+                    for w in [w for w, p in self._watches.items() if p.startswith(prefix + name + "/")]:
+                        self._watches.pop(w)
+                dirs.add(prefix + name + "/")
+            elif name:
+                files.add(prefix + name)
+        return bool(events)
+
+    def batches(self):
+        """
+        Yield the changes, once they have settled for `debounce` seconds,
+        and at least every `interval` seconds
+        :return: generator of tuple (set of changed keys, set of deleted keys)
+        """
+        while True:
+            if self._inotify is None:
+                time.sleep(self.interval)
+                changed, deleted = self._scan(dirs=[""])
+                start = time.time()
+                # Walk again until nothing changes, for a burst to be in one batch
+                while (changed or deleted) and time.time() - start < DEBOUNCE_MAX_DELAY:
+                    time.sleep(self.debounce)
+                    more_changed, more_deleted = self._scan(dirs=[""])
+                    if not more_changed and not more_deleted:
+                        break
+                    changed = (changed - more_deleted) | more_changed
+                    deleted = (deleted - more_changed) | more_deleted
+                yield changed, deleted
+                continue
+
+            files = set()
+            dirs = set()
+            if self._read_events(self.interval, files, dirs):
+                start = time.time()
+                while time.time() - start < DEBOUNCE_MAX_DELAY:
+                    if not self._read_events(self.debounce, files, dirs):
+                        break
+            changes = self._scan(files=files, dirs=dirs)
+            self._check_watches()
+            yield changes
@@ -0,0 +1,60 @@
+import pytest
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """
+    AWS mocked by moto, with fake credentials
+    """
+    moto = pytest.importorskip("moto")
+    for name, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        yield
+
+
+@pytest.fixture
+def s3(aws):
+    import boto3
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="bucket")
+    return client
+
+
+
+def write_files(base, files):
+    """
+    Write files in a directory
+    :param base: pathlib.Path
+    :param files: dict - path: content
+    """
+    for path, content in files.items():
+        path = base.joinpath(*path.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content)
+
+
+@pytest.fixture
+def run_cli(tmp_path, monkeypatch):
+    """
+    Run the command line in tmp_path, with a s3lify.yml of the given content.
+    Return the exit status
+    """
+    from s3lify import cli
+
+    def run(config, *args):
+        tmp_path.joinpath("s3lify.yml").write_text(config)
+        monkeypatch.setattr(cli, "CWD", str(tmp_path))
+        monkeypatch.setattr(cli, "CONFIG_FILE", str(tmp_path / "s3lify.yml"))
+        monkeypatch.setattr(cli, "CACHE_DIR", str(tmp_path / ".s3lify"))
+        monkeypatch.setattr("sys.argv", ["s3lify"] + list(args))
+        try:
+            cli.main()
+        except SystemExit as e:
+            return e.code or 0
+        return 0
+    return run
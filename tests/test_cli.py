@@ -0,0 +1,70 @@
+import threading
+from conftest import write_files
+from s3lify import S3lify
+from s3lify.cli import get_sites, run_sites
+
+SITES_CONFIG = """
+site_directory: site
+deploy_mode: sync
+sites:
+  - domain: a.example.com
+    site_directory: a
+  - domain: b.example.com
+"""
+
+
+def test_get_sites_without_sites():
+    config = {"domain": "example.com", "site_directory": "site"}
+    assert get_sites(config) == [config]
+
+
+def test_get_sites_overrides():
+    config = {"domain": "example.com", "site_directory": "site", "compress": True,
+              "sites": [{"domain": "a.example.com", "site_directory": "a"},
+                        {"domain": "b.example.com", "compress": False}]}
+    assert get_sites(config) == [
+        {"domain": "a.example.com", "site_directory": "a", "compress": True},
+        {"domain": "b.example.com", "site_directory": "site", "compress": False},
+    ]
+    # The top level domain is not a default
+    assert get_sites({"domain": "example.com", "sites": [{"site_directory": "a"}]}) == \
+        [{"site_directory": "a"}]
+
+
+def test_run_sites():
+    def fn(client, site):
+        if site == "b":
+            raise Exception("b failed")
+        return client + site
+    results = run_sites([("1", "a"), ("2", "b"), ("3", "c")], fn, 2)
+    assert [value for value, ex in results] == ["1a", None, "3c"]
+    assert [str(ex) for value, ex in results if ex] == ["b failed"]
+
+
+def test_run_sites_concurrency():
+    lock = threading.Lock()
+    running = []
+    most = []
+
+    def fn(client, site):
+        with lock:
+            running.append(site)
+            most.append(len(running))
+        threading.Event().wait(0.05)
+        with lock:
+            running.remove(site)
+    run_sites([(None, i) for i in range(6)], fn, 2)
+    assert max(most) == 2
+
+
+def test_deploy_sites_with_one_failing(aws, tmp_path, run_cli):
+    # b.example.com is not setup: a.example.com is deployed, the exit status is 1
+    S3lify("a.example.com").s3_create_site()
+    write_files(tmp_path / "a", {"index.html": "a"})
+    write_files(tmp_path / "site", {"index.html": "b"})
+    assert run_cli(SITES_CONFIG, "deploy") == 1
+    assert sorted(S3lify("a.example.com").s3_get_manifest_records()) == ["index.html"]
+
+    S3lify("b.example.com").s3_create_site()
+    assert run_cli(SITES_CONFIG, "deploy") == 0
+    assert sorted(S3lify("b.example.com").s3_get_manifest_records()) == ["index.html"]
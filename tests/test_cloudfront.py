@@ -0,0 +1,83 @@
+import pytest
+from s3lify import S3lify, _make_cloudfront_config
+
+POLICY_ID = "658327ea-f89d-4fab-a63d-7e88639e58f6"
+
+OPTIONS = {
+    "price_class": "PriceClass_All",
+    "default_ttl": 3600,
+    "spa": True,
+    "behaviors": [
+        {"path": "/static/*", "default_ttl": 31536000, "min_ttl": 86400},
+        {"path": "*.html", "default_ttl": 0, "max_ttl": 60},
+    ],
+}
+
+
+def behaviors(config):
+    return dict((b["PathPattern"], b) for b in config["CacheBehaviors"]["Items"])
+
+
+def test_behaviors_take_the_default_ttls():
+    config = _make_cloudfront_config("example.com", "s3", None, options=OPTIONS)
+    static = behaviors(config)["/static/*"]
+    assert (static["MinTTL"], static["DefaultTTL"]) == (86400, 31536000)
+    html = behaviors(config)["*.html"]
+    assert (html["DefaultTTL"], html["MaxTTL"]) == (0, 60)
+
+
+def test_behaviors_with_ttls_dont_take_the_cache_policy():
+    options = dict(OPTIONS, cache_policy_id=POLICY_ID,
+                   behaviors=OPTIONS["behaviors"] + [{"path": "/api/*"}])
+    config = _make_cloudfront_config("example.com", "s3", None, options=options)
+    assert config["DefaultCacheBehavior"]["CachePolicyId"] == POLICY_ID
+    assert "CachePolicyId" not in behaviors(config)["/static/*"]
+    assert behaviors(config)["/static/*"]["DefaultTTL"] == 31536000
+    assert behaviors(config)["/api/*"]["CachePolicyId"] == POLICY_ID
+    assert "DefaultTTL" not in behaviors(config)["/api/*"]
+
+
+def test_spa_error_responses():
+    config = _make_cloudfront_config("example.com", "s3", None, options={"spa": True})
+    responses = config["CustomErrorResponses"]["Items"]
+    assert sorted(r["ErrorCode"] for r in responses) == [403, 404]
+    assert all(r["ResponseCode"] == "200" for r in responses)
+
+
+@pytest.fixture
+def distribution(aws):
+    client = S3lify("example.com")
+    client.s3_create_site()
+    client._acm.request_certificate(DomainName="example.com", ValidationMethod="DNS")
+    client.cloudfront_create_distribution()
+    return client.cloudfront_get_distribution_id()
+
+
+def live_config(client):
+    return client._cloudfront.get_distribution_config(
+        Id=client.cloudfront_get_distribution_id())["DistributionConfig"]
+
+
+def test_update_only_what_changed(distribution):
+    assert S3lify("example.com").cloudfront_update_distribution() == []
+    client = S3lify("example.com", cloudfront_options=OPTIONS)
+    assert sorted(client.cloudfront_update_distribution()) == \
+        ["CacheBehaviors", "CustomErrorResponses", "DefaultCacheBehavior", "PriceClass"]
+    assert client.cloudfront_update_distribution() == []
+    config = live_config(client)
+    assert config["PriceClass"] == "PriceClass_All"
+    assert config["DefaultCacheBehavior"]["DefaultTTL"] == 3600
+    assert behaviors(config)["/static/*"]["DefaultTTL"] == 31536000
+
+
+def test_update_to_a_cache_policy(distribution):
+    client = S3lify("example.com", cloudfront_options=dict(OPTIONS, cache_policy_id=POLICY_ID,
+                                                           behaviors=[]))
+    assert "DefaultCacheBehavior" in client.cloudfront_update_distribution()
+    behavior = live_config(client)["DefaultCacheBehavior"]
+    assert behavior["CachePolicyId"] == POLICY_ID
+    assert client.cloudfront_update_distribution() == []
+
+
+def test_update_without_distribution(aws):
+    assert S3lify("example.com").cloudfront_update_distribution() == []
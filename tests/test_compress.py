@@ -0,0 +1,75 @@
+import os
+import gzip
+import pytest
+from conftest import write_files
+from s3lify import S3lify
+from s3lify.compress import Compressor, is_compressible
+
+FILES = {
+    "index.html": "<html>%s</html>" % ("hello " * 200),
+    # Random data doesn't compress
+    "data.txt": os.urandom(4096),
+    "tiny.css": "a {}",
+    "logo.png": b"\x89PNG" + os.urandom(1000),
+}
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", FILES)
+    return tmp_path / "site"
+
+
+def test_is_compressible():
+    assert is_compressible("text/html")
+    assert is_compressible("application/javascript")
+    assert not is_compressible("image/png")
+
+
+def test_compression():
+    compressor = Compressor("gzip", "/nowhere")
+    assert compressor.compression("text/html", 1000) == "gzip"
+    # Too small, or not compressible
+    assert compressor.compression("text/css", 10) is None
+    assert compressor.compression("image/png", 1000) is None
+
+
+def test_invalid_encoding():
+    with pytest.raises(Exception):
+        Compressor("zip", "/nowhere")
+
+
+def test_sync_compressed(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), compress="gzip")
+    client.s3_create_site()
+    result = client.s3_sync(str(site))
+    assert sorted(result.upload.succeeded) == sorted(FILES)
+
+    obj = client._s3.get_object(Bucket="example.com", Key="index.html")
+    assert obj["ContentEncoding"] == "gzip"
+    assert gzip.decompress(obj["Body"].read()).decode("utf-8") == FILES["index.html"]
+    # Not worth it: uploaded as is
+    assert "ContentEncoding" not in client._s3.get_object(Bucket="example.com", Key="data.txt")
+    records = dict((r["key"], r) for r in client._s3_iter_manifest())
+    assert records["data.txt"]["compressed"] == "gzip"
+    assert records["data.txt"]["content_encoding"] is None
+    assert "compressed" not in records["logo.png"]
+
+
+def test_sync_from_a_new_checkout(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), compress="gzip")
+    client.s3_create_site()
+    client.s3_sync(str(site))
+    # ie: CI, without the cache of the compressed files
+    client = S3lify("example.com", cache_dir=str(tmp_path / "empty"), compress="gzip")
+    result = client.s3_sync(str(site))
+    assert result.upload.succeeded == []
+    assert result.unchanged == len(FILES)
+
+
+def test_sync_compression_turned_off(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), compress="gzip")
+    client.s3_create_site()
+    client.s3_sync(str(site))
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"))
+    assert client.s3_sync(str(site)).upload.succeeded == ["index.html"]
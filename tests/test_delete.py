@@ -0,0 +1,112 @@
+import pytest
+from botocore.exceptions import ClientError
+import s3lify
+from s3lify import _s3_delete_batch
+
+
+class FakeS3(object):
+    """
+    A client whose delete_objects responses are scripted: each one is the
+    codes of the keys failing, by key, or an exception for the request
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [o["Key"] for o in Delete["Objects"]]
+        self.requests.append(keys)
+        response = self.responses.pop(0) if self.responses else {}
+        if isinstance(response, Exception):
+            raise response
+        return {"Errors": [{"Key": k, "Code": code, "Message": code}
+                           for k, code in response.items() if k in keys]}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(s3lify, "S3_RETRY_BASE_DELAY", 0)
+
+
+def test_slow_down_keys_are_retried():
+    s3 = FakeS3({"b": "SlowDown"}, {"b": "SlowDown"})
+    deleted, failed = _s3_delete_batch(s3, "bucket", ["a", "b", "c"])
+    assert sorted(deleted) == ["a", "b", "c"]
+    assert failed == []
+    assert s3.requests == [["a", "b", "c"], ["b"], ["b"]]
+
+
+def test_other_errors_fail_at_once():
+    s3 = FakeS3({"b": "AccessDenied"})
+    deleted, failed = _s3_delete_batch(s3, "bucket", ["a", "b"])
+    assert deleted == ["a"]
+    assert [k for k, _ in failed] == ["b"]
+    assert len(s3.requests) == 1
+
+
+def test_retries_are_limited():
+    s3 = FakeS3(*[{"b": "SlowDown"}] * 10)
+    deleted, failed = _s3_delete_batch(s3, "bucket", ["a", "b"], max_attempts=3)
+    assert deleted == ["a"]
+    assert [k for k, _ in failed] == ["b"]
+    assert len(s3.requests) == 3
+
+
+def test_failed_request_is_retried():
+    error = ClientError({"Error": {"Code": "ServiceUnavailable", "Message": ""}}, "DeleteObjects")
+    s3 = FakeS3(error)
+    deleted, failed = _s3_delete_batch(s3, "bucket", ["a", "b"])
+    assert sorted(deleted) == ["a", "b"]
+    assert len(s3.requests) == 2
+
+
+def test_failed_request_not_retryable():
+    error = ClientError({"Error": {"Code": "AccessDenied", "Message": ""}}, "DeleteObjects")
+    deleted, failed = _s3_delete_batch(FakeS3(error), "bucket", ["a", "b"])
+    assert deleted == []
+    assert [k for k, _ in failed] == ["a", "b"]
+
+
+def test_sync_keeps_the_keys_not_deleted(aws, tmp_path):
+    from conftest import write_files
+    from s3lify import S3lify
+    site = tmp_path / "site"
+    write_files(site, {"index.html": "i", "a.html": "a", "b.html": "b"})
+    client = S3lify("example.com")
+    client.s3_create_site()
+    client.s3_sync(str(site))
+    (site / "a.html").unlink()
+    (site / "b.html").unlink()
+
+    delete_objects = client._s3.delete_objects
+
+    def fail_on_b(Bucket, Delete):
+        Delete = dict(Delete, Objects=[o for o in Delete["Objects"] if o["Key"] != "b.html"])
+        resp = delete_objects(Bucket=Bucket, Delete=Delete)
+        resp["Errors"] = [{"Key": "b.html", "Code": "AccessDenied", "Message": "Access Denied"}]
+        return resp
+    client._s3.delete_objects = fail_on_b
+
+    result = client.s3_sync(str(site))
+    assert result.deleted == ["a.html"]
+    assert [k for k, _ in result.delete.failed] == ["b.html"]
+    assert not result.ok
+    # Still on S3, so still in the manifest, to be deleted by the next sync
+    assert sorted(r["key"] for r in client._s3_iter_manifest()) == ["b.html", "index.html"]
+
+
+def test_deploy_fails_when_files_are_not_deleted(aws, tmp_path, monkeypatch, run_cli):
+    from conftest import write_files
+    from s3lify import S3lify
+    S3lify("example.com").s3_create_site()
+    write_files(tmp_path / "site", {"index.html": "i", "a.html": "a"})
+    config = "domain: example.com\nsite_directory: site\ndeploy_mode: sync\npurge_files: True\n"
+    assert run_cli(config, "deploy") == 0
+
+    (tmp_path / "site" / "a.html").unlink()
+
+    def fail(s3, bucket_name, keys, **kwargs):
+        return [], [(k, Exception("AccessDenied")) for k in keys]
+    monkeypatch.setattr(s3lify, "_s3_delete_batch", fail)
+    assert run_cli(config, "deploy") == 1
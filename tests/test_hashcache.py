@@ -0,0 +1,85 @@
+import os
+import time
+import hashlib
+import pytest
+from s3lify import hashcache
+from s3lify.hashcache import HashCache, file_md5, FILENAME, RACY_WINDOW
+
+
+def write_old(path, content):
+    # Modified before the racy window, to be cached
+    path.write_bytes(content)
+    mtime = time.time() - RACY_WINDOW - 10
+    os.utime(str(path), (mtime, mtime))
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / "site").mkdir()
+    write_old(tmp_path / "site" / "a.html", b"a")
+    return tmp_path / "site"
+
+
+def test_file_md5(tmp_path, monkeypatch):
+    path = tmp_path / "big"
+    content = os.urandom(3000)
+    path.write_bytes(content)
+    # Mapped in memory, by blocks
+    monkeypatch.setattr(hashcache, "HASH_BLOCKSIZE", 1024)
+    assert file_md5(str(path)) == hashlib.md5(content).hexdigest()
+
+
+def test_cache(tmp_path, site):
+    cache = HashCache(str(tmp_path / "cache"))
+    assert cache.md5(str(site / "a.html")) == hashlib.md5(b"a").hexdigest()
+    cache.save()
+    cache = HashCache(str(tmp_path / "cache"))
+    assert cache.md5(str(site / "a.html")) == hashlib.md5(b"a").hexdigest()
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_changed_file(tmp_path, site):
+    cache = HashCache(str(tmp_path / "cache"))
+    cache.md5(str(site / "a.html"))
+    write_old(site / "a.html", b"b")
+    assert cache.md5(str(site / "a.html")) == hashlib.md5(b"b").hexdigest()
+    assert cache.misses == 2
+
+
+def test_racy_files_are_not_cached(tmp_path, site):
+    # Modified within RACY_WINDOW, it could change again with the same mtime
+    (site / "b.html").write_bytes(b"b")
+    cache = HashCache(str(tmp_path / "cache"))
+    cache.md5(str(site / "b.html"))
+    cache.md5(str(site / "b.html"))
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.save()
+    assert not (tmp_path / "cache" / FILENAME).exists()
+
+
+@pytest.mark.parametrize("content", [
+    "{not json",
+    '{"version": 0, "entries": {}}',
+    '{"version": 1, "entries": {"site/a.html": [1, "mtime", "md5"]}}',
+    '{"version": 1}',
+    "[]",
+])
+def test_corrupt_cache_is_empty(tmp_path, site, content):
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / FILENAME).write_text(content)
+    cache = HashCache(str(tmp_path / "cache"))
+    assert cache.md5(str(site / "a.html")) == hashlib.md5(b"a").hexdigest()
+    assert cache.misses == 1
+    # Written again, valid
+    cache.save()
+    assert HashCache(str(tmp_path / "cache"))._load() == cache._entries
+
+
+def test_save_drops_the_deleted_files(tmp_path, site):
+    write_old(site / "b.html", b"b")
+    cache = HashCache(str(tmp_path / "cache"))
+    cache.md5(str(site / "a.html"))
+    cache.md5(str(site / "b.html"))
+    (site / "b.html").unlink()
+    cache.save()
+    assert sorted(HashCache(str(tmp_path / "cache"))._load()) == [os.path.join("site", "a.html")]
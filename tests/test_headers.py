@@ -0,0 +1,36 @@
+import pytest
+from s3lify.headers import HeaderPolicy
+
+RULES = [
+    {"match": "fingerprinted", "cache_control": "public, max-age=31536000, immutable"},
+    {"match": ["*.html", "*.json"], "cache_control": "no-cache"},
+    {"match": "downloads/", "content_disposition": "attachment", "metadata": {"version": 2}},
+]
+
+
+@pytest.mark.parametrize("key, cache_control", [
+    ("static/app.3f2a9c1b.js", "public, max-age=31536000, immutable"),
+    ("assets/index-BQ4Ob2Ea.css", "public, max-age=31536000, immutable"),
+    ("index.html", "no-cache"),
+    ("docs/data.json", "no-cache"),
+    # Not a content hash: no digit
+    ("static/application.js", None),
+])
+def test_first_rule_matching_wins(key, cache_control):
+    assert HeaderPolicy(RULES).headers(key).get("CacheControl") == cache_control
+
+
+def test_header_names_and_metadata():
+    assert HeaderPolicy(RULES).headers("downloads/app.zip") == \
+        {"ContentDisposition": "attachment", "Metadata": {"version": "2"}}
+
+
+def test_no_rules():
+    assert HeaderPolicy().headers("index.html") == {}
+
+
+def test_invalid_rules():
+    with pytest.raises(Exception):
+        HeaderPolicy([{"cache_control": "no-cache"}])
+    with pytest.raises(Exception):
+        HeaderPolicy([{"match": "*.html", "expires": "never"}])
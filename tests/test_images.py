@@ -0,0 +1,130 @@
+import io
+import sys
+import pytest
+from conftest import write_files
+from s3lify import S3lify
+from s3lify.images import ImageOptimizer, DEFAULT_MIN_RATIO, _optimize_image, _make_webp
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_image(format, **options):
+    """
+    Return an image file content
+    :param format: str - ie: PNG, JPEG
+    """
+    im = Image.new("RGB", (64, 64))
+    for x in range(64):
+        for y in range(64):
+            im.putpixel((x, y), (x * 4, y * 4, (x * y) % 256))
+    out = io.BytesIO()
+    im.save(out, format, **options)
+    return out.getvalue()
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", {
+        "index.html": "<html></html>",
+        # Not optimized, will get smaller
+        "img/a.png": make_image("PNG", compress_level=0),
+        "img/b.jpg": make_image("JPEG", quality=90),
+    })
+    return tmp_path / "site"
+
+
+def test_without_pillow(monkeypatch):
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    with pytest.raises(Exception) as ex:
+        ImageOptimizer("/nowhere")
+    assert "Pillow" in str(ex.value)
+
+
+def test_invalid_quality():
+    with pytest.raises(Exception):
+        ImageOptimizer("/nowhere", quality=0)
+    with pytest.raises(Exception):
+        ImageOptimizer("/nowhere", webp_quality=101)
+
+
+def test_variants():
+    optimizer = ImageOptimizer("/nowhere", webp=True)
+    assert optimizer.variants("img/a.png", "image/png") == ["img/a.png.webp"]
+    assert optimizer.variants("img/b.jpg", "image/jpeg") == ["img/b.jpg.webp"]
+    assert optimizer.variants("img/c.gif", "image/gif") == []
+    assert ImageOptimizer("/nowhere").variants("img/a.png", "image/png") == []
+
+
+def test_min_ratio(tmp_path):
+    # An optimized image, with trailing bytes making it up to 5% larger
+    content = make_image("PNG", optimize=True)
+    for padding, optimized in [(len(content) // 100, False), (len(content) // 20, True)]:
+        local_path = tmp_path / ("%s.png" % padding)
+        local_path.write_bytes(content + b"\0" * padding)
+        out_path = tmp_path / ("%s-lossless.png" % padding)
+        result = _optimize_image(str(local_path), str(out_path), "image/png", None, DEFAULT_MIN_RATIO)
+        if optimized:
+            assert result == str(out_path)
+            assert out_path.read_bytes() == content
+        else:
+            # Under 2% smaller: not worth it, remembered with a '.skip' file
+            assert result is None
+            assert (tmp_path / ("%s-lossless.png.skip" % padding)).exists()
+
+
+def test_make_webp(tmp_path):
+    local_path = tmp_path / "a.png"
+    local_path.write_bytes(make_image("PNG"))
+    out_path = _make_webp(str(local_path), str(tmp_path / "a.webp"), 80, True)
+    with Image.open(out_path) as im:
+        assert (im.format, im.size) == ("WEBP", (64, 64))
+
+
+@pytest.fixture
+def client(aws, tmp_path):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), releases=True,
+                    optimize_images={"webp": True})
+    client.s3_create_site()
+    return client
+
+
+def test_sync_with_variants(client, site):
+    result = client.s3_sync(str(site))
+    assert sorted(result.upload.succeeded) == ["img/a.png", "img/b.jpg", "index.html"]
+    # The variants are invalidated with their image
+    assert sorted(result.changed_keys) == ["img/a.png", "img/a.png.webp", "img/b.jpg",
+                                           "img/b.jpg.webp", "index.html"]
+    png = client._s3.get_object(Bucket="example.com", Key="img/a.png")["Body"].read()
+    assert len(png) < len((site / "img" / "a.png").read_bytes())
+    assert client._s3.get_object(Bucket="example.com", Key="img/a.png.webp")["ContentType"] == "image/webp"
+    records = client.s3_get_manifest_records()
+    assert sorted(records) == ["img/a.png", "img/b.jpg", "index.html"]
+    assert records["img/a.png"]["variants"] == ["img/a.png.webp"]
+    assert records["img/a.png"]["optimized"] == "lossless"
+
+    # Unchanged images are not uploaded again
+    assert client.s3_sync(str(site)).upload.succeeded == []
+
+    (site / "img" / "a.png").unlink()
+    result = client.s3_sync(str(site))
+    assert sorted(result.deleted) == ["img/a.png", "img/a.png.webp"]
+    assert sorted(client._s3_iter_keys("img/")) == ["img/b.jpg", "img/b.jpg.webp"]
+
+
+def test_sync_without_variants_anymore(tmp_path, client, site):
+    client.s3_sync(str(site))
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), optimize_images=True)
+    result = client.s3_sync(str(site))
+    assert sorted(result.upload.succeeded) == ["img/a.png", "img/b.jpg"]
+    assert sorted(result.deleted) == ["img/a.png.webp", "img/b.jpg.webp"]
+    assert "variants" not in client.s3_get_manifest_records()["img/a.png"]
+
+
+def test_release_copies_the_variants(client, site):
+    client.release_upload(str(site), release_id="r1")
+    result = client.release_upload(str(site), release_id="r2", base_release="r1")
+    assert result.upload.succeeded == []
+    assert sorted(result.copy.succeeded) == ["img/a.png", "img/b.jpg", "index.html"]
+    prefix = client._release_prefix("r2")
+    assert sorted(k[len(prefix):] for k in client._s3_iter_keys(prefix + "img/")) == \
+        ["img/a.png", "img/a.png.webp", "img/b.jpg", "img/b.jpg.webp"]
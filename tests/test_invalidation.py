@@ -0,0 +1,28 @@
+from s3lify import invalidation_paths
+
+
+def test_keys_are_paths():
+    assert invalidation_paths(["css/app.css", "b c.html"]) == ["/b%20c.html", "/css/app.css"]
+
+
+def test_index_file_invalidates_its_directory():
+    assert invalidation_paths(["index.html", "docs/index.html"]) == \
+        ["/", "/docs/", "/docs/index.html", "/index.html"]
+
+
+def test_deepest_directories_collapse_first():
+    keys = ["a/b/1.js", "a/b/2.js", "a/b/3.js", "c.html"]
+    assert invalidation_paths(keys, max_paths=2) == ["/a/b/*", "/c.html"]
+
+
+def test_collapse_up_to_root():
+    assert invalidation_paths(["a/1", "b/2", "c/3"], max_paths=1) == ["/*"]
+
+
+def test_too_many_wildcards_is_root():
+    keys = ["d%s/%s" % (d, f) for d in range(20) for f in range(2)]
+    assert invalidation_paths(keys, max_paths=20) == ["/*"]
+
+
+def test_no_keys():
+    assert invalidation_paths([]) == []
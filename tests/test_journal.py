@@ -0,0 +1,90 @@
+import json
+from s3lify.journal import Journal
+
+
+def record(key):
+    return {"key": key, "size": 1, "hash": "h-%s" % key}
+
+
+def test_resume(tmp_path):
+    journal = Journal(str(tmp_path), "example.com")
+    journal.start(mode="releases", release_id="r1")
+    journal.add(record("a.html"))
+    journal.add(record("b.html"))
+    journal.close()
+
+    journal = Journal(str(tmp_path), "example.com")
+    assert journal.exists()
+    assert journal.resume()
+    assert journal.info["release_id"] == "r1"
+    assert journal.get("a.html") == record("a.html")
+    # Recording carries on in the same journal
+    journal.add(record("c.html"))
+    journal.close()
+    journal = Journal(str(tmp_path), "example.com")
+    journal.resume()
+    assert sorted(journal.records) == ["a.html", "b.html", "c.html"]
+
+
+def test_resume_ignores_a_cut_line(tmp_path):
+    journal = Journal(str(tmp_path), "example.com")
+    journal.start(mode="sync")
+    journal.add(record("a.html"))
+    journal.close()
+    with open(journal.path, "a") as f:
+        f.write(json.dumps(record("b.html"))[:10])
+
+    journal = Journal(str(tmp_path), "example.com")
+    assert journal.resume()
+    assert list(journal.records) == ["a.html"]
+    journal.add(record("c.html"))
+    journal.close()
+    journal.resume()
+    assert sorted(journal.records) == ["a.html", "c.html"]
+
+
+def test_resume_without_journal(tmp_path):
+    journal = Journal(str(tmp_path), "example.com")
+    assert not journal.exists()
+    assert not journal.resume()
+
+
+def test_inactive_journal_records_nothing(tmp_path):
+    journal = Journal(str(tmp_path), "example.com")
+    journal.add(record("a.html"))
+    assert journal.get("a.html") is None
+    assert not journal.exists()
+
+
+def test_discard(tmp_path):
+    journal = Journal(str(tmp_path), "example.com")
+    journal.start(mode="sync")
+    journal.add(record("a.html"))
+    journal.discard()
+    assert not journal.exists()
+    assert journal.get("a.html") is None
+
+
+def test_sync_resume(aws, tmp_path):
+    from conftest import write_files
+    from s3lify import S3lify
+    site = tmp_path / "site"
+    write_files(site, {"index.html": "<html></html>", "css/app.css": "body {}"})
+    cache_dir = str(tmp_path / "cache")
+    client = S3lify("example.com", cache_dir=cache_dir)
+    client.s3_create_site()
+    client.journal.start(mode="sync")
+    client.s3_sync(str(site))
+    # Interrupted before the journal is discarded
+    client.journal.close()
+
+    client = S3lify("example.com", cache_dir=cache_dir)
+    assert client.journal.resume()
+    write_files(site, {"index.html": "<html>changed</html>"})
+    result = client.s3_sync(str(site))
+    assert result.upload.resumed == 1
+    assert sorted(result.upload.succeeded) == ["css/app.css", "index.html"]
+    # Only the file changed since is uploaded
+    assert result.upload.bytes == len("<html>changed</html>")
+    assert client._s3.get_object(Bucket="example.com", Key="index.html")["Body"].read() == \
+        b"<html>changed</html>"
@@ -0,0 +1,98 @@
+import time
+import pytest
+from s3lify import S3lify, lookupcache
+from s3lify.lookupcache import LookupCache, FILENAME
+
+
+class Clock(object):
+    """
+    The time module, with a clock moved by the test
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lookupcache, "time", clock)
+    return clock
+
+
+def lookups(*values):
+    """
+    A lookup giving `values` one after the other, with the number of calls
+    """
+    def lookup():
+        lookup.calls += 1
+        return values[lookup.calls - 1]
+    lookup.calls = 0
+    return lookup
+
+
+def test_session_cache():
+    cache = LookupCache("ns")
+    lookup = lookups("arn:1", "arn:2")
+    assert cache.get("certificate", lookup) == "arn:1"
+    assert cache.get("certificate", lookup) == "arn:1"
+    assert lookup.calls == 1
+    cache.invalidate("certificate")
+    assert cache.get("certificate", lookup) == "arn:2"
+
+
+def test_missing_is_not_cached(tmp_path):
+    cache = LookupCache("ns", cache_dir=str(tmp_path), ttl=60)
+    lookup = lookups(None, "arn:1")
+    assert cache.get("certificate", lookup) is None
+    assert cache.get("certificate", lookup) == "arn:1"
+    assert lookup.calls == 2
+
+
+def test_disk_cache_ttl(tmp_path, clock):
+    LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lambda: "arn:1")
+    # A later run, within the TTL
+    clock.now += 59
+    lookup = lookups("arn:2", "arn:3")
+    assert LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lookup) == "arn:1"
+    assert lookup.calls == 0
+    # Expired
+    clock.now += 2
+    assert LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lookup) == "arn:2"
+    assert LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lookup) == "arn:2"
+    assert lookup.calls == 1
+
+
+def test_disk_cache_disabled(tmp_path):
+    LookupCache("ns", cache_dir=str(tmp_path)).get("certificate", lambda: "arn:1")
+    LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("zone", lambda: "Z1", persist=False)
+    assert not (tmp_path / FILENAME).exists()
+
+
+def test_disk_cache_invalidate(tmp_path):
+    LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lambda: "arn:1")
+    LookupCache("ns", cache_dir=str(tmp_path), ttl=60).invalidate("certificate")
+    assert LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lambda: "arn:2") == "arn:2"
+
+
+def test_corrupt_disk_cache(tmp_path):
+    (tmp_path / FILENAME).write_text("{not json")
+    cache = LookupCache("ns", cache_dir=str(tmp_path), ttl=60)
+    assert cache.get("certificate", lambda: "arn:1") == "arn:1"
+    assert LookupCache("ns", cache_dir=str(tmp_path), ttl=60).get("certificate", lambda: "arn:2") == "arn:1"
+
+
+def test_disk_cache_scoped_by_credentials(tmp_path):
+    def client(key, region="us-east-1", domain="example.com"):
+        return S3lify(domain, aws_access_key_id=key, aws_secret_access_key="secret", region=region,
+                      cache_dir=str(tmp_path), lookup_cache_ttl=60)
+    client("AKIA1")._lookup_cache.get("cloudfront_distribution", lambda: "D1")
+    # Another account, region or domain doesn't see it
+    assert client("AKIA2")._lookup_cache.get("cloudfront_distribution", lambda: "D2") == "D2"
+    assert client("AKIA1", region="eu-west-1")._lookup_cache.get("cloudfront_distribution", lambda: "D3") == "D3"
+    assert client("AKIA1", domain="example.org")._lookup_cache.get("cloudfront_distribution", lambda: "D4") == "D4"
+    assert client("AKIA1")._lookup_cache.get("cloudfront_distribution", lambda: "D5") == "D1"
+    assert client("AKIA2")._lookup_cache.get("cloudfront_distribution", lambda: "D6") == "D2"
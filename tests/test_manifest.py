@@ -0,0 +1,62 @@
+import io
+import gzip
+import json
+import pytest
+from s3lify import manifest
+
+
+def test_round_trip():
+    records = [
+        manifest.record("index.html", size=12, hash="abc", content_type="text/html",
+                        content_encoding="gzip", headers={"CacheControl": "no-cache"},
+                        uploaded_at=1700000000),
+        manifest.record("img/logo.png", size=34, hash="def", content_type="image/png",
+                        optimized="lossless", variants=["img/logo.png.webp"]),
+    ]
+    data = manifest.dumps(records)
+    assert data[:2] == manifest.GZIP_MAGIC
+    assert list(manifest.iter_records(io.BytesIO(data))) == records
+
+
+def test_keys_only_records():
+    data = manifest.dumps(["a.html", "b.html"])
+    assert [r["key"] for r in manifest.iter_records(io.BytesIO(data))] == ["a.html", "b.html"]
+
+
+def test_images_only_fields():
+    record = manifest.record("index.html")
+    assert "optimized" not in record and "variants" not in record
+
+
+def test_read_version_1():
+    records = list(manifest.iter_records(io.BytesIO(b"index.html,css/app.css,")))
+    assert records == [manifest.record("index.html"), manifest.record("css/app.css")]
+
+
+def test_read_empty():
+    assert list(manifest.iter_records(io.BytesIO(b""))) == []
+
+
+def test_read_unknown_version():
+    data = gzip.compress(json.dumps({"s3lify_manifest": 99}).encode("utf-8") + b"\n")
+    with pytest.raises(ValueError):
+        list(manifest.iter_records(io.BytesIO(data)))
+
+
+class ChunkedReader(object):
+    """
+    A stream returning less than asked, like S3 bodies
+    """
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._data.read()
+        return self._data.read(min(size, 3))
+
+
+def test_read_from_stream():
+    records = [manifest.record("page-%s.html" % i, size=i, hash="h%s" % i) for i in range(100)]
+    assert list(manifest.iter_records(ChunkedReader(manifest.dumps(records)))) == records
@@ -0,0 +1,105 @@
+import json
+import pytest
+from botocore.awsrequest import AWSResponse
+from conftest import write_files
+from s3lify import S3lify
+from s3lify.clients import ClientPool
+
+FILES = {
+    "index.html": "<html></html>",
+    "error.html": "<html>error</html>",
+    "css/app.css": "body {}",
+}
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", FILES)
+    return tmp_path / "site"
+
+
+@pytest.fixture
+def client(aws, tmp_path):
+    return S3lify("example.com", cache_dir=str(tmp_path / "cache"), clients=ClientPool())
+
+
+class SlowDown(object):
+    """
+    A before-send handler answering 503 SlowDown to the first `count`
+    attempts, before moto sees them
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def __call__(self, request, **kwargs):
+        if self.count:
+            self.count -= 1
+            body = b"<Error><Code>SlowDown</Code><Message>Slow down</Message></Error>"
+            return AWSResponse(request.url, 503, {}, RawBody(body))
+
+
+class RawBody(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+def test_calls_by_phase(client, site):
+    metrics = client._clients.metrics
+    with metrics.phase("setup"):
+        client.s3_create_site()
+    with metrics.phase("deploy"):
+        client.s3_sync(str(site))
+    phases = metrics.to_dict()
+    # The bucket, and the www one redirecting to it
+    assert phases["setup"]["operations"]["s3.CreateBucket"]["calls"] == 2
+    assert "s3.PutObject" not in phases["setup"]["operations"]
+
+    deploy = phases["deploy"]
+    put = deploy["operations"]["s3.PutObject"]
+    assert put["calls"] == len(FILES) + 1
+    assert put["bytes_sent"] >= sum(len(content) for content in FILES.values())
+    assert (put["errors"], put["retries"]) == (0, 0)
+    assert sum(put["latency_ms"]["histogram"].values()) == put["calls"]
+    # The totals of the phase are the sums of its operations
+    assert deploy["calls"] == sum(op["calls"] for op in deploy["operations"].values())
+    assert deploy["elapsed_s"] is not None
+
+    with metrics.phase("status"):
+        client.s3_get_manifest_records()
+    get = metrics.to_dict()["status"]["operations"]["s3.GetObject"]
+    assert get["calls"] == 1 and get["bytes_received"] > 0
+
+
+def test_retries_and_errors(client, monkeypatch):
+    # No backoff between the attempts
+    monkeypatch.setattr("botocore.retryhandler.random", type("Random", (), {"random": staticmethod(lambda: 0)}))
+    client.s3_create_site()
+    client._s3.meta.events.register_first("before-send.s3.PutObject", SlowDown(2))
+    metrics = client._clients.metrics
+    with metrics.phase("test"):
+        client._s3.put_object(Bucket="example.com", Key="a.html", Body=b"a")
+        client._s3.put_object(Bucket="example.com", Key="b.html", Body=b"b")
+        with pytest.raises(Exception):
+            client._s3.head_object(Bucket="example.com", Key="c.html")
+    operations = metrics.to_dict()["test"]["operations"]
+    # Retried calls are counted once, with their retries
+    assert (operations["s3.PutObject"]["calls"], operations["s3.PutObject"]["retries"]) == (2, 2)
+    assert operations["s3.PutObject"]["errors"] == 0
+    assert (operations["s3.HeadObject"]["calls"], operations["s3.HeadObject"]["errors"]) == (1, 1)
+
+
+def test_metrics_file(aws, tmp_path, site, run_cli):
+    S3lify("example.com").s3_create_site()
+    config = "domain: example.com\nsite_directory: site\ndeploy_mode: sync\n"
+    path = tmp_path / "metrics.json"
+    assert run_cli(config, "--metrics", str(path), "deploy") == 0
+    phases = json.loads(path.read_text())
+    assert list(phases) == ["deploy"]
+    put = phases["deploy"]["operations"]["s3.PutObject"]
+    assert put["calls"] == len(FILES) + 1
+    assert phases["deploy"]["calls"] >= put["calls"]
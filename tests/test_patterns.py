@@ -0,0 +1,85 @@
+import re
+import pytest
+from s3lify import exclude_matcher
+from s3lify.patterns import translate
+from s3lify.walker import IgnoreRules, walk_files
+
+
+@pytest.mark.parametrize("pattern, path, matched", [
+    ("*.html", "index.html", True),
+    ("*.html", "docs/index.html", True),
+    ("*.html", "index.htm", False),
+    ("/index.html", "index.html", True),
+    ("/index.html", "docs/index.html", False),
+    ("static/*.css", "static/app.css", True),
+    ("static/*.css", "static/css/app.css", False),
+    ("static/*.css", "docs/static/app.css", False),
+    ("static/**/*.css", "static/css/app.css", True),
+    ("static/**/*.css", "static/app.css", True),
+    ("drafts/", "drafts/a/b.html", True),
+    ("drafts/", "drafts", False),
+    ("?.js", "a.js", True),
+    ("?.js", "ab.js", False),
+    ("[ab].js", "b.js", True),
+    ("[!ab].js", "b.js", False),
+    ("[!ab].js", "c.js", True),
+])
+def test_translate(pattern, path, matched):
+    assert bool(re.match(translate(pattern), path)) is matched
+
+
+def test_ignore_rules():
+    rules = IgnoreRules(["# comment", "*.map", "!vendor/app.js.map", ".git/", ""])
+    assert rules.match("app.js.map")
+    assert not rules.match("vendor/app.js.map")
+    assert rules.match(".git", is_dir=True)
+    # A trailing '/' only matches directories
+    assert not rules.match(".git")
+    assert not rules.match("index.html")
+
+
+def test_ignore_rules_last_pattern_wins():
+    rules = IgnoreRules(["!*.map", "*.map"])
+    assert rules.match("app.js.map")
+
+
+def test_ignore_rules_match_file_by_directory():
+    rules = IgnoreRules(["drafts/"])
+    assert rules.match_file("drafts/2020/post.html")
+    assert not rules.match_file("posts/drafts.html")
+
+
+def test_no_rules():
+    assert not IgnoreRules()
+    assert not IgnoreRules(["# only a comment"])
+
+
+def test_exclude_matcher():
+    is_excluded = exclude_matcher(["/index.html", "static/"])
+    assert is_excluded("index.html")
+    assert is_excluded("static/app.css")
+    assert not is_excluded("docs/index.html")
+    assert not exclude_matcher([])("index.html")
+
+
+def test_exclude_matcher_plain_names_are_at_the_root():
+    # The purge_exclude_files of configs from before the path patterns
+    is_excluded = exclude_matcher(["index.html", "error.html"])
+    assert is_excluded("index.html")
+    assert not is_excluded("docs/index.html")
+    assert not is_excluded("docs/error.html")
+    # Patterns keep matching at any level
+    assert exclude_matcher(["*.html"])("docs/index.html")
+    assert exclude_matcher(["**/index.html"])("docs/index.html")
+
+
+def test_walk_files_skips_ignored_directories(tmp_path):
+    for path in ["index.html", "app.js.map", ".git/HEAD", "vendor/app.js.map"]:
+        path = tmp_path.joinpath(*path.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x")
+    walked = []
+    rules = IgnoreRules(["*.map", "!vendor/app.js.map", ".git/"])
+    files = walk_files(str(tmp_path), ignore=rules, on_dir=lambda path, prefix: walked.append(prefix))
+    assert sorted(s3_path for _, s3_path in files) == ["index.html", "vendor/app.js.map"]
+    assert ".git/" not in walked
@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import pytest
+from conftest import write_files
+from s3lify import S3lify, make_release_id, _make_releases_function_code
+from s3lify import cli, transfer
+from s3lify.transfer import MB, copy_object
+
+FILES = {
+    "index.html": "<html>v1</html>",
+    "error.html": "<html>error</html>",
+    "css/app.css": "body {}",
+}
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", FILES)
+    return tmp_path / "site"
+
+
+@pytest.fixture
+def client(aws, tmp_path):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), releases=True)
+    client.s3_create_site()
+    return client
+
+
+@pytest.fixture
+def distribution(client):
+    """
+    A distribution of the site. moto has no publish_function, it is faked
+    with the function as created
+    """
+    def publish_function(Name, IfMatch):
+        return client._cloudfront.describe_function(Name=Name)
+    client._cloudfront.publish_function = publish_function
+    client._acm.request_certificate(DomainName="example.com", ValidationMethod="DNS")
+    client.cloudfront_create_distribution()
+    return client.cloudfront_get_distribution_id()
+
+
+def keys(client, prefix=""):
+    return sorted(client._s3_iter_keys(prefix))
+
+
+def test_release_ids_are_unique_and_sorted():
+    ids = [make_release_id() for _ in range(100)]
+    assert len(set(ids)) == len(ids)
+    assert sorted(ids) == ids
+
+
+def test_upload_copies_the_unchanged_files(client, site):
+    first = client.release_upload(str(site), release_id="r1")
+    assert sorted(first.upload.succeeded) == sorted(FILES)
+    write_files(site, {"index.html": "<html>v2</html>"})
+    second = client.release_upload(str(site), release_id="r2", base_release="r1")
+    assert second.upload.succeeded == ["index.html"]
+    assert sorted(second.copy.succeeded) == ["css/app.css", "error.html"]
+    assert client.release_list() == ["r1", "r2"]
+    assert keys(client, ".s3lify-releases/r2/") == sorted(
+        ".s3lify-releases/r2/" + k for k in list(FILES) + [".s3lify.manifest"])
+
+
+def test_releases_prefix_is_reserved(client, site):
+    write_files(site, {".s3lify-releases/notes.html": "notes"})
+    with pytest.raises(Exception):
+        client.release_upload(str(site))
+
+
+def test_releases_prefix_is_only_reserved_with_releases(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"))
+    client.s3_create_site()
+    write_files(site, {"releases/notes.html": "notes", ".s3lify-releases/a.html": "a"})
+    client.s3_sync(str(site))
+    client._s3.put_object(Bucket="example.com", Key="releases/old.html", Body=b"old")
+    client._s3.delete_object(Bucket="example.com", Key=".s3lify.manifest")
+    # Listed, not taken for releases
+    result = client.s3_sync(str(site))
+    assert result.deleted == ["releases/old.html"]
+
+
+def test_custom_releases_prefix(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), releases=True,
+                    releases_prefix="/_deploys/")
+    client.s3_create_site()
+    client.release_upload(str(site), release_id="r1")
+    assert client.release_list() == ["r1"]
+    assert "_deploys/r1/index.html" in keys(client)
+
+
+def test_prune(client, site):
+    for release_id in ["r1", "r2", "r3"]:
+        client.release_upload(str(site), release_id=release_id)
+    pruned, deletion = client.release_prune(keep=1, protect=["r1"])
+    assert pruned == ["r2"]
+    assert client.release_list() == ["r1", "r3"]
+
+
+def test_activate(client, site, distribution):
+    client.release_upload(str(site), release_id="r1")
+    client.release_upload(str(site), release_id="r2", base_release="r1")
+    assert client.release_activate("r1")
+    assert client.release_get_live() == "r1"
+    assert client.release_activate("r2")
+    assert client.release_get_live() == "r2"
+    assert not client.release_activate("r2")
+    website = client._s3.get_bucket_website(Bucket="example.com")
+    assert website["ErrorDocument"]["Key"] == ".s3lify-releases/r2/error.html"
+    with pytest.raises(Exception):
+        client.release_activate("r3")
+
+
+def test_releases_function(client, distribution):
+    arn = client.cloudfront_get_releases_function()
+    assert arn.endswith(":function/s3lify-releases-example-com")
+    code = client._cloudfront.get_function(Name="s3lify-releases-example-com")["FunctionCode"].read()
+    assert code == _make_releases_function_code(".s3lify-releases/")
+
+
+@pytest.mark.parametrize("location, expected", [
+    ("/.s3lify-releases/20260101-000000-000001/docs/", "/docs/"),
+    ("https://example.com/.s3lify-releases/r1/docs/", "/docs/"),
+    ("/docs/", "/docs/"),
+    ("/.s3lify-releasesX/r1/docs/", "/.s3lify-releasesX/r1/docs/"),
+])
+def test_releases_function_redirects(location, expected):
+    code = _make_releases_function_code(".s3lify-releases/").decode("utf-8")
+    # The javascript regex is also a python one
+    regex = re.search(r"\.replace\(/(.*)/, \"/\"\)", code).group(1)
+    assert re.sub(regex, "/", location, count=1) == expected
+
+
+def test_copy_in_parts(s3, monkeypatch):
+    body = os.urandom(10 * MB)
+    s3.put_object(Bucket="bucket", Key="a", Body=body, ContentType="video/mp4",
+                  CacheControl="max-age=60", Metadata={"version": "1"})
+    assert copy_object(s3, "bucket", "b", "a", size=len(body)) == 0
+    # As if the object was over 5GB
+    monkeypatch.setattr(transfer, "COPY_MAX_SIZE", MB)
+    assert copy_object(s3, "bucket", "c", "a") == 2
+    head = s3.head_object(Bucket="bucket", Key="c")
+    assert (head["ContentType"], head["CacheControl"], head["Metadata"]) == \
+        ("video/mp4", "max-age=60", {"version": "1"})
+    assert s3.get_object(Bucket="bucket", Key="c")["Body"].read() == body
+
+
+RELEASES_CONFIG = "domain: example.com\naws_region: us-east-1\nsite_directory: site\ndistribution: cloudfront\nreleases: True\n"
+
+
+@pytest.fixture
+def cli_releases(aws, monkeypatch, site):
+    """
+    A site with releases r1 and r2, r2 live. moto has no publish_function,
+    the releases function ARN is made up
+    """
+    monkeypatch.setattr(S3lify, "cloudfront_get_releases_function",
+                        lambda self: "arn:aws:cloudfront::123456789012:function/releases")
+    client = S3lify("example.com", releases=True)
+    client.s3_create_site()
+    client._acm.request_certificate(DomainName="example.com", ValidationMethod="DNS")
+    client.cloudfront_create_distribution()
+    client.release_upload(str(site), release_id="r1")
+    client.release_upload(str(site), release_id="r2")
+    client.release_activate("r2")
+    return client
+
+
+def test_rollback(cli_releases, run_cli):
+    assert run_cli(RELEASES_CONFIG, "rollback") == 0
+    assert cli_releases.release_get_live() == "r1"
+    assert run_cli(RELEASES_CONFIG, "rollback", "r2") == 0
+    assert cli_releases.release_get_live() == "r2"
+
+
+def test_rollback_to_an_unknown_release(cli_releases, run_cli, monkeypatch, capsys):
+    # Halo's default stream is the sys.stdout it was imported with
+    from halo import Halo
+    monkeypatch.setattr(cli.Spinner, "_halo", Halo(stream=sys.stdout))
+    assert run_cli(RELEASES_CONFIG, "rollback", "r9") == 1
+    assert "Release 'r9' doesn't exist" in capsys.readouterr().out
+    assert cli_releases.release_get_live() == "r2"
+
+
+def test_rollback_without_releases(cli_releases, run_cli):
+    assert run_cli(RELEASES_CONFIG.replace("releases: True", "releases: False"), "rollback") == 1
@@ -0,0 +1,133 @@
+import pytest
+from conftest import write_files
+from s3lify import S3lify, MANIFEST_FILE
+from s3lify.clients import ClientPool
+
+FILES = {
+    "index.html": "<html></html>",
+    "error.html": "<html>error</html>",
+    "css/app.css": "body {}",
+    "js/app.js": "var a = 1;",
+}
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", FILES)
+    return tmp_path / "site"
+
+
+@pytest.fixture
+def client(aws, tmp_path):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"), clients=ClientPool())
+    client.s3_create_site()
+    return client
+
+
+def keys(client):
+    return sorted(client._s3_iter_keys(""))
+
+
+def operations(client, fn):
+    """
+    Return the number of calls of each AWS operation made by fn
+    """
+    with client._clients.metrics.phase("test"):
+        fn()
+    phase = client._clients.metrics.to_dict()["test"]
+    return dict((name, op["calls"]) for name, op in phase["operations"].items())
+
+
+def test_first_sync_uploads_everything(client, site):
+    result = client.s3_sync(str(site))
+    assert sorted(result.upload.succeeded) == sorted(FILES)
+    assert keys(client) == sorted(list(FILES) + [MANIFEST_FILE])
+    assert client._s3.get_object(Bucket="example.com", Key="css/app.css")["ContentType"] == "text/css"
+
+
+def test_sync_uploads_and_deletes_the_changes(client, site):
+    client.s3_sync(str(site))
+    write_files(site, {"css/app.css": "body { color: red }", "new.html": "new"})
+    (site / "js" / "app.js").unlink()
+    result = client.s3_sync(str(site))
+    assert sorted(result.upload.succeeded) == ["css/app.css", "new.html"]
+    assert result.deleted == ["js/app.js"]
+    assert result.unchanged == 2
+    assert sorted(result.changed_keys) == ["css/app.css", "js/app.js", "new.html"]
+    assert "js/app.js" not in keys(client)
+
+
+def test_sync_keeps_the_excluded_files(client, site):
+    client.s3_sync(str(site))
+    (site / "error.html").unlink()
+    (site / "js" / "app.js").unlink()
+    result = client.s3_sync(str(site))
+    assert result.deleted == ["js/app.js"]
+    assert "error.html" in keys(client)
+
+
+def test_sync_without_delete(client, site):
+    client.s3_sync(str(site))
+    (site / "js" / "app.js").unlink()
+    assert client.s3_sync(str(site), delete=False).deleted == []
+    assert "js/app.js" in keys(client)
+
+
+def test_sync_that_changes_nothing_only_reads_the_manifest(client, site):
+    client.s3_sync(str(site))
+    calls = operations(client, lambda: client.s3_sync(str(site)))
+    assert calls == {"s3.GetObject": 1}
+
+
+def test_sync_without_manifest_lists_the_bucket(client, site):
+    client.s3_sync(str(site))
+    client._s3.delete_object(Bucket="example.com", Key=MANIFEST_FILE)
+    result = client.s3_sync(str(site))
+    assert result.upload.succeeded == []
+    assert result.unchanged == len(FILES)
+    # The manifest is written back
+    assert MANIFEST_FILE in keys(client)
+
+
+def test_sync_of_changed_headers(aws, tmp_path, site):
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"))
+    client.s3_create_site()
+    client.s3_sync(str(site))
+    client = S3lify("example.com", cache_dir=str(tmp_path / "cache"),
+                    headers=[{"match": "*.css", "cache_control": "max-age=60"}])
+    assert client.s3_sync(str(site)).upload.succeeded == ["css/app.css"]
+    assert client._s3.get_object(Bucket="example.com", Key="css/app.css")["CacheControl"] == "max-age=60"
+
+
+def test_sync_with_legacy_exclude_files(client, site):
+    write_files(site, {"docs/index.html": "docs"})
+    client.s3_sync(str(site))
+    (site / "index.html").unlink()
+    (site / "docs" / "index.html").unlink()
+    result = client.s3_sync(str(site), exclude_files=["index.html", "error.html"])
+    # Only the root index.html is kept
+    assert result.deleted == ["docs/index.html"]
+    assert "index.html" in keys(client)
+
+
+def test_push(client, site):
+    client.s3_sync(str(site))
+    write_files(site, {"css/app.css": "body { color: red }"})
+    (site / "js" / "app.js").unlink()
+    result = client.s3_push(str(site), ["css/app.css", "js/app.js", "index.html"])
+    assert (result.upload.succeeded, result.deleted, result.unchanged) == (["css/app.css"], ["js/app.js"], 1)
+    assert sorted(client.s3_get_manifest_records()) == ["css/app.css", "error.html", "index.html"]
+
+
+def test_push_with_the_records_kept(client, site):
+    # ie: by `s3lify watch`, the manifest is only written
+    client.s3_sync(str(site))
+    records = client.s3_get_manifest_records()
+    write_files(site, {"new.html": "new"})
+    calls = operations(client, lambda: client.s3_push(str(site), ["new.html"], records=records))
+    assert calls == {"s3.PutObject": 2}
+    (site / "new.html").unlink()
+    calls = operations(client, lambda: client.s3_push(str(site), ["new.html"], records=records))
+    assert "s3.GetObject" not in calls and calls["s3.DeleteObjects"] == 1
+    assert records == client.s3_get_manifest_records()
+    assert "new.html" not in records
@@ -0,0 +1,78 @@
+import pytest
+from botocore.exceptions import ClientError
+from s3lify.throttle import AdaptiveLimiter, is_congestion, parse_rate
+
+
+def slow_down():
+    return ClientError({"Error": {"Code": "SlowDown", "Message": "Slow down"}}, "PutObject")
+
+
+def test_additive_increase():
+    limiter = AdaptiveLimiter(8, initial=2)
+    # About one more every `limit` requests that succeed
+    for _ in range(3):
+        limiter.release(limiter.acquire())
+    assert limiter.concurrency == 3
+    for _ in range(500):
+        limiter.release(limiter.acquire())
+    assert limiter.concurrency == 8
+
+
+def test_multiplicative_decrease():
+    limiter = AdaptiveLimiter(64, initial=40)
+    limiter.release(limiter.acquire(), congested=True)
+    assert limiter.concurrency == 20
+    assert limiter.throttles == 1
+
+
+def test_one_cut_per_burst():
+    limiter = AdaptiveLimiter(64, initial=40)
+    starts = [limiter.acquire() for _ in range(3)]
+    # Requests in flight at the cut were sent at the old limit
+    for start in starts:
+        limiter.release(start, congested=True)
+    assert limiter.concurrency == 20
+    assert limiter.throttles == 3
+    limiter.release(limiter.acquire(), congested=True)
+    assert limiter.concurrency == 10
+
+
+def test_min_concurrency():
+    limiter = AdaptiveLimiter(4, initial=1)
+    limiter.release(limiter.acquire(), congested=True)
+    assert limiter.concurrency == 1
+
+
+def test_call_on_throttle():
+    limiter = AdaptiveLimiter(16)
+
+    def put_object():
+        raise slow_down()
+    with pytest.raises(ClientError):
+        limiter.call(put_object)
+    assert limiter.concurrency == 8
+    assert limiter.call(lambda **kwargs: kwargs, Key="a") == {"Key": "a"}
+
+
+def test_is_congestion():
+    assert is_congestion(exception=slow_down())
+    assert not is_congestion(exception=ValueError())
+    assert is_congestion(response={"ResponseMetadata": {"RetryAttempts": 2}})
+    assert is_congestion(response={"Errors": [{"Code": "SlowDown", "Key": "a"}]})
+    assert not is_congestion(response={"ResponseMetadata": {"HTTPStatusCode": 200}})
+
+
+@pytest.mark.parametrize("value, rate", [
+    (None, None),
+    (1000, 1000),
+    ("500KB", 500 * 1024),
+    ("20MB", 20 * 1024 ** 2),
+    ("1G/s", 1024 ** 3),
+])
+def test_parse_rate(value, rate):
+    assert parse_rate(value) == rate
+
+
+def test_parse_invalid_rate():
+    with pytest.raises(Exception):
+        parse_rate("fast")
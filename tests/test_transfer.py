@@ -0,0 +1,37 @@
+import os
+from s3lify import file_multipart_etag
+from s3lify.transfer import MB, Transfer, multipart_chunksize
+
+
+def test_multipart_chunksize():
+    assert multipart_chunksize(1) == 8 * MB
+    assert multipart_chunksize(8 * MB * 1000) == 8 * MB
+    assert multipart_chunksize(8 * MB * 1000 + 1) == 16 * MB
+    # Never more than 10000 parts
+    size = 5 * 1024 * 1024 * MB
+    assert -(-size // multipart_chunksize(size)) <= 10000
+
+
+def test_file_multipart_etag(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"a" * 10 + b"b" * 10)
+    import hashlib
+    parts = [hashlib.md5(b"a" * 10).digest(), hashlib.md5(b"b" * 10).digest()]
+    assert file_multipart_etag(str(path), chunksize=10) == \
+        "%s-2" % hashlib.md5(b"".join(parts)).hexdigest()
+
+
+def test_upload(s3, tmp_path):
+    small = tmp_path / "small"
+    small.write_bytes(b"x" * 100)
+    large = tmp_path / "large"
+    large.write_bytes(os.urandom(17 * MB))
+    with Transfer(s3, 4, multipart_threshold=16 * MB) as t:
+        futures = [t.upload(str(small), "bucket", "small", {"ContentType": "text/plain"}),
+                   t.upload(str(large), "bucket", "large")]
+    assert [f.result() for f in futures] == [100, 17 * MB]
+    assert s3.head_object(Bucket="bucket", Key="small")["ContentType"] == "text/plain"
+    # The ETag of a file uploaded in parts can be computed locally
+    assert s3.head_object(Bucket="bucket", Key="large")["ETag"].strip('"') == \
+        file_multipart_etag(str(large))
+
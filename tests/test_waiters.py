@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+from s3lify import waiters
+from s3lify.waiters import wait_until, wait_all, WaitTimeout
+
+
+class Clock(object):
+    """
+    The time module, with a clock that only moves on sleep
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(waiters, "time", clock)
+    return clock
+
+
+def checks(*values):
+    values = list(values)
+    return lambda: values.pop(0)
+
+
+def test_wait_until(clock):
+    assert wait_until(checks(None, False, "Deployed")) == "Deployed"
+    assert len(clock.sleeps) == 2
+
+
+def test_backoff(clock):
+    wait_until(checks(*[None] * 8 + [True]), initial_delay=1, max_delay=10)
+    # Doubled up to max_delay, with a jitter of up to half the delay
+    for sleep, delay in zip(clock.sleeps, [1, 2, 4, 8, 10, 10, 10, 10]):
+        assert delay / 2.0 <= sleep <= delay
+
+
+def test_timeout(clock):
+    start = clock.now
+    with pytest.raises(WaitTimeout) as ex:
+        wait_until(lambda: None, timeout=60, description="the certificate")
+    assert "the certificate" in str(ex.value)
+    # The last sleep stops at the deadline
+    assert clock.now == pytest.approx(start + 60)
+
+
+def test_check_raises(clock):
+    def check():
+        raise Exception("Distribution disabled")
+    with pytest.raises(Exception) as ex:
+        wait_until(check)
+    assert str(ex.value) == "Distribution disabled"
+    assert clock.sleeps == []
+
+
+def test_wait_all():
+    assert wait_all({}) == {}
+    # Together: each one waits for the other to start
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait(value):
+        barrier.wait()
+        return value
+    assert wait_all({"certificate": lambda: wait("ISSUED"),
+                     "distribution": lambda: wait("Deployed")}) == \
+        {"certificate": "ISSUED", "distribution": "Deployed"}
+
+
+def test_wait_all_with_a_timeout():
+    def timeout():
+        raise WaitTimeout("Timed out")
+    done = []
+
+    def other():
+        time.sleep(0.05)
+        done.append(True)
+        return True
+    with pytest.raises(WaitTimeout):
+        wait_all({"certificate": timeout, "distribution": other})
+    # The other waits are not left running
+    assert done == [True]
@@ -0,0 +1,191 @@
+import sys
+import time
+import pytest
+from conftest import write_files
+from s3lify import watch
+from s3lify.walker import IgnoreRules
+from s3lify.watch import Watcher, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_TO, IN_ISDIR, \
+    IN_DELETE_SELF, IN_Q_OVERFLOW, IN_IGNORED
+
+FILES = {
+    "index.html": "<html></html>",
+    "css/app.css": "body {}",
+    "js/app.js": "var a = 1;",
+}
+
+
+@pytest.fixture
+def site(tmp_path):
+    write_files(tmp_path / "site", FILES)
+    return tmp_path / "site"
+
+
+class FakeInotify(object):
+    """
+    Scripted inotify: each read gives the next list of events
+    """
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.timeouts = []
+        self.wd = 0
+
+    def add_watch(self, path):
+        self.wd += 1
+        return self.wd
+
+    def read(self, timeout):
+        self.timeouts.append(timeout)
+        return self.reads.pop(0) if self.reads else []
+
+    def close(self):
+        pass
+
+
+class FakeTime(object):
+    """
+    The time module, with some functions replaced
+    """
+
+    def __init__(self, **functions):
+        self.__dict__.update(functions)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def fake_watcher(site, monkeypatch, reads, **kwargs):
+    monkeypatch.setattr(watch, "_Inotify", lambda: FakeInotify(reads))
+    watcher = Watcher(str(site), **kwargs)
+    watcher.start()
+    return watcher
+
+
+def wd(watcher, prefix):
+    return [w for w, p in watcher._watches.items() if p == prefix][0]
+
+
+def test_events_to_keys(site, monkeypatch):
+    watcher = fake_watcher(site, monkeypatch, [])
+    assert watcher.mode == "inotify"
+    assert sorted(watcher._watches.values()) == ["", "css/", "js/"]
+    write_files(site, {"css/app.css": "body { color: red }", "css/new.css": "a {}"})
+    (site / "js" / "app.js").unlink()
+    watcher._inotify.reads = [[(wd(watcher, "css/"), IN_CLOSE_WRITE, "app.css"),
+                               (wd(watcher, "css/"), IN_MOVED_TO, "new.css"),
+                               (wd(watcher, "js/"), IN_DELETE, "app.js")]]
+    assert next(watcher.batches()) == ({"css/app.css", "css/new.css"}, {"js/app.js"})
+
+
+def test_events_of_directories(site, monkeypatch):
+    watcher = fake_watcher(site, monkeypatch, [])
+    write_files(site, {"img/a.png": "a", "img/b/c.png": "c"})
+    js = wd(watcher, "js/")
+    (site / "js" / "app.js").unlink()
+    (site / "js").rmdir()
+    watcher._inotify.reads = [[(wd(watcher, ""), IN_CREATE | IN_ISDIR, "img"),
+                               (js, IN_DELETE_SELF, ""),
+                               (js, IN_IGNORED, "")]]
+    assert next(watcher.batches()) == ({"img/a.png", "img/b/c.png"}, {"js/app.js"})
+    assert "img/" in watcher._watches.values() and js not in watcher._watches
+
+
+def test_events_of_ignored_or_unchanged_files(site, monkeypatch):
+    watcher = fake_watcher(site, monkeypatch, [], ignore=IgnoreRules(["*.tmp", "drafts/"]))
+    write_files(site, {"a.tmp": "a", "drafts/b.html": "b"})
+    root = wd(watcher, "")
+    watcher._inotify.reads = [[(root, IN_CLOSE_WRITE, "a.tmp"),
+                               (root, IN_CREATE | IN_ISDIR, "drafts"),
+                               (root, IN_CLOSE_WRITE, "index.html")]]
+    assert next(watcher.batches()) == (set(), set())
+
+
+def test_events_overflow(site, monkeypatch):
+    watcher = fake_watcher(site, monkeypatch, [])
+    write_files(site, {"css/app.css": "body { color: red }"})
+    watcher._inotify.reads = [[(-1, IN_Q_OVERFLOW, "")]]
+    assert next(watcher.batches()) == ({"css/app.css"}, set())
+
+
+def test_debounce(site, monkeypatch):
+    # A burst of changes is given in one batch, once there was no event for `debounce`
+    watcher = fake_watcher(site, monkeypatch, [], debounce=0.2, interval=5)
+    write_files(site, {"a.html": "a", "b.html": "b"})
+    root = wd(watcher, "")
+    watcher._inotify.reads = [[(root, IN_CLOSE_WRITE, "a.html")],
+                              [(root, IN_CLOSE_WRITE, "b.html")],
+                              [],
+                              [(root, IN_CLOSE_WRITE, "index.html")]]
+    assert next(watcher.batches()) == ({"a.html", "b.html"}, set())
+    assert watcher._inotify.timeouts == [5, 0.2, 0.2]
+
+
+def test_debounce_max_delay(site, monkeypatch):
+    # Changes that never settle are given after DEBOUNCE_MAX_DELAY
+    watcher = fake_watcher(site, monkeypatch, [], debounce=0.2)
+    root = wd(watcher, "")
+    events = [[(root, IN_CLOSE_WRITE, "index.html")]] * 100
+    watcher._inotify.reads = list(events)
+    # A second goes by on each look at the clock
+    clock = iter(range(100))
+    monkeypatch.setattr(watch, "time", FakeTime(time=lambda: next(clock)))
+    assert next(watcher.batches()) == (set(), set())
+    assert watcher._inotify.timeouts == [watch.DEFAULT_POLL_INTERVAL] + [0.2] * (watch.DEBOUNCE_MAX_DELAY - 1)
+
+
+def test_polling(site, monkeypatch):
+    # The directory is walked again after each sleep, until nothing changes
+    watcher = Watcher(str(site), poll=True, debounce=0.2, interval=5)
+    watcher.start()
+    assert watcher.mode == "polling"
+    changes = [lambda: write_files(site, {"a.html": "a", "css/app.css": "body { color: red }"}),
+               lambda: (site / "a.html").unlink(),
+               lambda: write_files(site, {"b.html": "b"}),
+               lambda: None]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        changes.pop(0)()
+
+    monkeypatch.setattr(watch, "time", FakeTime(sleep=sleep))
+    assert next(watcher.batches()) == ({"b.html", "css/app.css"}, {"a.html"})
+    assert sleeps == [5, 0.2, 0.2, 0.2]
+    monkeypatch.setattr(watch, "time", FakeTime(sleep=lambda seconds: None))
+    assert next(watcher.batches()) == (set(), set())
+
+
+def test_polling_without_inotify(site, monkeypatch):
+    def no_inotify():
+        raise OSError(24, "Too many open files")
+    monkeypatch.setattr(watch, "_Inotify", no_inotify)
+    watcher = Watcher(str(site))
+    watcher.start()
+    assert watcher.mode == "polling"
+
+
+def test_polling_over_the_max_watches(site, monkeypatch):
+    # A directory that can't be watched would be missed, all are polled
+    class LimitedInotify(FakeInotify):
+        def add_watch(self, path):
+            if self.wd == 2:
+                raise OSError(28, "No space left on device")
+            return FakeInotify.add_watch(self, path)
+    monkeypatch.setattr(watch, "_Inotify", lambda: LimitedInotify([]))
+    watcher = Watcher(str(site))
+    watcher.start()
+    assert watcher.mode == "polling"
+    assert sorted(watcher._files) == sorted(FILES)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only on Linux")
+def test_inotify(site):
+    watcher = Watcher(str(site), debounce=0.1, interval=1)
+    watcher.start()
+    try:
+        assert watcher.mode == "inotify"
+        write_files(site, {"css/app.css": "body { color: red }", "img/a.png": "a"})
+        (site / "js" / "app.js").unlink()
+        assert next(watcher.batches()) == ({"css/app.css", "img/a.png"}, {"js/app.js"})
+    finally:
+        watcher.stop()